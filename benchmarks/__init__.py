@@ -0,0 +1,50 @@
+"""
+Benchmarks of the hot paths, run them all with
+
+    python -m benchmarks --output results.json
+
+Every benchmark reports throughput and the percentiles of its per batch (or
+per request) timings, saved as JSON to compare releases.
+"""
+import statistics
+import time
+from typing import Callable, Dict, List
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    res = {}
+    for p in PERCENTILES:
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        res["p%d" % p] = ordered[index]
+    return res
+
+
+def summarize(samples: List[float], ops_per_sample: int) -> Dict[str, float]:
+    """samples are seconds per batch of ops_per_sample operations"""
+    total = sum(samples)
+    res = {
+        "ops": ops_per_sample * len(samples),
+        "ops_per_sec": ops_per_sample * len(samples) / total if total else 0.0,
+        "mean_us": statistics.mean(samples) / ops_per_sample * 1e6,
+    }
+    for name, value in percentiles(samples).items():
+        res[name + "_us"] = value / ops_per_sample * 1e6
+    return res
+
+
+def measure(fn: Callable[[], None], batch: int, rounds: int) -> Dict[str, float]:
+    """Time rounds of batch calls to fn"""
+    for _ in range(batch):
+        fn()
+
+    samples = []
+    timer = time.perf_counter
+    for _ in range(rounds):
+        start = timer()
+        for _ in range(batch):
+            fn()
+        samples.append(timer() - start)
+    return summarize(samples, batch)
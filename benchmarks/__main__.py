@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import sys
+import time
+
+from benchmarks import (
+    bench_codec,
+    bench_dispatch,
+    bench_end_to_end,
+    bench_inbound,
+    bench_parser,
+)
+import zigpy_cc
+
+BENCHMARKS = {
+    "parser": bench_parser.run,
+    "codec": bench_codec.run,
+    "dispatch": bench_dispatch.run,
+    "inbound": bench_inbound.run,
+    "end_to_end": bench_end_to_end.run,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "names", nargs="*", help="one of %s, default: all" % ", ".join(BENCHMARKS)
+    )
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--output", "-o", help="write the results as JSON")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark '%s'" % name)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    results = {
+        "version": zigpy_cc.__version__,
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "rounds": args.rounds,
+        "results": {},
+    }
+    for name in args.names or BENCHMARKS:
+        print("running", name, file=sys.stderr)
+        results["results"][name] = BENCHMARKS[name](args.rounds)
+    loop.close()
+
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+    return results
+
+
+if __name__ == "__main__":
+    main()
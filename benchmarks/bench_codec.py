@@ -0,0 +1,16 @@
+from benchmarks import measure
+from benchmarks.fixtures import frames
+from zigpy_cc.zpi_object import ZpiObject
+
+BATCH = 1000
+
+
+def run(rounds: int):
+    res = {}
+    for name, frame in frames().items():
+        obj = ZpiObject.from_unpi_frame(frame)
+        res[name] = {
+            "decode": measure(lambda: ZpiObject.from_unpi_frame(frame), BATCH, rounds),
+            "encode": measure(obj.to_unpi_frame, BATCH, rounds),
+        }
+    return res
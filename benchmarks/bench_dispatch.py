@@ -0,0 +1,32 @@
+from benchmarks import measure
+from benchmarks.fixtures import frames
+from zigpy_cc import config
+from zigpy_cc.api import API
+from zigpy_cc.types import CommandType, Subsystem
+
+WAITERS = (0, 100, 1000)
+BATCH = 1000
+
+DEVICE_CONFIG = config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: "/dev/null"})
+
+
+def run(rounds: int):
+    """API.data_received of a dataConfirm nobody waits for, behind N waiters"""
+    frame = frames()["af_confirm"]
+    res = {}
+    for count in WAITERS:
+        api = API(DEVICE_CONFIG)
+        for i in range(count):
+            api.wait_for(
+                CommandType.AREQ,
+                Subsystem.AF,
+                "dataConfirm",
+                {"transid": 1000 + i},
+                timeout=3600000,
+            )
+        res["waiters_%d" % count] = measure(
+            lambda: api.data_received(frame), BATCH, rounds
+        )
+        if api._waiters._timer is not None:
+            api._waiters._timer.cancel()
+    return res
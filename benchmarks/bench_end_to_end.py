@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import zigpy.device
+from zigpy.zcl.clusters.general import OnOff
+
+from benchmarks import summarize
+from zigpy_cc import config, uart
+from zigpy_cc.emulator import Emulator
+from zigpy_cc.zigbee.application import ControllerApplication
+
+APP_CONFIG = {
+    config.CONF_DEVICE: {config.CONF_DEVICE_PATH: "/dev/null"},
+    config.CONF_DATABASE: None,
+}
+
+CONCURRENCY = 16
+
+
+async def _start(emulator: Emulator) -> ControllerApplication:
+    app = ControllerApplication(APP_CONFIG)
+    connect = uart.connect
+    uart.connect = emulator.connect
+    try:
+        await app.startup(auto_form=True)
+    finally:
+        uart.connect = connect
+
+    for virtual in emulator.devices.values():
+        device = app.add_device(virtual.ieee, virtual.nwk)
+        endpoint = device.add_endpoint(virtual.endpoint)
+        endpoint.profile_id = virtual.profile
+        for cluster_id in virtual.in_clusters:
+            endpoint.add_input_cluster(cluster_id)
+        device.status = zigpy.device.Status.ENDPOINTS_INIT
+    return app
+
+
+async def _round_trip(cluster, samples):
+    start = time.perf_counter()
+    await cluster.read_attributes([0], allow_cache=False)
+    samples.append(time.perf_counter() - start)
+
+
+async def _run(requests: int, devices: int, latency: float):
+    emulator = Emulator(devices=devices, latency=latency, buffers=CONCURRENCY * 2)
+    app = await _start(emulator)
+    clusters = [
+        app.get_device(ieee=virtual.ieee)
+        .endpoints[virtual.endpoint]
+        .in_clusters[OnOff.cluster_id]
+        for virtual in emulator.devices.values()
+    ]
+
+    res = {}
+    samples = []
+    for i in range(requests):
+        await _round_trip(clusters[i % len(clusters)], samples)
+    res["sequential"] = summarize(samples, 1)
+
+    samples = []
+    pending = set()
+    start = time.perf_counter()
+    for i in range(requests):
+        if len(pending) >= CONCURRENCY:
+            _, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+        pending.add(
+            asyncio.ensure_future(_round_trip(clusters[i % len(clusters)], samples))
+        )
+    await asyncio.wait(pending)
+    elapsed = time.perf_counter() - start
+    res["concurrent"] = summarize(samples, 1)
+    res["concurrent"]["ops_per_sec"] = requests / elapsed
+    res["concurrent"]["concurrency"] = CONCURRENCY
+
+    await app.shutdown()
+    return res
+
+
+def run(rounds: int, devices: int = 8, latency: float = 0.0):
+    """ControllerApplication request/reply round trips against the emulator"""
+    requests = rounds * 20
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_run(requests, devices, latency))
@@ -0,0 +1,46 @@
+import zigpy.types
+
+from benchmarks import measure
+from benchmarks.fixtures import frames
+from zigpy_cc import config
+from zigpy_cc.types import CommandType, Subsystem
+import zigpy_cc.zigbee.application as application
+
+BATCH = 1000
+
+APP_CONFIG = {
+    config.CONF_DEVICE: {config.CONF_DEVICE_PATH: "/dev/null"},
+    config.CONF_DATABASE: None,
+}
+
+
+def run(rounds: int):
+    """
+    Attribute reports from API.data_received up to the application's
+    handle_message, over the incomingMsg fast path and the generic one
+    """
+    frame = frames()["af_incoming"]
+    app = application.ControllerApplication(APP_CONFIG)
+    app._api = application.API(APP_CONFIG[config.CONF_DEVICE])
+    app._api.set_application(app)
+    app.add_device(zigpy.types.EUI64(bytes(range(8))), 0x1001)
+    app.handle_message = lambda *args: None
+    api = app._api
+
+    res = {"fast": measure(lambda: api.data_received(frame), BATCH, rounds)}
+
+    # a waiter for incomingMsg sends the reports down the generic path
+    waiter = api.wait_for(
+        CommandType.AREQ,
+        Subsystem.AF,
+        "incomingMsg",
+        {"srcaddr": 0xFFFE},
+        timeout=3600000,
+    )
+    res["generic"] = measure(lambda: api.data_received(frame), BATCH, rounds)
+    api._waiters.pop(waiter.id)
+    if api._waiters._timer is not None:
+        api._waiters._timer.cancel()
+
+    res["speedup"] = res["fast"]["ops_per_sec"] / res["generic"]["ops_per_sec"]
+    return res
@@ -0,0 +1,26 @@
+from benchmarks import measure
+from benchmarks.fixtures import stream
+from zigpy_cc import uart
+
+FRAMES = 1000
+CHUNK = 64
+
+
+def run(rounds: int):
+    data = stream(FRAMES)
+    chunks = [data[i : i + CHUNK] for i in range(0, len(data), CHUNK)]
+    parser = uart.Parser()
+
+    def parse_chunked():
+        for chunk in chunks:
+            parser.write(chunk)
+
+    def parse_whole():
+        parser.write(data)
+
+    res = {}
+    for name, fn in (("chunked", parse_chunked), ("whole", parse_whole)):
+        stats = measure(fn, 1, rounds)
+        stats["frames_per_sec"] = stats.pop("ops_per_sec") * FRAMES
+        res[name] = stats
+    return res
@@ -0,0 +1,73 @@
+"""Fixed inputs shared by the benchmarks"""
+from zigpy_cc.types import Subsystem
+from zigpy_cc.zpi_object import ZpiObject
+
+ZCL_REPORT = b"\x18\x2a\x0a\x00\x00\x10\x01"
+
+
+def frames():
+    """One frame of each command family, as received from the adapter"""
+    objs = {
+        "af_incoming": ZpiObject.from_command(
+            Subsystem.AF,
+            "incomingMsg",
+            {
+                "groupid": 0,
+                "clusterid": 6,
+                "srcaddr": 0x1001,
+                "srcendpoint": 1,
+                "dstendpoint": 1,
+                "wasbroadcast": 0,
+                "linkquality": 120,
+                "securityuse": 0,
+                "timestamp": 123456,
+                "transseqnumber": 0,
+                "len": len(ZCL_REPORT),
+                "data": ZCL_REPORT,
+            },
+        ),
+        "af_confirm": ZpiObject.from_command(
+            Subsystem.AF, "dataConfirm", {"status": 0, "endpoint": 1, "transid": 42}
+        ),
+        "zdo_node_desc": ZpiObject.from_command(
+            Subsystem.ZDO,
+            "nodeDescRsp",
+            {
+                "srcaddr": 0x1001,
+                "status": 0,
+                "nwkaddr": 0x1001,
+                "logicaltype_cmplxdescavai_userdescavai": 1,
+                "apsflags_freqband": 0x40,
+                "maccapflags": 0x8E,
+                "manufacturercode": 0x1234,
+                "maxbuffersize": 80,
+                "maxintransfersize": 160,
+                "servermask": 0x2C00,
+                "maxouttransfersize": 160,
+                "descriptorcap": 0,
+            },
+        ),
+        "zdo_active_ep": ZpiObject.from_command(
+            Subsystem.ZDO,
+            "activeEpRsp",
+            {
+                "srcaddr": 0x1001,
+                "status": 0,
+                "nwkaddr": 0x1001,
+                "activeepcount": 2,
+                "activeeplist": [1, 2],
+            },
+        ),
+        "sys_nv_write": ZpiObject.from_command(
+            Subsystem.SYS,
+            "osalNvWrite",
+            {"id": 0x60, "offset": 0, "len": 16, "value": bytes(range(16))},
+        ),
+    }
+    return {name: obj.to_unpi_frame() for name, obj in objs.items()}
+
+
+def stream(count: int) -> bytes:
+    """count frames cycling through every family, as one byte stream"""
+    data = [f.to_buffer() for f in frames().values()]
+    return b"".join(data[i % len(data)] for i in range(count))
@@ -21,7 +21,7 @@ setup(
     author="Balazs Sandor",
     author_email="sanyatuning@gmail.com",
     license="GPL-3.0",
-    packages=find_packages(exclude=["*.tests"]),
+    packages=find_packages(exclude=["*.tests", "benchmarks"]),
     install_requires=["pyserial-asyncio", "zigpy>=0.20.a1"],
     tests_require=["asynctest", "pytest", "pytest-asyncio"],
 )
@@ -0,0 +1,162 @@
+import csv
+import json
+from unittest import mock
+
+import pytest
+
+from zigpy_cc import analysis, registry, uart
+from zigpy_cc.capture import CaptureWriter, Direction
+from zigpy_cc.emulator import _payload
+from zigpy_cc.types import AddressMode, CommandType, Subsystem
+
+MS = 1000000
+
+
+def frame(command_type, subsystem, command, **values):
+    cmd = registry.get_command(subsystem, command)
+    parameters = cmd.response if command_type == CommandType.SRSP else cmd.request
+    data = cmd.codec(command_type).encode(_payload(parameters, **values))
+    return uart.UnpiFrame(command_type, subsystem, cmd.id, data)
+
+
+@pytest.fixture
+def path(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    records = [
+        (0, Direction.TX, frame(CommandType.SREQ, Subsystem.SYS, "version")),
+        (2, Direction.RX, frame(CommandType.SRSP, Subsystem.SYS, "version")),
+        (
+            3,
+            Direction.TX,
+            frame(CommandType.SREQ, Subsystem.AF, "dataRequest", transid=5),
+        ),
+        (4, Direction.RX, frame(CommandType.SRSP, Subsystem.AF, "dataRequest")),
+        (
+            13,
+            Direction.RX,
+            frame(CommandType.AREQ, Subsystem.AF, "dataConfirm", transid=5),
+        ),
+        (
+            20,
+            Direction.RX,
+            frame(CommandType.AREQ, Subsystem.AF, "incomingMsg", srcaddr=0x1234),
+        ),
+        # unknown command
+        (30, Direction.RX, uart.UnpiFrame(CommandType.AREQ, Subsystem.AF, 0x7F, b"")),
+        (
+            60020,
+            Direction.RX,
+            frame(CommandType.AREQ, Subsystem.AF, "incomingMsg", srcaddr=0x1234),
+        ),
+        # never answered
+        (60030, Direction.TX, frame(CommandType.SREQ, Subsystem.SYS, "ping")),
+    ]
+    write_capture(path, records)
+    return path
+
+
+def write_capture(path, records):
+    writer = CaptureWriter(path)
+    with mock.patch("zigpy_cc.capture.time.monotonic_ns") as monotonic_ns:
+        monotonic_ns.side_effect = [ms * MS for ms, _, _ in records]
+        for _, direction, f in records:
+            writer.write_frame(direction, f)
+    writer.close()
+
+
+def check(summary):
+    assert summary["frames"] == 9
+    assert summary["undecodable"] == 1
+    assert summary["unanswered"] == 1
+    assert summary["commands"]["RX AREQ AF incomingMsg"] == 2
+    assert summary["commands"]["TX SREQ SYS version"] == 1
+
+    assert summary["latency"]["sreq"]["version"]["p50_ms"] == 2
+    assert summary["latency"]["data_request"]["dataRequest"] == {
+        "count": 1,
+        "p50_ms": 10,
+        "p90_ms": 10,
+        "p99_ms": 10,
+        "max_ms": 10,
+    }
+    assert summary["devices"] == {"0x1234": {"messages": 2, "per_minute": 2.0}}
+    assert summary["pairs"]["latency_ns"] == [2 * MS, 10 * MS]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 40, analysis.DEFAULT_CHUNK_SIZE])
+def test_analyse_in_process(path, chunk_size):
+    check(analysis.analyse(path, workers=0, chunk_size=chunk_size))
+
+
+def test_analyse_pool(path):
+    check(analysis.analyse(path, workers=2, chunk_size=40))
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_incoming_msg_ext(tmpdir, workers):
+    path = str(tmpdir.join("capture.bin"))
+    ieee = bytes(range(1, 9))
+
+    def ext(mode, address):
+        return frame(
+            CommandType.AREQ,
+            Subsystem.AF,
+            "incomingMsgExt",
+            srcaddrmode=mode,
+            srcaddr=address,
+        )
+
+    records = [
+        (0, Direction.RX, ext(AddressMode.ADDR_64BIT, ieee)),
+        # a 16 bit source, padded to the width of an IEEE address
+        (10, Direction.RX, ext(AddressMode.ADDR_16BIT, b"\x34\x12" + bytes(6))),
+        (20, Direction.RX, ext(AddressMode.ADDR_64BIT, ieee)),
+        (30, Direction.RX, frame(CommandType.AREQ, Subsystem.AF, "incomingMsg")),
+    ]
+    write_capture(path, records)
+
+    summary = analysis.analyse(path, workers=workers, chunk_size=40)
+    assert summary["undecodable"] == 0
+    assert list(summary["devices"]) == ["0x0000", "0x1234", "08:07:06:05:04:03:02:01"]
+    assert summary["devices"]["08:07:06:05:04:03:02:01"]["messages"] == 2
+    assert summary["devices"]["0x1234"]["messages"] == 1
+
+
+def test_corrupt_records(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    writer = CaptureWriter(path)
+    # length beyond the record, checksum mismatch, unknown subsystem
+    writer.write(Direction.RX, b"\xfe\x20\x61\x02\x00")
+    writer.write(Direction.RX, b"\xfe\x01\x61\x02\x00\x00")
+    writer.write(Direction.RX, b"\xfe\x01\x7f\x00\x00\x7e")
+    writer.write_frame(Direction.TX, frame(CommandType.SREQ, Subsystem.SYS, "ping"))
+    writer.close()
+
+    summary = analysis.analyse(path, workers=0)
+    assert summary["frames"] == 4
+    assert summary["undecodable"] == 3
+    assert summary["commands"] == {"TX SREQ SYS ping": 1}
+
+
+def test_empty(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    CaptureWriter(path).close()
+    summary = analysis.analyse(path)
+    assert summary["frames"] == 0
+    assert summary["latency"] == {}
+
+
+def test_main(path, tmpdir, capsys):
+    pairs = str(tmpdir.join("pairs.csv"))
+    analysis.main([path, "--workers", "0", "--pairs", pairs])
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["frames"] == 9
+    assert "pairs" not in summary
+
+    with open(pairs, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["kind", "command", "request_ns", "latency_ns"]
+    assert rows[1:] == [
+        ["sreq", "version", "0", str(2 * MS)],
+        ["data_request", "dataRequest", str(3 * MS), str(10 * MS)],
+    ]
@@ -3,11 +3,13 @@ import asyncio
 from asynctest import CoroutineMock, mock
 import pytest
 import serial
+import zigpy.types
 
 from zigpy_cc import types as t, uart
 import zigpy_cc.api
 import zigpy_cc.config
 from zigpy_cc.definition import Definition
+from zigpy_cc.emulator import MAC_NO_ACK, Emulator
 import zigpy_cc.exception
 import zigpy_cc.uart
 from zigpy_cc.uart import UnpiFrame
@@ -22,6 +24,7 @@ DEVICE_CONFIG = zigpy_cc.config.SCHEMA_DEVICE(
 def api():
     api = zigpy_cc.api.API(DEVICE_CONFIG)
     api._uart = mock.MagicMock()
+    api._uart.drain = CoroutineMock()
     return api
 
 
@@ -272,3 +275,378 @@ async def test_probe_fail(mock_connect, mock_version, exception):
     assert mock_connect.call_args[0][0] == DEVICE_CONFIG
     assert mock_version.call_count == 1
     assert mock_connect.return_value.close.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_waiter_index_fifo(api: zigpy_cc.api.API):
+    first = api.wait_for(
+        t.CommandType.AREQ, t.Subsystem.AF, "dataConfirm", {"transid": 1}
+    )
+    second = api.wait_for(
+        t.CommandType.AREQ, t.Subsystem.AF, "dataConfirm", {"transid": 1}
+    )
+    other = api.wait_for(
+        t.CommandType.AREQ, t.Subsystem.AF, "dataConfirm", {"transid": 2}
+    )
+    assert len(api._waiters) == 3
+
+    api.data_received(UnpiFrame(2, 4, 128, b"\x00\x01\x02"))
+    assert other.future.done()
+    assert not first.future.done()
+    assert len(api._waiters) == 2
+
+    api.data_received(UnpiFrame(2, 4, 128, b"\x00\x01\x01"))
+    assert first.future.done()
+    assert second.future.done()
+    assert len(api._waiters) == 0
+    assert api._waiters._index == {}
+
+
+@pytest.mark.asyncio
+async def test_waiter_index_sequence(api: zigpy_cc.api.API):
+    first = api.wait_for(
+        t.CommandType.AREQ,
+        t.Subsystem.ZDO,
+        "nodeDescRsp",
+        {"srcaddr": 0xD04A},
+        sequence=3,
+    )
+    second = api.wait_for(
+        t.CommandType.AREQ,
+        t.Subsystem.ZDO,
+        "nodeDescRsp",
+        {"srcaddr": 0xD04A},
+        sequence=4,
+    )
+
+    obj = ZpiObject.from_command(
+        t.Subsystem.ZDO,
+        "nodeDescRsp",
+        {
+            "srcaddr": 0xD04A,
+            "status": 0,
+            "nwkaddr": 0xD04A,
+            "logicaltype_cmplxdescavai_userdescavai": 0,
+            "apsflags_freqband": 0,
+            "maccapflags": 0,
+            "manufacturercode": 0,
+            "maxbuffersize": 0,
+            "maxintransfersize": 0,
+            "servermask": 0,
+            "maxouttransfersize": 0,
+            "descriptorcap": 0,
+        },
+    )
+    api.data_received(obj.to_unpi_frame())
+
+    assert first.future.done()
+    assert first.future.result().sequence == 3
+    assert not second.future.done()
+    assert list(api._waiters) == [second.id]
+
+
+@pytest.mark.asyncio
+async def test_waiter_index_pop(api: zigpy_cc.api.API):
+    waiter = api.wait_for(t.CommandType.SRSP, t.Subsystem.SYS, "ping", {})
+    assert api._waiters.pop(waiter.id) is waiter
+    assert len(api._waiters) == 0
+    assert api._waiters._index == {}
+
+
+@pytest.mark.asyncio
+async def test_waiter_unhashable(api: zigpy_cc.api.API):
+    waiter = api.wait_for(
+        t.CommandType.AREQ,
+        t.Subsystem.ZDO,
+        "activeEpRsp",
+        {"activeeplist": [1, 2]},
+        sequence=5,
+    )
+    assert api._waiters.waiting_for(
+        (t.CommandType.AREQ, t.Subsystem.ZDO, "activeEpRsp")
+    )
+    assert api._waiters._index == {}
+
+    def frame(endpoints):
+        return ZpiObject.from_command(
+            t.Subsystem.ZDO,
+            "activeEpRsp",
+            {
+                "srcaddr": 0x1001,
+                "status": 0,
+                "nwkaddr": 0x1001,
+                "activeepcount": len(endpoints),
+                "activeeplist": endpoints,
+            },
+        ).to_unpi_frame()
+
+    api.data_received(frame([1]))
+    assert not waiter.future.done()
+
+    api.data_received(frame([1, 2]))
+    assert waiter.future.result().sequence == 5
+    assert len(api._waiters) == 0
+    assert api._waiters._unindexed == {}
+
+
+@pytest.mark.asyncio
+async def test_waiter_timeout(api: zigpy_cc.api.API):
+    waiter = api.wait_for(t.CommandType.SRSP, t.Subsystem.SYS, "ping", {}, timeout=10)
+    with pytest.raises(asyncio.TimeoutError):
+        await waiter.wait()
+    assert len(api._waiters) == 0
+    assert api._waiters.expired == 1
+    assert api._waiters._timer is None
+
+
+@pytest.mark.asyncio
+async def test_waiter_single_timer(api: zigpy_cc.api.API):
+    waiters = [
+        api.wait_for(t.CommandType.SRSP, t.Subsystem.SYS, "ping", {}, timeout=50)
+        for _ in range(10)
+    ]
+    timer = api._waiters._timer
+    assert timer is not None
+
+    early = api.wait_for(
+        t.CommandType.AREQ, t.Subsystem.SYS, "resetInd", {}, timeout=10
+    )
+    assert api._waiters._timer is not timer
+    assert timer.cancelled()
+
+    api.data_received(UnpiFrame(3, 1, 1, b"\x01\x00"))
+    assert all(w.future.done() for w in waiters)
+    assert len(api._waiters) == 1
+
+    await asyncio.sleep(0.1)
+    assert early.future.done()
+    assert isinstance(early.future.exception(), asyncio.TimeoutError)
+    assert api._waiters.expired == 1
+    assert len(api._waiters) == 0
+    assert api._waiters._timer is None
+    assert api._waiters._deadlines == []
+
+
+@pytest.mark.asyncio
+async def test_request_waits_for_drain():
+    api = zigpy_cc.api.API(DEVICE_CONFIG)
+    api._uart = zigpy_cc.uart.Gateway(api)
+    api._uart._transport = mock.MagicMock()
+    api._uart.pause_writing()
+
+    fut = asyncio.ensure_future(
+        api.request(t.Subsystem.UTIL, "ledControl", {"ledid": 3, "mode": 1})
+    )
+    await asyncio.sleep(0.01)
+    assert not fut.done()
+    assert api._uart.queued == 0
+    assert len(api._waiters) == 0
+
+    api._uart.resume_writing()
+    await asyncio.sleep(0)
+    assert api._uart.queued == 1
+    fut.cancel()
+
+
+@pytest.mark.asyncio
+async def test_stats():
+    emulator = Emulator(devices=1, latency=0.01, loss=1.0)
+    api = zigpy_cc.api.API(DEVICE_CONFIG)
+    api._uart = await emulator.connect(DEVICE_CONFIG, api)
+
+    await api.version()
+    await api.version()
+    with pytest.raises(zigpy_cc.exception.CommandError):
+        await api.request(
+            t.Subsystem.SYS,
+            "osalNvItemInit",
+            {"id": 0x100, "len": 1, "initlen": 1, "initvalue": b"\x00"},
+        )
+
+    obj = ZpiObject.from_cluster(0x1001, 260, 6, 1, 1, 1, b"\x01\x01\x01")
+    confirm = api.create_response_waiter(obj)
+    await api.request_raw(obj, confirm.id)
+    await confirm.wait()
+    await asyncio.sleep(0)
+
+    stats = api.stats()
+    version = stats["commands"]["SYS version"]
+    assert version["count"] == 2
+    assert version["latency"]["count"] == 2
+    assert version["latency"]["buckets"][-1] == (float("inf"), 2)
+    assert stats["commands"]["SYS osalNvItemInit"]["errors"] == {9: 1}
+
+    data_request = stats["confirms"]["AF dataRequest"]
+    assert data_request["count"] == 1
+    assert data_request["errors"] == {MAC_NO_ACK: 1}
+    assert data_request["latency"]["sum"] >= 0.01
+
+    assert stats["lock_wait"]["count"] == 4
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 1
+    assert stats["waiters"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stats_confirm_latency():
+    emulator = Emulator(devices=1, latency=0.01)
+    api = zigpy_cc.api.API(DEVICE_CONFIG)
+    api._uart = await emulator.connect(DEVICE_CONFIG, api)
+
+    obj = ZpiObject.from_cluster(0x1001, 260, 6, 1, 1, 1, b"\x01\x01\x01")
+    confirm = api.create_response_waiter(obj)
+    # queued behind another request, that time is lock_wait
+    await api._lock.acquire(t.Priority.NORMAL)
+    request = asyncio.ensure_future(api.request_raw(obj, confirm.id))
+    await asyncio.sleep(0.1)
+    api._lock.release()
+    await request
+    await confirm.wait()
+    await asyncio.sleep(0)
+
+    stats = api.stats()
+    latency = stats["confirms"]["AF dataRequest"]["latency"]
+    assert latency["count"] == 1
+    assert 0.01 <= latency["sum"] < 0.1
+    assert stats["lock_wait"]["sum"] >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_stats_timeout(api: zigpy_cc.api.API, monkeypatch):
+    monkeypatch.setattr(t.Timeouts, "SREQ", 10)
+    requests = [api.request(t.Subsystem.SYS, "ping", {}) for _ in range(3)]
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+
+    stats = api.stats()
+    assert stats["commands"]["SYS ping"]["timeouts"] == 3
+    assert stats["commands"]["SYS ping"]["latency"]["count"] == 0
+    assert stats["max_queue_depth"] == 2
+    assert stats["lock_wait"]["sum"] >= 0.02
+    assert stats["expired_waiters"] == 3
+
+
+def incoming_frames():
+    payload = {
+        "groupid": 0,
+        "clusterid": 6,
+        "srcaddr": 0x1001,
+        "srcendpoint": 1,
+        "dstendpoint": 2,
+        "wasbroadcast": 0,
+        "linkquality": 120,
+        "securityuse": 0,
+        "timestamp": 123456,
+        "transseqnumber": 0,
+        "len": 3,
+        "data": b"\x18\x2a\x0b",
+    }
+    msg = ZpiObject.from_command(t.Subsystem.AF, "incomingMsg", payload)
+    payload = dict(payload, srcaddrmode=t.AddressMode.ADDR_64BIT, srcpanid=0x1A62)
+    payload["srcaddr"] = bytes(range(8))
+    ext = ZpiObject.from_command(t.Subsystem.AF, "incomingMsgExt", payload)
+    return msg.to_unpi_frame(), ext.to_unpi_frame()
+
+
+def test_incoming_fast_path(api):
+    app = mock.MagicMock()
+    api.set_application(app)
+    msg, ext = incoming_frames()
+
+    api.data_received(msg)
+    assert app.handle_znp.call_count == 0
+    app.handle_incoming.assert_called_once_with(
+        "incomingMsg", 0x1001, None, 6, 1, 2, 120, b"\x18\x2a\x0b"
+    )
+    assert type(app.handle_incoming.call_args[0][1]) is zigpy.types.NWK
+
+    api.data_received(ext)
+    assert app.handle_znp.call_count == 0
+    assert app.handle_incoming.call_args[0] == (
+        "incomingMsgExt",
+        None,
+        zigpy.types.EUI64(bytes(range(8))),
+        6,
+        1,
+        2,
+        120,
+        b"\x18\x2a\x0b",
+    )
+
+    # 16 bit source address
+    data = bytearray(ext.data)
+    data[4] = t.AddressMode.ADDR_16BIT
+    api.data_received(UnpiFrame(ext.command_type, ext.subsystem, 0x82, bytes(data)))
+    assert app.handle_incoming.call_args[0][1:3] == (0x0100, None)
+    assert type(app.handle_incoming.call_args[0][1]) is zigpy.types.NWK
+
+
+@pytest.mark.asyncio
+async def test_incoming_generic_path(api):
+    app = mock.MagicMock()
+    api.set_application(app)
+    msg, _ = incoming_frames()
+
+    # somebody waits for it
+    waiter = api.wait_for(t.CommandType.AREQ, t.Subsystem.AF, "incomingMsg")
+    api.data_received(msg)
+    assert waiter.future.done()
+    assert app.handle_znp.call_count == 1
+    assert app.handle_incoming.call_count == 0
+
+    # truncated, left to the generic decoder
+    with pytest.raises(OverflowError):
+        api.data_received(UnpiFrame(msg.command_type, msg.subsystem, 0x81, b"\x00"))
+    assert app.handle_incoming.call_count == 0
+
+
+def test_add_handler(api):
+    app = mock.MagicMock()
+    app.handle_znp.side_effect = lambda obj: events.append("app")
+    api.set_application(app)
+    events = []
+    frame = ZpiObject.from_command(
+        t.Subsystem.ZDO,
+        "concentratorIndCb",
+        {"srcaddr": 0x1001, "extaddr": 0x1122, "pktCost": 1},
+    ).to_unpi_frame()
+
+    def handler(obj):
+        events.append(obj.command)
+
+    def broken(obj):
+        raise ValueError()
+
+    api.add_handler(t.Subsystem.ZDO, "concentratorIndCb", broken)
+    api.add_handler(t.Subsystem.ZDO, "concentratorIndCb", handler)
+    api.data_received(frame)
+    assert events == ["app", "concentratorIndCb"]
+    assert api.handles(app.handle_znp.call_args[0][0])
+
+    api.remove_handler(t.Subsystem.ZDO, "concentratorIndCb", broken)
+    api.remove_handler(t.Subsystem.ZDO, "concentratorIndCb", handler)
+    api.data_received(frame)
+    assert events == ["app", "concentratorIndCb", "app"]
+    assert not api.handles(app.handle_znp.call_args[0][0])
+    with pytest.raises(ValueError):
+        api.remove_handler(t.Subsystem.ZDO, "concentratorIndCb", handler)
+    api.add_handler(t.Subsystem.SYS, "version", broken)
+    with pytest.raises(ValueError):
+        api.remove_handler(t.Subsystem.SYS, "version", handler)
+    with pytest.raises(ValueError):
+        api.remove_handler(t.Subsystem.SYS, "ping", handler)
+
+
+def test_incoming_handler(api):
+    app = mock.MagicMock()
+    api.set_application(app)
+    msg, _ = incoming_frames()
+    handler = mock.MagicMock()
+
+    # a handler for incomingMsg needs the decoded frame, no fast path
+    api.add_handler(t.Subsystem.AF, "incomingMsg", handler)
+    api.data_received(msg)
+    assert handler.call_count == 1
+    assert handler.call_args[0][0].payload["clusterid"] == 6
+    assert app.handle_znp.call_count == 1
+    assert app.handle_incoming.call_count == 0
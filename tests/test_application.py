@@ -2,7 +2,12 @@
 import asyncio
 from unittest import mock
 
+from asynctest import CoroutineMock
+
 import pytest
+import zigpy.application
+import zigpy.device
+import zigpy.types
 from zigpy.types import EUI64, Group, BroadcastAddress
 import zigpy.zdo.types as zdo_t
 from zigpy.zcl.clusters.general import Groups
@@ -10,7 +15,9 @@ from zigpy.zcl.clusters.general import Groups
 from zigpy_cc import types as t
 from zigpy_cc.api import API
 import zigpy_cc.config as config
+import zigpy_cc.exception
 import zigpy_cc.zigbee.application as application
+from zigpy_cc.zigbee.concurrency import AdaptiveSemaphore
 from zigpy_cc.zpi_object import ZpiObject
 
 APP_CONFIG = {
@@ -27,7 +34,7 @@ def app():
     app = application.ControllerApplication(APP_CONFIG)
     app._api = API(APP_CONFIG[config.CONF_DEVICE])
     app._api.set_application(app)
-    app._semaphore = asyncio.Semaphore()
+    app._semaphore = AdaptiveSemaphore(1)
     return app
 
 
@@ -723,3 +730,282 @@ async def test_read_attributes(app: application.ControllerApplication):
 # async def test_mrequest_send_aps_data_error(app):
 #     r = await _test_mrequest(app, False, aps_data_error=True)
 #     assert r[0] != 0
+
+
+@pytest.mark.asyncio
+async def test_request_no_resources(app: application.ControllerApplication):
+    await device_annce(app)
+    device = app.get_device(nwk=53322)
+    app._semaphore = AdaptiveSemaphore(16, maximum=32)
+
+    async def request_raw(obj, waiter_id=None, priority=None):
+        raise zigpy_cc.exception.CommandError(0x1A, "no resources")
+
+    app._api.request_raw = request_raw
+
+    res = await app.request(
+        device, 260, 6, 1, 1, 1, b"\x01\x01\x01", expect_reply=False
+    )
+    assert res[0] == 0x1A
+    assert app.concurrency == 8
+
+
+@pytest.mark.asyncio
+async def test_request_priority(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    fut = asyncio.Future()
+    fut.set_result(None)
+    app._api.request_raw = mock.MagicMock(return_value=fut)
+
+    await app.request(
+        device, 0, zdo_t.ZDOCmd.Mgmt_Lqi_req, 0, 0, 1, b"\x01\x00", expect_reply=False
+    )
+    assert app._api.request_raw.call_args[1]["priority"] == t.Priority.BACKGROUND
+
+    await app.request(device, 260, 6, 1, 1, 2, b"\x01\x02\x01", expect_reply=False)
+    assert app._api.request_raw.call_args[1]["priority"] == t.Priority.NORMAL
+
+    await app.request(
+        device,
+        260,
+        6,
+        1,
+        1,
+        3,
+        b"\x01\x03\x01",
+        expect_reply=False,
+        priority=t.Priority.INTERACTIVE,
+    )
+    assert app._api.request_raw.call_args[1]["priority"] == t.Priority.INTERACTIVE
+
+
+@pytest.mark.asyncio
+async def test_data_confirm_no_resources(app: application.ControllerApplication):
+    app._semaphore = AdaptiveSemaphore(16, maximum=32)
+    obj = ZpiObject.from_command(
+        t.Subsystem.AF, "dataConfirm", {"status": 0xF1, "endpoint": 1, "transid": 1}
+    )
+    app.handle_znp(obj)
+    assert app.concurrency == 8
+
+
+def data_confirm_frame(status, transid):
+    return ZpiObject.from_command(
+        t.Subsystem.AF,
+        "dataConfirm",
+        {"status": status, "endpoint": 1, "transid": transid},
+    ).to_unpi_frame()
+
+
+@pytest.mark.asyncio
+async def test_request_confirm_delivery(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    app._confirm_delivery = True
+
+    async def request_raw(obj, waiter_id=None, priority=None):
+        def confirm():
+            # the slot is held until the confirm arrives
+            assert app._semaphore.in_flight == 1
+            app._api.data_received(data_confirm_frame(0, obj.payload["transid"]))
+
+        asyncio.get_event_loop().call_soon(confirm)
+
+    app._api.request_raw = request_raw
+
+    res = await app.request(
+        device, 260, 6, 1, 1, 12, b"\x01\x0c\x01", expect_reply=False
+    )
+    assert res == (0, "message delivered")
+    assert app._semaphore.in_flight == 0
+    assert len(app._api._waiters) == 0
+
+
+@pytest.mark.asyncio
+async def test_request_confirm_delivery_failed(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    app._confirm_delivery = True
+
+    async def request_raw(obj, waiter_id=None, priority=None):
+        asyncio.get_event_loop().call_soon(
+            app._api.data_received, data_confirm_frame(0xE9, obj.payload["transid"])
+        )
+
+    app._api.request_raw = request_raw
+
+    res = await app.request(device, 260, 6, 1, 1, 13, b"\x01\x0d\x01")
+    assert res[0] == 0xE9
+    assert app._semaphore.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_request_confirm_delivery_timeout(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    app._confirm_delivery = True
+    app._confirm_timeout = 0.01
+
+    async def request_raw(obj, waiter_id=None, priority=None):
+        # queued for longer than the confirm timeout
+        await asyncio.sleep(0.05)
+        assert app._api._waiters.get(waiter_id).deadline is None
+
+    app._api.request_raw = request_raw
+
+    res = await app.request(device, 260, 6, 1, 1, 14, b"\x01\x0e\x01")
+    assert res[0] == application.CONFIRM_TIMEOUT_STATUS
+    assert app._semaphore.in_flight == 0
+    assert len(app._api._waiters) == 0
+
+
+@pytest.mark.asyncio
+async def test_request_reply_timeout(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    app._confirm_timeout = 0.01
+    app._api.request_raw = CoroutineMock()
+
+    res = await app.request(device, 0, 5, 0, 0, 15, b"\x0f\x4a\xd0")
+    assert res == (0, "message send success")
+    # a ZDO reply gets the default timeout, from when the frame was sent
+    (waiter,) = [app._api._waiters.get(i) for i in app._api._waiters]
+    assert waiter.timeout == t.Timeouts.default
+    assert waiter.deadline is not None
+    await asyncio.sleep(0.02)
+    assert not waiter.future.done()
+    app._api.cancel_waiter(waiter)
+
+
+@pytest.mark.asyncio
+async def test_request_failed_drops_waiter(app: application.ControllerApplication):
+    device = mock.MagicMock(nwk=zigpy.types.NWK(0xD04A))
+    app._api.request_raw = CoroutineMock(side_effect=asyncio.TimeoutError)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await app.request(device, 0, 5, 0, 0, 16, b"\x10\x4a\xd0")
+    assert len(app._api._waiters) == 0
+
+
+@pytest.mark.asyncio
+async def test_nwk_index(app: application.ControllerApplication, ieee):
+    scan = mock.patch.object(
+        zigpy.application.ControllerApplication, "get_device", side_effect=KeyError
+    )
+    with mock.patch.object(zigpy.device.Device, "schedule_initialize"):
+        app.handle_join(0x1234, ieee, 0)
+        device = app.devices[ieee]
+        with scan as scan_mock:
+            assert app.get_device(nwk=0x1234) is device
+        assert scan_mock.call_count == 0
+
+        # rejoined with another address
+        app.handle_join(0x4321, ieee, 0)
+        assert app.get_device(nwk=0x4321) is device
+        assert 0x1234 not in app._nwk_index
+        with pytest.raises(KeyError):
+            app.get_device(nwk=0x1234)
+
+    # address lookups
+    payload = {
+        "status": 0,
+        "ieeeaddr": ieee,
+        "nwkaddr": 0x5555,
+        "startindex": 0,
+        "numassocdev": 0,
+        "assocdevlist": [],
+    }
+    app.handle_znp(ZpiObject(2, 5, "nwkAddrRsp", 128, payload, []))
+    assert device.nwk == 0x5555
+    with scan as scan_mock:
+        assert app.get_device(nwk=0x5555) is device
+
+    # replaced behind the index' back, e.g. by a quirk
+    replacement = zigpy.device.Device(app, ieee, 0x5555)
+    app.devices[ieee] = replacement
+    assert app.get_device(nwk=0x5555) is replacement
+    assert app._nwk_index[0x5555] is replacement
+
+    with mock.patch.object(app, "force_remove"), mock.patch.object(
+        replacement.zdo, "leave", side_effect=asyncio.TimeoutError
+    ):
+        await app.remove(ieee)
+    assert app._nwk_index == {}
+    with pytest.raises(KeyError):
+        app.get_device(nwk=0x5555)
+
+
+def test_nwk_index_incoming(app: application.ControllerApplication, ieee):
+    # loaded from the database, unknown to the index
+    device = zigpy.device.Device(app, ieee, 0x6DBB)
+    app.devices[ieee] = device
+
+    payload = {
+        "groupid": 0,
+        "clusterid": 6,
+        "srcaddr": 0x6DBB,
+        "srcendpoint": 1,
+        "dstendpoint": 1,
+        "wasbroadcast": 0,
+        "linkquality": 136,
+        "securityuse": 0,
+        "timestamp": 15458350,
+        "transseqnumber": 0,
+        "len": 3,
+        "data": b"\x18\x01\x0b",
+    }
+    with mock.patch.object(app, "handle_message") as handle_message:
+        app.handle_znp(ZpiObject(2, 4, "incomingMsg", 129, payload, []))
+    assert handle_message.call_args[0][0] is device
+    assert app._nwk_index[0x6DBB] is device
+
+
+def test_zdo_reply_not_reencoded(app: application.ControllerApplication):
+    payload = {
+        "srcaddr": 53322,
+        "status": 0,
+        "nwkaddr": 53322,
+        "activeepcount": 1,
+        "activeeplist": [1],
+    }
+    frame = ZpiObject.from_command(5, "activeEpRsp", payload).to_unpi_frame()
+    obj = ZpiObject.from_unpi_frame(frame)
+    assert obj.data is frame.data
+    obj.sequence = 7
+
+    with mock.patch.object(app, "get_device"), mock.patch.object(
+        app, "handle_message"
+    ) as handle_message, mock.patch.object(
+        ZpiObject, "to_unpi_frame", side_effect=AssertionError
+    ):
+        app.handle_znp(obj)
+    assert handle_message.call_args[0][5] == b"\x07\x00\x4a\xd0\x01\x01"
+
+
+def test_handle_znp_unhandled(app, caplog):
+    obj = ZpiObject.from_command(
+        t.Subsystem.ZDO,
+        "concentratorIndCb",
+        {"srcaddr": 0x1001, "extaddr": 0x1122, "pktCost": 1},
+    )
+    app.handle_znp(obj)
+    assert "Unhandled message" in caplog.text
+
+    # the API's handlers take care of it
+    caplog.clear()
+    app._api.add_handler(t.Subsystem.ZDO, "concentratorIndCb", lambda obj: None)
+    app.handle_znp(obj)
+    assert "Unhandled message" not in caplog.text
+
+    caplog.clear()
+    app.handle_znp(ZpiObject(2, 5, "srcRtgInd", 196, {}, []))
+    assert caplog.text == ""
+
+
+@pytest.mark.asyncio
+async def test_semaphore_before_startup():
+    app = application.ControllerApplication(APP_CONFIG)
+    assert app.concurrency == application.CONCURRENCY_DEFAULT
+
+    app.handle_znp(
+        ZpiObject.from_command(
+            t.Subsystem.AF, "dataConfirm", {"status": 0x11, "endpoint": 1, "transid": 1}
+        )
+    )
+    assert app.concurrency == 1
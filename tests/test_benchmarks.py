@@ -0,0 +1,43 @@
+import pytest
+
+from benchmarks import (
+    bench_codec,
+    bench_dispatch,
+    bench_end_to_end,
+    bench_inbound,
+    bench_parser,
+    percentiles,
+)
+
+
+def test_percentiles():
+    res = percentiles([float(i) for i in range(100)])
+    assert res == {"p50": 50.0, "p90": 90.0, "p99": 99.0}
+
+
+def test_parser_and_codec():
+    res = bench_parser.run(1)
+    assert res["whole"]["frames_per_sec"] > 0
+
+    res = bench_codec.run(1)
+    assert set(res["af_incoming"]) == {"decode", "encode"}
+
+
+@pytest.mark.asyncio
+async def test_dispatch():
+    res = bench_dispatch.run(1)
+    assert set(res) == {"waiters_0", "waiters_100", "waiters_1000"}
+
+
+@pytest.mark.asyncio
+async def test_inbound():
+    res = bench_inbound.run(1)
+    assert res["fast"]["ops"] == res["generic"]["ops"]
+    assert res["speedup"] > 0
+
+
+@pytest.mark.asyncio
+async def test_end_to_end():
+    res = await bench_end_to_end._run(8, 2, 0)
+    assert res["sequential"]["ops"] == 8
+    assert res["concurrent"]["ops"] == 8
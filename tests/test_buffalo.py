@@ -1,3 +1,4 @@
+import pytest
 from zigpy.types import EUI64, Group, NWK
 
 import zigpy_cc.types as t
@@ -32,6 +33,16 @@ def test_write_ieee_group():
     assert b"\x02\x00\x00\x00\x00\x00\x00\x00" == data_out.buffer
 
 
+def test_write_fixed_buffer():
+    data_out = Buffalo(b"")
+    data_out.write_parameter(t.ParameterType.INT8, -2, {})
+    data_out.write_parameter(t.ParameterType.BUFFER8, bytes(range(8)), {})
+    assert b"\xfe\x00\x01\x02\x03\x04\x05\x06\x07" == data_out.buffer
+
+    with pytest.raises(ValueError):
+        data_out.write_parameter(t.ParameterType.BUFFER16, bytes(8), {})
+
+
 def test_read_ieee():
     data_in = Buffalo(ieeeAddr1["hex"])
     actual = data_in.read_parameter("test", t.ParameterType.IEEEADDR, {})
@@ -0,0 +1,117 @@
+import os
+
+from asynctest import mock
+import pytest
+
+from zigpy_cc import capture, uart
+from zigpy_cc.capture import CaptureReader, CaptureWriter, Direction
+from zigpy_cc.exception import OutboundQueueFull
+
+SRSP = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+
+
+@pytest.fixture
+def gw(tmpdir):
+    gw = uart.Gateway(mock.MagicMock())
+    gw._transport = mock.MagicMock()
+    gw.capture = CaptureWriter(str(tmpdir.join("capture.bin")))
+    return gw
+
+
+@pytest.mark.asyncio
+async def test_gateway_capture(gw):
+    frame = uart.UnpiFrame(1, 1, 2, b"\x00")
+    gw.send(frame)
+    gw.data_received(b"\x00" + SRSP)
+    path = gw.capture.path
+    gw.capture.close()
+
+    with CaptureReader(path) as reader:
+        records = list(reader)
+        assert [r.direction for r in records] == [Direction.TX, Direction.RX]
+        assert records[0].timestamp <= records[1].timestamp
+        assert bytes(records[0].data) == frame.to_buffer()
+        # garbage before the frame is not recorded
+        assert bytes(records[1].data) == SRSP
+        assert records[1].frame().command_id == 2
+        del records
+
+
+@pytest.mark.asyncio
+async def test_gateway_capture_queue_full(gw, monkeypatch):
+    monkeypatch.setattr(uart, "MaxOutboundFrames", 1)
+    gw._paused = True
+    gw.send(uart.UnpiFrame(1, 1, 2, b"\x00"))
+    with pytest.raises(OutboundQueueFull):
+        gw.send(uart.UnpiFrame(1, 1, 2, b"\x01"))
+    path = gw.capture.path
+    gw.capture.close()
+
+    with CaptureReader(path) as reader:
+        records = [bytes(r.data) for r in reader]
+    assert records == [uart.UnpiFrame(1, 1, 2, b"\x00").to_buffer()]
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    writer = CaptureWriter(path, max_bytes=100, backup_count=2)
+    for i in range(20):
+        writer.write(Direction.RX, SRSP)
+    writer.close()
+
+    assert os.path.exists(path + ".1")
+    assert os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+    for name in (path, path + ".1"):
+        assert os.path.getsize(name) <= 100
+        with CaptureReader(name) as reader:
+            assert all(bytes(r.data) == SRSP for r in reader)
+
+
+def test_torn_and_invalid_files(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    writer = CaptureWriter(path)
+    writer.write(Direction.RX, SRSP)
+    writer.write(Direction.RX, SRSP)
+    writer.close()
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+    with CaptureReader(path) as reader:
+        assert len(list(reader)) == 1
+
+    open(path, "w").close()
+    with CaptureReader(path) as reader:
+        assert list(reader) == []
+
+    with open(path, "wb") as f:
+        f.write(b"not a capture")
+    with pytest.raises(ValueError):
+        CaptureReader(path)
+
+
+@pytest.mark.asyncio
+async def test_replay(tmpdir):
+    path = str(tmpdir.join("capture.bin"))
+    writer = CaptureWriter(path)
+    writer.write(Direction.TX, uart.UnpiFrame(1, 1, 2, b"\x00").to_buffer())
+    for _ in range(3):
+        writer.write(Direction.RX, SRSP)
+    writer.close()
+
+    api = mock.MagicMock()
+    assert await capture.replay(path, api, speed=0) == 3
+    assert api.data_received.call_count == 3
+    frame = api.data_received.call_args[0][0]
+    assert frame.to_buffer() == SRSP
+
+    assert await capture.replay(path, api, speed=100) == 3
+
+
+def test_dump(tmpdir, capsys):
+    path = str(tmpdir.join("capture.bin"))
+    writer = CaptureWriter(path)
+    writer.write(Direction.RX, SRSP)
+    writer.close()
+
+    capture.main(["dump", path])
+    assert "RX <UnpiFrame" in capsys.readouterr().out
@@ -0,0 +1,120 @@
+import pytest
+from zigpy.types import EUI64, NWK
+
+from zigpy_cc import buffalo, registry
+from zigpy_cc.codec import ParameterCodec
+import zigpy_cc.types as t
+
+
+def test_incoming_msg_prefix():
+    codec = registry.get_command(t.Subsystem.AF, "incomingMsg").request_codec
+    assert codec._decode_struct.size == 17
+    assert [p["name"] for p in codec._decode_tail] == ["data"]
+
+    data = (
+        b"\x00\x00\x01\x00\xbbm\x01\x01\x00s\x00YC3\x00\x00\t\x18\x01\x01\x04\x00\x86"
+        b"\x05\x00\x86\xbbm\x1d"
+    )
+    payload = codec.decode(memoryview(data))
+    assert isinstance(payload["srcaddr"], NWK)
+    assert payload["srcaddr"] == 0x6DBB
+    assert payload["len"] == 9
+    assert payload["data"] == b"\x18\x01\x01\x04\x00\x86\x05\x00\x86"
+    assert list(payload) == [
+        p["name"] for p in registry.get_command(t.Subsystem.AF, "incomingMsg").request
+    ]
+
+
+def test_data_request_encode():
+    codec = registry.get_command(t.Subsystem.AF, "dataRequestExt").request_codec
+    payload = {
+        "dstaddrmode": t.AddressMode.ADDR_GROUP,
+        "dstaddr": NWK(0x0002),
+        "destendpoint": 255,
+        "dstpanid": 0,
+        "srcendpoint": 1,
+        "clusterid": 4,
+        "transid": 39,
+        "options": 0,
+        "radius": 30,
+        "len": 3,
+        "data": b"\x01'\x00",
+    }
+    assert (
+        b"\x01\x02\x00\x00\x00\x00\x00\x00\x00\xff\x00\x00\x01\x04\x00'\x00\x1e"
+        b"\x03\x00\x01'\x00" == codec.encode(payload)
+    )
+
+
+def test_ieee_round_trip():
+    codec = registry.get_command(t.Subsystem.SYS, "setExtAddr").request_codec
+    ieee = EUI64.convert("00:12:4b:00:18:ed:25:0c")
+    data = codec.encode({"extaddress": ieee})
+    assert data == b"\x0c%\xed\x18\x00K\x12\x00"
+    assert codec.decode(data) == {"extaddress": ieee}
+
+
+def test_decode_too_short():
+    codec = registry.get_command(t.Subsystem.AF, "dataConfirm").request_codec
+    with pytest.raises(OverflowError):
+        codec.decode(b"\x00\x01")
+
+
+def test_unsupported_encode_uses_buffalo():
+    codec = ParameterCodec(
+        [
+            {"name": "len", "parameterType": t.ParameterType.UINT8},
+            {"name": "values", "parameterType": t.ParameterType.LIST_UINT16},
+        ]
+    )
+    data = codec.encode({"len": 2, "values": [1, 0x0203]})
+    assert data == b"\x02\x01\x00\x03\x02"
+    assert codec.decode(data) == {"len": 2, "values": [1, 0x0203]}
+
+
+def test_nwk_addr_rsp_assoc_devices():
+    codec = registry.get_command(t.Subsystem.ZDO, "nwkAddrRsp").request_codec
+    ieee = b"\x01\x02\x03\x04\x05\x06\x07\x08"
+    payload = codec.decode(ieee.join((b"\x00", b"\x34\x12\x01\x03\x01\x00\x02\x00")))
+    assert payload["ieeeaddr"] == EUI64(ieee)
+    assert payload["nwkaddr"] == 0x1234
+    assert payload["assocdevlist"] == [0x0001, 0x0002]
+
+    payload = codec.decode(ieee.join((b"\x00", b"\x34\x12\x00\x00")))
+    assert payload["assocdevlist"] == []
+
+
+def test_tail_coercion():
+    codec = ParameterCodec(
+        [
+            {"name": "len", "parameterType": t.ParameterType.UINT8},
+            {"name": "data", "parameterType": t.ParameterType.BUFFER},
+            {"name": "key", "parameterType": t.ParameterType.BUFFER8},
+            {"name": "dstaddrmode", "parameterType": t.ParameterType.UINT8},
+            {"name": "dstaddr", "parameterType": t.ParameterType.UINT16},
+            {"name": "count", "parameterType": t.ParameterType.UINT16},
+        ]
+    )
+    assert [plan[3] for plan in codec._tail_plan] == [
+        None,
+        None,
+        buffalo.address_mode,
+        NWK,
+        None,
+    ]
+
+    payload = codec.decode(b"\x02\xaa\xbb" + bytes(range(8)) + b"\x01\x34\x12\x05\x00")
+    assert payload == {
+        "len": 2,
+        "data": b"\xaa\xbb",
+        "key": bytes(range(8)),
+        "dstaddrmode": t.AddressMode.ADDR_GROUP,
+        "dstaddr": 0x1234,
+        "count": 5,
+    }
+    assert payload["dstaddrmode"] is t.AddressMode.ADDR_GROUP
+    assert isinstance(payload["dstaddr"], NWK)
+    assert type(payload["count"]) is int
+
+    with pytest.raises(ValueError):
+        codec.decode(b"\x00" + bytes(8) + b"\x07\x34\x12\x05\x00")
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from zigpy_cc.zigbee import concurrency
+from zigpy_cc.zigbee.concurrency import AdaptiveSemaphore, BroadcastLimiter
+
+
+def test_additive_increase():
+    sem = AdaptiveSemaphore(2, maximum=4)
+    assert sem.value == 2
+    sem.success()
+    sem.success()
+    assert sem.value == 2
+    sem.success()
+    assert sem.value == 3
+    for _ in range(20):
+        sem.success()
+    assert sem.value == 4
+
+
+@pytest.mark.asyncio
+async def test_multiplicative_decrease(monkeypatch):
+    sem = AdaptiveSemaphore(16, maximum=32)
+    sem.congested()
+    assert sem.value == 8
+    # same burst, ignored
+    sem.congested()
+    assert sem.value == 8
+
+    monkeypatch.setattr(concurrency, "CONGESTION_HOLDOFF", 0)
+    for _ in range(10):
+        sem.congested()
+    assert sem.value == 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_release():
+    sem = AdaptiveSemaphore(1, maximum=2)
+    await sem.acquire()
+    assert sem.locked()
+
+    waiter = asyncio.ensure_future(sem.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    # growing the window lets the waiter through
+    sem.success()
+    await asyncio.sleep(0)
+    assert waiter.done()
+    assert sem.in_flight == 2
+
+    sem.release()
+    sem.release()
+    assert sem.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_cancelled():
+    sem = AdaptiveSemaphore(1)
+    async with sem:
+        waiter = asyncio.ensure_future(sem.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+
+    assert sem.in_flight == 0
+    async with sem:
+        assert sem.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_broadcast_limiter():
+    limiter = BroadcastLimiter(capacity=2, expiry=0.05)
+    loop = asyncio.get_event_loop()
+
+    start = loop.time()
+    await limiter.acquire()
+    await limiter.acquire()
+    assert limiter.available == 0
+    assert loop.time() - start < 0.05
+
+    await limiter.acquire()
+    assert loop.time() - start >= 0.05
+    assert limiter.available == 1
+
+    await asyncio.sleep(0.06)
+    assert limiter.available == 2
+
+
+def test_resource_shortage():
+    assert concurrency.is_resource_shortage(0x11)
+    assert concurrency.is_resource_shortage(0xF1)
+    # a busy channel isn't a shortage of adapter resources
+    assert not concurrency.is_resource_shortage(0xE1)
+    assert not concurrency.is_resource_shortage(0)
@@ -0,0 +1,145 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from zigpy.zcl.clusters.general import Basic, OnOff
+
+from zigpy_cc import registry, types as t, uart
+from zigpy_cc.api import API
+import zigpy_cc.config as config
+from zigpy_cc.definition import Definition
+from zigpy_cc.emulator import MAC_NO_ACK, MEM_ERROR, Emulator, _payload
+from zigpy_cc.exception import CommandError
+import zigpy_cc.zigbee.application as application
+from zigpy_cc.zpi_object import ZpiObject
+
+DEVICE_CONFIG = config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: "/dev/null"})
+
+APP_CONFIG = {
+    config.CONF_DEVICE: {config.CONF_DEVICE_PATH: "/dev/null"},
+    config.CONF_DATABASE: None,
+}
+
+
+async def attach(emulator):
+    api = API(DEVICE_CONFIG)
+    api._uart = await emulator.connect(DEVICE_CONFIG, api)
+    return api
+
+
+def data_request(nwk, transid, data=b"\x01\x01\x01"):
+    return ZpiObject.from_cluster(nwk, 260, 6, 1, 1, transid, data)
+
+
+@pytest.mark.asyncio
+async def test_sreq():
+    api = await attach(Emulator(version=t.ZnpVersion.zStack12))
+    version = await api.version()
+    assert version["product"] == t.ZnpVersion.zStack12
+
+    await api.request(
+        t.Subsystem.SYS,
+        "osalNvWrite",
+        {"id": 3, "offset": 0, "len": 1, "value": b"\x02"},
+    )
+    result = await api.request(t.Subsystem.SYS, "osalNvRead", {"id": 3, "offset": 0})
+    assert result.payload["value"] == b"\x02"
+
+
+@pytest.mark.asyncio
+async def test_every_sreq_answered():
+    api = mock.MagicMock()
+    gateway = await Emulator(devices=1).connect(DEVICE_CONFIG, api)
+    sent = set()
+    for subsystem, definitions in Definition.items():
+        for definition in definitions:
+            if definition["type"] != t.CommandType.SREQ:
+                continue
+            cmd = registry.get_command(subsystem, definition["name"])
+            data = cmd.request_codec.encode(_payload(cmd.request))
+            gateway.send(uart.UnpiFrame(t.CommandType.SREQ, subsystem, cmd.id, data))
+            sent.add((cmd.subsystem, cmd.id))
+    await asyncio.sleep(0.05)
+
+    answered = {
+        (frame.subsystem, frame.command_id)
+        for (frame,), _ in api.data_received.call_args_list
+        if frame.command_type == t.CommandType.SRSP
+    }
+    assert sent - answered == set()
+
+
+@pytest.mark.asyncio
+async def test_data_request_reply():
+    emulator = Emulator(devices=1, latency=0.01)
+    device = emulator.devices[0x1001]
+    api = await attach(emulator)
+
+    obj = data_request(device.nwk, 7, b"\x01\x07\x01")
+    confirm = api.create_response_waiter(obj)
+    incoming = api.wait_for(t.CommandType.AREQ, t.Subsystem.AF, "incomingMsg")
+    await api.request_raw(obj)
+
+    assert (await confirm.wait()).payload["status"] == 0
+    reply = await incoming.wait()
+    assert reply.payload["srcaddr"] == device.nwk
+    # default response to tsn 7, command 1
+    assert reply.payload["data"] == b"\x18\x07\x0b\x01\x00"
+
+
+@pytest.mark.asyncio
+async def test_loss_and_buffers():
+    emulator = Emulator(devices=1, latency=0.01, loss=1.0, buffers=1)
+    api = await attach(emulator)
+
+    confirm = api.create_response_waiter(data_request(0x1001, 1))
+    await api.request_raw(data_request(0x1001, 1))
+    with pytest.raises(CommandError) as exc:
+        await api.request_raw(data_request(0x1001, 2))
+    assert exc.value.status == MEM_ERROR
+
+    assert (await confirm.wait()).payload["status"] == MAC_NO_ACK
+    assert emulator.lost == 1
+    assert emulator.refused == 1
+
+
+@pytest.mark.asyncio
+async def test_application():
+    emulator = Emulator(devices=1)
+    app = application.ControllerApplication(APP_CONFIG)
+
+    with mock.patch.object(uart, "connect", emulator.connect):
+        await app.startup(auto_form=True)
+    assert app.ieee == emulator.ieee
+    assert emulator.groups == {(242, 0x0B84)}
+
+    device = emulator.devices[0x1001]
+    emulator.announce(device)
+    await asyncio.sleep(0.1)
+    zigpy_device = app.get_device(ieee=device.ieee)
+    for _ in range(50):
+        if 1 in zigpy_device.endpoints:
+            break
+        await asyncio.sleep(0.1)
+
+    endpoint = zigpy_device.endpoints[1]
+    assert OnOff.cluster_id in endpoint.in_clusters
+    result = await endpoint.in_clusters[Basic.cluster_id].read_attributes(
+        ["model"], allow_cache=False
+    )
+    assert result[0]["model"] == "emulated"
+    await app.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pty():
+    emulator = Emulator()
+    path = emulator.open_pty()
+    try:
+        api = API(config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: path}))
+        await api.connect()
+        version = await api.version()
+        assert version["product"] == t.ZnpVersion.zStack3x0
+        api.close()
+    finally:
+        emulator.close()
@@ -0,0 +1,112 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from zigpy_cc import metrics, uart
+from zigpy_cc.api import API
+import zigpy_cc.config as config
+from zigpy_cc.emulator import Emulator
+import zigpy_cc.zigbee.application as application
+
+DEVICE_CONFIG = config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: "/dev/null"})
+
+
+async def fetch(port, path="/metrics", method="GET"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        "{} {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(method, path).encode()
+    )
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return head.decode(), body.decode()
+
+
+def samples(text):
+    res = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        res[name] = float(value)
+    return res
+
+
+@pytest.mark.asyncio
+async def test_render_api():
+    emulator = Emulator()
+    api = API(DEVICE_CONFIG)
+    api._uart = await emulator.connect(DEVICE_CONFIG, api)
+    await api.version()
+    api._uart.data_received(b"\x00\x01")
+
+    text = metrics.render(api)
+    assert text.endswith("# EOF\n")
+    assert "# TYPE zigpy_cc_frames counter" in text
+    assert "# UNIT zigpy_cc_sreq_latency_seconds seconds" in text
+
+    values = samples(text)
+    assert values['zigpy_cc_frames_total{direction="tx"}'] == 1
+    assert values['zigpy_cc_frames_total{direction="rx"}'] == 1
+    assert values["zigpy_cc_dropped_bytes_total"] == 2
+    assert values["zigpy_cc_checksum_failures_total"] == 0
+    labels = 'subsystem="SYS",command="version"'
+    assert values["zigpy_cc_sreq_requests_total{%s}" % labels] == 1
+    assert values['zigpy_cc_sreq_latency_seconds_bucket{le="+Inf",%s}' % labels] == 1
+    assert values["zigpy_cc_sreq_latency_seconds_count{%s}" % labels] == 1
+    # no application, no semaphore
+    assert "concurrency" not in text
+
+
+def test_render_escaping():
+    family = metrics.Family("test", "gauge", "help\nme")
+    family.add(1.5, command='a"b\\c')
+    lines = []
+    family.render(lines)
+    assert lines == [
+        "# TYPE zigpy_cc_test gauge",
+        "# HELP zigpy_cc_test help\\nme",
+        'zigpy_cc_test{command="a\\"b\\\\c"} 1.5',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_exporter(tmpdir):
+    textfile = str(tmpdir.join("zigpy_cc.prom"))
+    app = application.ControllerApplication(
+        {
+            config.CONF_DEVICE: {config.CONF_DEVICE_PATH: "/dev/null"},
+            config.CONF_DATABASE: None,
+            config.CONF_METRICS: {
+                config.CONF_METRICS_PORT: 0,
+                config.CONF_METRICS_TEXTFILE: textfile,
+                config.CONF_METRICS_INTERVAL: 0.01,
+            },
+        }
+    )
+    emulator = Emulator()
+    with mock.patch.object(uart, "connect", emulator.connect):
+        await app.startup()
+    port = app._metrics.port
+
+    head, body = await fetch(port)
+    assert head.startswith("HTTP/1.1 200 OK")
+    assert metrics.CONTENT_TYPE in head
+    values = samples(body)
+    assert values["zigpy_cc_concurrency_limit"] == app.concurrency
+    assert values["zigpy_cc_concurrency_in_flight"] == 0
+    assert values["zigpy_cc_broadcasts_available"] == 9
+
+    head, _ = await fetch(port, "/")
+    assert head.startswith("HTTP/1.1 404")
+    head, _ = await fetch(port, method="POST")
+    assert head.startswith("HTTP/1.1 405")
+
+    await asyncio.sleep(0.05)
+    with open(textfile) as f:
+        assert f.read().endswith("# EOF\n")
+
+    await app.shutdown()
+    with pytest.raises(OSError):
+        await fetch(port)
@@ -0,0 +1,43 @@
+import pytest
+
+from zigpy_cc import registry
+from zigpy_cc.definition import Definition
+from zigpy_cc.types import CommandType, Subsystem
+
+
+def test_all_commands_indexed():
+    for subsystem, commands in Definition.items():
+        for cmd in commands:
+            by_name = registry.get_command(subsystem, cmd["name"])
+            assert by_name.id == cmd["ID"]
+            assert by_name.request is cmd["request"]
+            assert registry.get_command_by_id(subsystem, cmd["ID"]) is by_name
+            assert (
+                registry.get_frame_command(subsystem, cmd["type"], cmd["ID"]) is by_name
+            )
+
+
+def test_srsp_resolves_to_sreq():
+    cmd = registry.get_frame_command(Subsystem.SYS, CommandType.SRSP, 2)
+    assert cmd.name == "version"
+    assert cmd.type == CommandType.SREQ
+    assert cmd.parameters(CommandType.SRSP) is cmd.response
+    assert cmd.parameters(CommandType.SREQ) is cmd.request
+
+
+def test_response_command():
+    assert registry.get_response_command(Subsystem.ZDO, "nodeDescReq") == (
+        "nodeDescRsp"
+    )
+    assert registry.get_response_command(Subsystem.ZDO, "mgmtPermitJoinReq") == (
+        "mgmtPermitJoinRsp"
+    )
+    assert registry.get_response_command(Subsystem.SYS, "ping") is None
+    assert registry.get_response_command(Subsystem.AF, "dataRequest") is None
+
+
+def test_unknown_command():
+    with pytest.raises(KeyError):
+        registry.get_command(Subsystem.SYS, "doesNotExist")
+    with pytest.raises(KeyError):
+        registry.get_frame_command(Subsystem.SYS, CommandType.AREQ, 0xEE)
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from zigpy_cc.scheduler import PriorityLock
+from zigpy_cc.types import Priority
+
+
+async def _hold(lock, priority, order, name):
+    async with lock(priority):
+        order.append(name)
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    lock = PriorityLock()
+    order = []
+    await lock.acquire()
+
+    tasks = [
+        asyncio.ensure_future(_hold(lock, Priority.BACKGROUND, order, "led")),
+        asyncio.ensure_future(_hold(lock, Priority.NORMAL, order, "read")),
+        asyncio.ensure_future(_hold(lock, Priority.BACKGROUND, order, "nv")),
+        asyncio.ensure_future(_hold(lock, Priority.INTERACTIVE, order, "toggle")),
+    ]
+    await asyncio.sleep(0)
+    assert lock.queue_depth == 4
+
+    lock.release()
+    await asyncio.gather(*tasks)
+    assert order == ["toggle", "read", "led", "nv"]
+    assert not lock.locked()
+    assert lock.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_starved_waiter_goes_first():
+    lock = PriorityLock(starvation_timeout=0)
+    order = []
+    await lock.acquire()
+
+    tasks = [
+        asyncio.ensure_future(_hold(lock, Priority.BACKGROUND, order, "scan")),
+        asyncio.ensure_future(_hold(lock, Priority.INTERACTIVE, order, "toggle")),
+    ]
+    await asyncio.sleep(0)
+    lock.release()
+    await asyncio.gather(*tasks)
+    assert order == ["scan", "toggle"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_skipped():
+    lock = PriorityLock()
+    await lock.acquire()
+
+    cancelled = asyncio.ensure_future(lock.acquire(Priority.INTERACTIVE))
+    waiting = asyncio.ensure_future(lock.acquire(Priority.BACKGROUND))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+
+    lock.release()
+    assert await waiting
+    assert lock.locked()
+    lock.release()
+    assert not lock.locked()
+
+    # nothing stale left behind blocks the next caller
+    await asyncio.wait_for(lock.acquire(), 1)
+
+
+def test_release_unlocked():
+    with pytest.raises(RuntimeError):
+        PriorityLock().release()
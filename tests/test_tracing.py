@@ -0,0 +1,152 @@
+import asyncio
+
+from asynctest import CoroutineMock, mock
+
+import pytest
+from zigpy.zdo.types import ZDOCmd
+
+from zigpy_cc import types as t, uart
+from zigpy_cc.api import API
+import zigpy_cc.config as config
+from zigpy_cc.emulator import Emulator
+from zigpy_cc.tracing import TraceEvent, zcl_tsn
+import zigpy_cc.zigbee.application as application
+from zigpy_cc.zpi_object import ZpiObject
+
+DEVICE_CONFIG = config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: "/dev/null"})
+
+APP_CONFIG = {
+    config.CONF_DEVICE: {config.CONF_DEVICE_PATH: "/dev/null"},
+    config.CONF_DATABASE: None,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event, command, tsn, nwk, **info):
+        self.events.append((event, command, tsn, nwk, info))
+
+
+@pytest.fixture
+def api():
+    api = API(DEVICE_CONFIG)
+    api.set_tracer(Recorder())
+    return api
+
+
+async def connect(api):
+    api._uart = await Emulator(devices=1, latency=0.01).connect(DEVICE_CONFIG, api)
+
+
+@pytest.mark.asyncio
+async def test_data_request(api):
+    await connect(api)
+    obj = ZpiObject.from_cluster(0x1001, 260, 6, 1, 1, 7, b"\x01\x07\x01")
+    confirm = api.create_response_waiter(obj)
+    await api.request_raw(obj, priority=t.Priority.INTERACTIVE)
+    await confirm.wait()
+    await asyncio.sleep(0)
+
+    assert api._tracer.events == [
+        (
+            TraceEvent.ENQUEUE,
+            "dataRequest",
+            7,
+            0x1001,
+            {"priority": t.Priority.INTERACTIVE},
+        ),
+        (TraceEvent.LOCK_ACQUIRED, "dataRequest", 7, 0x1001, {}),
+        (TraceEvent.FRAME_WRITTEN, "dataRequest", 7, 0x1001, {}),
+        (TraceEvent.SRSP, "dataRequest", 7, 0x1001, {"status": 0}),
+        (TraceEvent.DATA_CONFIRM, "dataRequest", 7, 0x1001, {"status": 0}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_zdo_reply(api):
+    await connect(api)
+    obj = ZpiObject.from_cluster(
+        0x1001, 0, ZDOCmd.Active_EP_req, 0, 0, 5, b"\x05\x01\x10"
+    )
+    waiter = api.create_response_waiter(obj, 5)
+    await api.request_raw(obj)
+    await waiter.wait()
+    await asyncio.sleep(0)
+
+    assert [e[0] for e in api._tracer.events] == [
+        TraceEvent.ENQUEUE,
+        TraceEvent.LOCK_ACQUIRED,
+        TraceEvent.FRAME_WRITTEN,
+        TraceEvent.SRSP,
+        TraceEvent.REPLY,
+    ]
+    assert api._tracer.events[-1] == (TraceEvent.REPLY, "activeEpReq", 5, 0x1001, {})
+
+
+@pytest.mark.asyncio
+async def test_timeout(monkeypatch):
+    api = API(DEVICE_CONFIG)
+    api._uart = mock.MagicMock()
+    api._uart.drain = CoroutineMock()
+    api.set_tracer(Recorder())
+    monkeypatch.setattr(t.Timeouts, "SREQ", 10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await api.request(t.Subsystem.SYS, "ping", {})
+    assert api._tracer.events[-1] == (
+        TraceEvent.TIMEOUT,
+        "ping",
+        None,
+        None,
+        {"waiting_for": "SRSP"},
+    )
+
+
+@pytest.mark.asyncio
+async def test_application_zcl_reply():
+    emulator = Emulator(devices=1)
+    device = emulator.devices[0x1001]
+    app = application.ControllerApplication(APP_CONFIG)
+    tracer = Recorder()
+    app.set_tracer(tracer)
+    with mock.patch.object(uart, "connect", emulator.connect):
+        await app.startup()
+    assert app._api._tracer is tracer
+
+    emulator.announce(device)
+    emulator.incoming(device, 6, b"\x18\x2a\x0b\x01\x00")
+    await asyncio.sleep(0.05)
+    assert (TraceEvent.REPLY, "incomingMsg", 0x2A, 0x1001, {}) in tracer.events
+
+    app.set_tracer(None)
+    assert app._api._tracer is None
+    await app.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_broken_tracer(api, caplog):
+    def broken(event, command, tsn, nwk, **info):
+        raise RuntimeError(event)
+
+    await connect(api)
+    api.set_tracer(broken)
+    for _ in range(2):
+        # the lock is released, so the second request goes through as well
+        result = await api.request(t.Subsystem.SYS, "ping", {})
+        assert result.command == "ping"
+    assert "Tracer failed on lock_acquired of ping" in caplog.text
+
+    app = application.ControllerApplication(APP_CONFIG)
+    app.set_tracer(broken)
+    app.handle_incoming("incomingMsg", 0x1001, None, 6, 1, 1, 120, b"\x18\x2a")
+    assert "Tracer failed on reply of incomingMsg" in caplog.text
+
+
+def test_zcl_tsn():
+    assert zcl_tsn(b"\x18\x2a\x0b") == 0x2A
+    # manufacturer specific
+    assert zcl_tsn(b"\x1c\x5f\x11\x2a\x0b") == 0x2A
+    assert zcl_tsn(b"\x18") is None
+    assert zcl_tsn(b"") is None
@@ -1,6 +1,7 @@
 # flake8: noqa: E501
 from unittest import mock
 
+import pytest
 from zigpy.zcl.clusters.general import PowerConfiguration
 
 import zigpy_cc.types as t
@@ -100,6 +101,20 @@ def test_from_unpi_frame2():
     )
 
 
+def test_from_unpi_frame_memoryview():
+    data = (
+        b"\x00\x00\x01\x00\xbbm\x01\x01\x00s\x00YC3\x00\x00\t\x18\x01\x01\x04\x00\x86"
+        b"\x05\x00\x86\xbbm\x1d"
+    )
+    frame = uart.UnpiFrame(2, 4, 129, memoryview(data))
+
+    obj = ZpiObject.from_unpi_frame(frame)
+
+    assert obj.payload["srcaddr"] == 0x6DBB
+    assert isinstance(obj.payload["data"], bytes)
+    assert obj.payload["data"] == b"\x18\x01\x01\x04\x00\x86\x05\x00\x86"
+
+
 """
 zigbee-herdsman:adapter:zStack:znp:SREQ --> AF - dataRequest
 {
@@ -532,3 +547,20 @@ def test_mgmt_nwk_update_notify():
         "'energyvalues': [214, 172, 204, 176, 181, 162, 178, 165, 179, 165, 162, 169, 161, 161, 165, 174]"
         "}" == str(obj)
     )
+
+
+def test_enum_tables():
+    assert len(t.SUBSYSTEMS) == 256
+    assert t.SUBSYSTEMS[4] is t.Subsystem.AF
+    assert t.SUBSYSTEMS[t.Subsystem.ZDO] is t.Subsystem.ZDO
+    assert t.SUBSYSTEMS[10] is None
+    assert t.COMMAND_TYPES[3] is t.CommandType.SRSP
+    assert t.ADDRESS_MODES[15] is t.AddressMode.ADDR_BROADCAST
+
+    frame = uart.UnpiFrame(2, 4, 0x81, b"")
+    assert frame.command_type is t.CommandType.AREQ
+    assert frame.subsystem is t.Subsystem.AF
+    with pytest.raises(ValueError):
+        uart.UnpiFrame(2, 10, 0x81, b"")
+    with pytest.raises(ValueError):
+        ZpiObject(4, 4, "incomingMsg", 0x81, {}, [])
@@ -1,9 +1,16 @@
+import asyncio
+import logging
+import socket
+
 from asynctest import mock
 
 import pytest
+import serial
 import serial_asyncio
+import voluptuous as vol
 
 from zigpy_cc import uart
+from zigpy_cc.exception import OutboundQueueFull
 import zigpy_cc.config
 
 DEVICE_CONFIG = zigpy_cc.config.SCHEMA_DEVICE(
@@ -37,6 +44,102 @@ async def test_connect(monkeypatch):
     await uart.connect(DEVICE_CONFIG, api)
 
 
+@pytest.mark.asyncio
+async def test_connect_socket():
+    api = mock.MagicMock()
+    frames = [
+        uart.UnpiFrame(3, 1, 2, b"\x01\x02"),
+        uart.UnpiFrame(2, 1, 2, b"\x00" * 200),
+    ]
+    received = asyncio.Queue()
+    done = asyncio.Event()
+
+    async def handle(reader, writer):
+        # replay frames split across writes, as a serial bridge would
+        data = b"".join(f.to_buffer() for f in frames)
+        writer.write(data[:3])
+        await writer.drain()
+        await asyncio.sleep(0.01)
+        writer.write(data[3:])
+        await writer.drain()
+        received.put_nowait(await reader.read(100))
+        await done.wait()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    config = zigpy_cc.config.SCHEMA_DEVICE(
+        {zigpy_cc.config.CONF_DEVICE_PATH: "socket://127.0.0.1:{}".format(port)}
+    )
+
+    gw = await uart.connect(config, api)
+    try:
+        sock = gw._transport.get_extra_info("socket")
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+        assert api.data_received.call_count == 2
+        for call, frame in zip(api.data_received.call_args_list, frames):
+            assert call[0][0].to_buffer() == frame.to_buffer()
+
+        assert await asyncio.wait_for(received.get(), 1) == b"\xef"
+    finally:
+        done.set()
+        gw.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_socket_path_validation():
+    for path in ("socket://192.168.1.5:6638", "tcp://zigbee.local:8888"):
+        config = zigpy_cc.config.SCHEMA_DEVICE({zigpy_cc.config.CONF_DEVICE_PATH: path})
+        assert config[zigpy_cc.config.CONF_DEVICE_PATH] == path
+
+    with pytest.raises(vol.Invalid):
+        zigpy_cc.config.SCHEMA_DEVICE(
+            {zigpy_cc.config.CONF_DEVICE_PATH: "http://192.168.1.5:6638"}
+        )
+
+
+def test_buffered_receive(gw):
+    data = uart.UnpiFrame(3, 1, 2, b"\x01\x02").to_buffer()
+    buf = gw.get_buffer(-1)
+    buf[: len(data) - 1] = data[:-1]
+    gw.buffer_updated(len(data) - 1)
+    assert gw._api.data_received.call_count == 0
+
+    buf = gw.get_buffer(-1)
+    buf[:1] = data[-1:]
+    gw.buffer_updated(1)
+    assert gw._api.data_received.call_count == 1
+    frame = gw._api.data_received.call_args[0][0]
+    assert bytes(frame.data) == b"\x01\x02"
+
+
+def test_buffered_receive_in_place(gw):
+    first = uart.UnpiFrame(3, 1, 2, b"\x01\x02").to_buffer()
+    second = uart.UnpiFrame(2, 4, 0x80, b"\x03\x04\x05").to_buffer()
+    data = first + second
+    buf = gw.get_buffer(-1)
+    buf[: len(data) - 2] = data[:-2]
+    gw.buffer_updated(len(data) - 2)
+    assert gw.bytes_received == len(data) - 2
+    frame = gw._api.data_received.call_args[0][0]
+    # only the incomplete frame is kept
+    assert gw._parser.buffer == second[:-2]
+
+    # the transport reuses the buffer, the frame doesn't see it
+    buf = gw.get_buffer(-1)
+    buf[:2] = second[-2:]
+    buf[2:10] = b"\x00" * 8
+    gw.buffer_updated(2)
+    assert frame.data == b"\x01\x02"
+    assert gw._api.data_received.call_count == 2
+    assert gw._api.data_received.call_args[0][0].data == b"\x03\x04\x05"
+    assert gw._parser.buffer == b""
+    assert gw._parser.frames == 2
+
+
 def test_write(gw):
     data = b"\x00"
     gw.write(data)
@@ -44,11 +147,150 @@ def test_write(gw):
     assert gw._transport.write.called_once_with(data)
 
 
+@pytest.mark.asyncio
+async def test_send_coalesced(gw):
+    frames = [uart.UnpiFrame(1, 1, 2, bytes([i])) for i in range(3)]
+    for frame in frames:
+        gw.send(frame)
+    assert gw._transport.write.call_count == 0
+    assert gw.queued == 3
+
+    await asyncio.sleep(0)
+    assert gw._transport.write.call_count == 1
+    assert gw._transport.write.call_args[0][0] == b"".join(
+        f.to_buffer() for f in frames
+    )
+    assert gw.queued == 0
+    assert gw.frames_sent == 3
+    assert gw.flushes == 1
+    assert gw.max_queued == 3
+
+
+@pytest.mark.asyncio
+async def test_send_paused(gw):
+    frame = uart.UnpiFrame(1, 1, 2, b"\x00")
+    gw.pause_writing()
+    gw.send(frame)
+    await asyncio.sleep(0)
+    assert gw._transport.write.call_count == 0
+
+    gw.resume_writing()
+    assert gw._transport.write.call_count == 1
+    assert gw._transport.write.call_args[0][0] == frame.to_buffer()
+
+
+@pytest.mark.asyncio
+async def test_send_queue_full(gw, monkeypatch):
+    monkeypatch.setattr(uart, "MaxOutboundFrames", 2)
+    frame = uart.UnpiFrame(1, 1, 2, b"\x00")
+    gw.pause_writing()
+    gw.send(frame)
+    gw.send(frame)
+    with pytest.raises(OutboundQueueFull):
+        gw.send(frame)
+    assert gw.queued == 2
+
+
+@pytest.mark.asyncio
+async def test_drain(gw):
+    await asyncio.wait_for(gw.drain(), 1)
+
+    gw.pause_writing()
+    assert gw.paused
+    drain = asyncio.ensure_future(gw.drain())
+    await asyncio.sleep(0)
+    assert not drain.done()
+
+    gw.resume_writing()
+    await asyncio.wait_for(drain, 1)
+    assert not gw.paused
+
+
+@pytest.mark.asyncio
+async def test_drain_connection_lost(gw):
+    gw.pause_writing()
+    drain = asyncio.ensure_future(gw.drain())
+    await asyncio.sleep(0)
+    gw.connection_lost(None)
+    with pytest.raises(serial.SerialException):
+        await drain
+
+
+def test_write_buffer_limits():
+    config = zigpy_cc.config.SCHEMA_DEVICE(
+        {
+            zigpy_cc.config.CONF_DEVICE_PATH: "/dev/null",
+            zigpy_cc.config.CONF_WRITE_BUFFER_HIGH: 512,
+            zigpy_cc.config.CONF_WRITE_BUFFER_LOW: 128,
+        }
+    )
+    gw = uart.Gateway(
+        mock.MagicMock(),
+        high_water=config[zigpy_cc.config.CONF_WRITE_BUFFER_HIGH],
+        low_water=config[zigpy_cc.config.CONF_WRITE_BUFFER_LOW],
+    )
+    transport = mock.MagicMock()
+    gw.connection_made(transport)
+    transport.set_write_buffer_limits.assert_called_once_with(512, 128)
+
+
+def test_write_buffer_limits_inverted():
+    with pytest.raises(vol.Invalid):
+        zigpy_cc.config.SCHEMA_DEVICE(
+            {
+                zigpy_cc.config.CONF_DEVICE_PATH: "/dev/null",
+                zigpy_cc.config.CONF_WRITE_BUFFER_HIGH: 128,
+                zigpy_cc.config.CONF_WRITE_BUFFER_LOW: 512,
+            }
+        )
+    # against the default high water mark
+    with pytest.raises(vol.Invalid):
+        zigpy_cc.config.SCHEMA_DEVICE(
+            {
+                zigpy_cc.config.CONF_DEVICE_PATH: "/dev/null",
+                zigpy_cc.config.CONF_WRITE_BUFFER_LOW: 8192,
+            }
+        )
+    with pytest.raises(vol.Invalid):
+        zigpy_cc.config.CONFIG_SCHEMA(
+            {
+                zigpy_cc.config.CONF_DEVICE: {
+                    zigpy_cc.config.CONF_DEVICE_PATH: "/dev/null",
+                    zigpy_cc.config.CONF_WRITE_BUFFER_HIGH: 0,
+                },
+            }
+        )
+    assert (
+        zigpy_cc.config.CONF_WRITE_BUFFER_HIGH in zigpy_cc.config.SCHEMA_DEVICE.schema
+    )
+
+
 def test_close(gw):
     gw.close()
     assert gw._transport.close.call_count == 1
 
 
+@pytest.mark.asyncio
+async def test_close_paused(gw):
+    frame = uart.UnpiFrame(1, 1, 2, b"\x00")
+    gw.pause_writing()
+    gw.send(frame)
+    gw.close()
+    gw._transport.write.assert_called_once_with(frame.to_buffer())
+    assert gw.queued == 0
+    assert gw._transport.close.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_connection_lost_cancels_flush(gw):
+    gw.send(uart.UnpiFrame(1, 1, 2, b"\x00"))
+    gw.connection_lost(None)
+    assert gw._flush_handle is None
+    assert gw.queued == 0
+    await asyncio.sleep(0)
+    assert gw._transport.write.call_count == 0
+
+
 def test_data_received_chunk_frame(gw):
     data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x00\x00\x00\x00\xda"
     gw.data_received(data[:-4])
@@ -93,10 +335,94 @@ def test_data_received_extra(gw):
     assert gw._parser.buffer == b"\xfe\x00"
 
 
+def test_data_received_partial_frame_quiet(gw, caplog):
+    caplog.set_level(logging.INFO, logger="zigpy_cc.uart")
+    gw.data_received(b"\xfe\x0ea\x02")
+    assert caplog.records == []
+
+    caplog.set_level(logging.DEBUG, logger="zigpy_cc.uart")
+    gw.data_received(b"\x02")
+    assert "Bytes received" in caplog.text
+
+
+def test_data_received_multiple_frames(gw):
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    gw.data_received(data * 3 + data[:5])
+    assert gw._api.data_received.call_count == 3
+    assert gw._parser.buffer == data[:5]
+    gw.data_received(data[5:])
+    assert gw._api.data_received.call_count == 4
+    assert gw._parser.buffer == b""
+
+
+def test_data_received_garbage(gw):
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    gw.data_received(b"\x00\x12\x34" + data + b"\x55\x66" + data)
+    assert gw._api.data_received.call_count == 2
+    assert gw.parser.frames == 2
+    assert gw.parser.dropped_bytes == 5
+    assert gw.bytes_received == 5 + 2 * len(data)
+    eq(
+        gw._api.data_received.call_args[0][0],
+        uart.UnpiFrame(3, 1, 2, data[4:-1], 14, 219),
+    )
+    assert gw._parser.buffer == b""
+
+
+def test_data_received_invalid_length(gw):
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    gw.data_received(b"\xfe\xff\x00\x00" + data)
+    assert gw._api.data_received.call_count == 1
+    assert gw.parser.dropped_bytes == 4
+    assert gw._parser.buffer == b""
+
+
+def test_parser_empty_frame():
+    parser = uart.Parser()
+    frames = parser.write(b"\xfe\x00\x41\x00\x41")
+    assert len(frames) == 1
+    assert frames[0].command_id == 0
+    assert frames[0].data == b""
+
+
+def test_parser_frames_share_chunk():
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    parser = uart.Parser()
+    frames = parser.write(data * 2)
+    assert len(frames) == 2
+    assert isinstance(frames[0].data, memoryview)
+    assert frames[0].data.readonly
+    assert frames[0].data.obj is frames[1].data.obj
+    assert frames[0].data == data[4:-1]
+    eq(frames[0], uart.UnpiFrame(3, 1, 2, data[4:-1], 14, 219))
+
+
 def test_data_received_wrong_checksum(gw):
     data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdc"
     gw.data_received(data)
     assert gw._api.data_received.call_count == 0
+    assert gw.parser.checksum_failures == 1
+    assert gw.parser.dropped_bytes == len(data)
+
+
+def test_data_received_unknown_subsystem(gw):
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    # valid checksum, subsystem 31
+    unknown = b"\xfe\x01\x7f\x00\x00\x7e"
+    gw.data_received(data + unknown + data)
+    assert gw._api.data_received.call_count == 2
+    assert gw.parser.dropped_bytes == len(unknown)
+    assert gw._parser.buffer == b""
+
+
+def test_data_received_resync_after_checksum(gw):
+    data = b"\xfe\x0ea\x02\x02\x00\x02\x06\x03\x90\x154\x01\x02\x01\x00\x00\x00\xdb"
+    # a stray SOF whose length covers the real frames behind it
+    gw.data_received(b"\xfe\x20" + data + data)
+    assert gw._api.data_received.call_count == 2
+    assert gw.parser.checksum_failures == 1
+    assert gw.parser.dropped_bytes == 2
+    assert gw._parser.buffer == b""
 
 
 @pytest.mark.skip("TODO")
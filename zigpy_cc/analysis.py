@@ -0,0 +1,278 @@
+"""
+Offline decoding of capture files, spread over a process pool
+
+The file is split into chunks on record boundaries, every worker decodes its
+chunk and pairs requests with their answers. Pairs straddling two chunks are
+completed when the chunk results are merged, in file order.
+
+    python -m zigpy_cc.analysis capture.bin --workers 8 --pairs pairs.csv
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from zigpy_cc.api import source_address
+from zigpy_cc.capture import CaptureReader, Direction
+from zigpy_cc.types import CommandType, Subsystem
+from zigpy_cc.zpi_object import ZpiObject
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+PAIR_SREQ = "sreq"
+PAIR_DATA_REQUEST = "data_request"
+
+# sender of a received frame, a NWK address or an IEEE address as text
+DeviceKey = Union[int, str]
+
+
+def _pair_key(obj: ZpiObject, direction: Direction):
+    """
+    (pair kind, key, is request) of a frame which is half of a pair, keys are
+    plain values so chunk results can be pickled
+    """
+    if obj.command_type == CommandType.SREQ and direction == Direction.TX:
+        if obj.subsystem == Subsystem.AF and obj.command.startswith("dataRequest"):
+            # answered by its SRSP too, the confirm is what matters here
+            return PAIR_DATA_REQUEST, obj.payload["transid"], True
+        return PAIR_SREQ, (int(obj.subsystem), obj.command), True
+    if obj.command_type == CommandType.SRSP:
+        if obj.subsystem == Subsystem.AF and obj.command.startswith("dataRequest"):
+            return None
+        return PAIR_SREQ, (int(obj.subsystem), obj.command), False
+    if (
+        obj.command_type == CommandType.AREQ
+        and obj.subsystem == Subsystem.AF
+        and obj.command == "dataConfirm"
+    ):
+        return PAIR_DATA_REQUEST, obj.payload["transid"], False
+    return None
+
+
+def _device_key(obj: ZpiObject) -> Optional[DeviceKey]:
+    """Sender of a received frame as a plain, picklable value"""
+    payload = obj.payload
+    if "srcaddr" not in payload:
+        return None
+    if obj.subsystem == Subsystem.AF and obj.command == "incomingMsgExt":
+        nwk, ieee = source_address(
+            payload["srcaddrmode"], payload["srcaddr"].serialize()
+        )
+        if ieee is not None:
+            return str(ieee)
+        return int(nwk)
+    return int(payload["srcaddr"])
+
+
+def _device_name(key: DeviceKey) -> str:
+    if isinstance(key, str):
+        return key
+    return "0x%04x" % key
+
+
+def decode_chunk(path: str, start: int, end: int) -> Dict[str, Any]:
+    """Decode the records between the offsets start and end of a capture"""
+    commands: Dict[str, int] = {}
+    devices: Dict[DeviceKey, List[int]] = {}
+    # pairs completed in the chunk: kind, command, request time, latency
+    pairs: Tuple[List, List, List, List] = ([], [], [], [])
+    # requests still waiting at the end of the chunk, answers without their
+    # request at the start of it
+    pending: Dict[tuple, Tuple[int, str]] = {}
+    unmatched: List[Tuple[tuple, int]] = []
+    frames = undecodable = 0
+
+    with CaptureReader(path) as reader:
+        for record in reader.records(start, end):
+            frames += 1
+            try:
+                frame = record.frame()
+                obj = ZpiObject.from_unpi_frame(frame)
+            except Exception:
+                undecodable += 1
+                continue
+
+            name = "{} {} {} {}".format(
+                record.direction.name,
+                CommandType(obj.command_type).name,
+                Subsystem(obj.subsystem).name,
+                obj.command,
+            )
+            commands[name] = commands.get(name, 0) + 1
+
+            key = _device_key(obj) if record.direction == Direction.RX else None
+            if key is not None:
+                device = devices.get(key)
+                if device is None:
+                    devices[key] = [1, record.timestamp, record.timestamp]
+                else:
+                    device[0] += 1
+                    device[2] = record.timestamp
+
+            pair = _pair_key(obj, record.direction)
+            if pair is None:
+                continue
+            kind, key, is_request = pair
+            if is_request:
+                pending[(kind, key)] = (record.timestamp, obj.command)
+                continue
+            request = pending.pop((kind, key), None)
+            if request is None:
+                unmatched.append(((kind, key), record.timestamp))
+                continue
+            pairs[0].append(kind)
+            pairs[1].append(request[1])
+            pairs[2].append(request[0])
+            pairs[3].append(record.timestamp - request[0])
+        # let go of the views into the file before it is unmapped
+        record = frame = None
+
+    return {
+        "frames": frames,
+        "undecodable": undecodable,
+        "commands": commands,
+        "devices": devices,
+        "pairs": pairs,
+        "pending": pending,
+        "unmatched": unmatched,
+    }
+
+
+def _percentiles(values: List[int]) -> Dict[str, float]:
+    ordered = sorted(values)
+    res = {"count": len(ordered)}
+    if not ordered:
+        return res
+    for p in (50, 90, 99):
+        res["p%d_ms" % p] = (
+            ordered[min(len(ordered) - 1, len(ordered) * p // 100)] / 1e6
+        )
+    res["max_ms"] = ordered[-1] / 1e6
+    return res
+
+
+def merge(results) -> Dict[str, Any]:
+    """Combine chunk results, given in file order"""
+    commands: Dict[str, int] = {}
+    devices: Dict[DeviceKey, List[int]] = {}
+    columns = {"kind": [], "command": [], "request_ns": [], "latency_ns": []}
+    pending: Dict[tuple, Tuple[int, str]] = {}
+    frames = undecodable = 0
+
+    for res in results:
+        frames += res["frames"]
+        undecodable += res["undecodable"]
+        for name, count in res["commands"].items():
+            commands[name] = commands.get(name, 0) + count
+        for key, (count, first, last) in res["devices"].items():
+            device = devices.get(key)
+            if device is None:
+                devices[key] = [count, first, last]
+            else:
+                device[0] += count
+                device[2] = last
+
+        # answers at the start of this chunk complete the previous ones
+        for key, timestamp in res["unmatched"]:
+            request = pending.pop(key, None)
+            if request is None:
+                continue
+            columns["kind"].append(key[0])
+            columns["command"].append(request[1])
+            columns["request_ns"].append(request[0])
+            columns["latency_ns"].append(timestamp - request[0])
+        pending.update(res["pending"])
+
+        for name, column in zip(
+            ("kind", "command", "request_ns", "latency_ns"), res["pairs"]
+        ):
+            columns[name].extend(column)
+
+    latency: Dict[str, Dict[str, Any]] = {}
+    by_command: Dict[Tuple[str, str], List[int]] = {}
+    for kind, command, value in zip(
+        columns["kind"], columns["command"], columns["latency_ns"]
+    ):
+        by_command.setdefault((kind, command), []).append(value)
+    for (kind, command), values in sorted(by_command.items()):
+        latency.setdefault(kind, {})[command] = _percentiles(values)
+
+    rates = {}
+    # NWK addresses first, then IEEE addresses
+    for key, (count, first, last) in sorted(
+        devices.items(), key=lambda item: (isinstance(item[0], str), item[0])
+    ):
+        seconds = (last - first) / 1e9
+        rates[_device_name(key)] = {
+            "messages": count,
+            "per_minute": count * 60 / seconds if seconds > 0 else None,
+        }
+
+    return {
+        "frames": frames,
+        "undecodable": undecodable,
+        "unanswered": len(pending),
+        "commands": dict(sorted(commands.items())),
+        "devices": rates,
+        "latency": latency,
+        "pairs": columns,
+    }
+
+
+def analyse(
+    path: str, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Dict[str, Any]:
+    """
+    Summary of a capture: counts per command, message rates per device and
+    SREQ->SRSP, dataRequest->dataConfirm latencies, also as columns in "pairs"
+
+    workers=0 decodes in this process.
+    """
+    with CaptureReader(path) as reader:
+        offsets = list(reader.offsets(chunk_size))
+    if not offsets:
+        return merge([])
+    bounds = list(zip(offsets, offsets[1:] + [os.path.getsize(path)]))
+
+    if workers == 0 or len(bounds) == 1:
+        results = [decode_chunk(path, start, end) for start, end in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    decode_chunk,
+                    [path] * len(bounds),
+                    [start for start, _ in bounds],
+                    [end for _, end in bounds],
+                )
+            )
+    return merge(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m zigpy_cc.analysis")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, default=None, help="default: CPUs")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--pairs", help="write the request/answer pairs as CSV")
+    args = parser.parse_args(argv)
+
+    summary = analyse(args.path, args.workers, args.chunk_size)
+    pairs = summary.pop("pairs")
+    if args.pairs:
+        with open(args.pairs, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(pairs))
+            writer.writerows(zip(*pairs.values()))
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,30 @@
 import asyncio
+import collections
+import functools
+import heapq
 import logging
-from typing import Any, Dict, Optional
+import struct
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 import serial
 import zigpy.exceptions
+import zigpy.types
 
-from zigpy_cc import uart
+from zigpy_cc import registry, uart
 from zigpy_cc.config import CONF_DEVICE_PATH, SCHEMA_DEVICE
-from zigpy_cc.definition import Definition
 from zigpy_cc.exception import CommandError
-from zigpy_cc.types import CommandType, Repr, Subsystem, Timeouts
+from zigpy_cc.scheduler import PriorityLock
+from zigpy_cc.stats import CommandStats, Stats
+from zigpy_cc.tracing import TraceEvent, Tracer, request_ids, trace
+from zigpy_cc.types import (
+    AddressMode,
+    CommandType,
+    Priority,
+    Repr,
+    Subsystem,
+    Timeouts,
+)
 from zigpy_cc.uart import Gateway
 from zigpy_cc.zpi_object import ZpiObject
 
@@ -17,6 +32,33 @@ LOGGER = logging.getLogger(__name__)
 
 COMMAND_TIMEOUT = 2
 
+# AF incomingMsg and incomingMsgExt, only the fields the application uses:
+# clusterid, srcaddr(mode), srcendpoint, dstendpoint, linkquality and len
+INCOMING_MSG = struct.Struct("<2xHHBBxB6xB")
+INCOMING_MSG_EXT = struct.Struct("<2xHB8sB2xBxB6xH")
+INCOMING_MSG_ID = registry.get_command(Subsystem.AF, "incomingMsg").id
+INCOMING_MSG_EXT_ID = registry.get_command(Subsystem.AF, "incomingMsgExt").id
+INCOMING_KEYS = {
+    INCOMING_MSG_ID: (CommandType.AREQ, Subsystem.AF, "incomingMsg"),
+    INCOMING_MSG_EXT_ID: (CommandType.AREQ, Subsystem.AF, "incomingMsgExt"),
+}
+
+# commands with an API._handle_<command> method
+HANDLERS = (
+    (Subsystem.SYS, "version"),
+    (Subsystem.UTIL, "getDeviceInfo"),
+    (Subsystem.SAPI, "getDeviceInfo"),
+)
+
+Handler = Callable[[ZpiObject], Any]
+
+
+def source_address(mode, address: bytes):
+    """(nwk, ieee) of the sender of an incomingMsgExt, one of them is None"""
+    if mode == AddressMode.ADDR_64BIT:
+        return None, zigpy.types.EUI64(address)
+    return zigpy.types.NWK(int.from_bytes(address[:2], "little")), None
+
 
 class Matcher(Repr):
     def __init__(self, command_type, subsystem, command, payload):
@@ -24,6 +66,15 @@ class Matcher(Repr):
         self.subsystem = subsystem
         self.command = command
         self.payload = payload
+        # precomputed lookup keys for Waiters
+        self.key = (command_type, subsystem, command)
+        self.fields = tuple(payload) if payload else ()
+        self.values = tuple(payload.values()) if payload else ()
+        try:
+            hash(self.values)
+            self.hashable = True
+        except TypeError:
+            self.hashable = False
 
 
 class Waiter(Repr):
@@ -41,10 +92,21 @@ class Waiter(Repr):
         self.matcher = Matcher(command_type, subsystem, command, payload)
         self.future = asyncio.get_event_loop().create_future()
         self.timeout = timeout
+        self.deadline = None
         self.sequence = sequence
+        # monotonic time the request this waiter answers was written
+        self.sent: Optional[float] = None
 
     async def wait(self):
-        return await asyncio.wait_for(self.future, self.timeout / 1000)
+        """Result of the matched frame, the Waiters deadline raises TimeoutError"""
+        return await self.future
+
+    def set_timeout(self) -> None:
+        if self.future.done():
+            return
+        self.future.set_exception(asyncio.TimeoutError())
+        # nobody might ever await this one, don't log it as never retrieved
+        self.future.exception()
 
     def set_result(self, result) -> None:
         if self.future.cancelled():
@@ -71,14 +133,177 @@ class Waiter(Repr):
         return True
 
 
+class Waiters:
+    """Pending waiters, indexed by what they match on
+
+    (command_type, subsystem, command) -> payload fields -> payload values ->
+    waiters in FIFO order, so resolving a frame is a few dict lookups.
+
+    Timeouts are kept in a single heap of deadlines served by one timer, which
+    expires every overdue waiter at once. Resolved and re-armed waiters leave
+    their heap entry behind, it is skipped when it comes due. A waiter added
+    without a timeout has no deadline until it is armed.
+
+    Waiters matching on unhashable values, lists say, can't be indexed by
+    them and are matched one by one after the indexed ones.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[int, Waiter] = {}
+        self._index: Dict[tuple, Dict[tuple, Dict[tuple, Deque[Waiter]]]] = {}
+        self._unindexed: Dict[tuple, List[Waiter]] = {}
+        self._deadlines: List[Tuple[float, int]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def __contains__(self, waiter_id) -> bool:
+        return waiter_id in self._waiters
+
+    def __iter__(self):
+        return iter(self._waiters)
+
+    def get(self, waiter_id) -> Optional[Waiter]:
+        return self._waiters.get(waiter_id)
+
+    def waiting_for(self, key: tuple) -> bool:
+        """Any waiter for (command_type, subsystem, command)"""
+        return key in self._index or key in self._unindexed
+
+    def add(self, waiter: Waiter):
+        self._waiters[waiter.id] = waiter
+        if waiter.timeout is not None:
+            self._schedule(waiter)
+        matcher = waiter.matcher
+        if not matcher.hashable:
+            self._unindexed.setdefault(matcher.key, []).append(waiter)
+            return
+        by_fields = self._index.setdefault(matcher.key, {})
+        by_values = by_fields.setdefault(matcher.fields, {})
+        by_values.setdefault(matcher.values, collections.deque()).append(waiter)
+
+    def pop(self, waiter_id) -> Waiter:
+        waiter = self._waiters.pop(waiter_id)
+        matcher = waiter.matcher
+        if not matcher.hashable:
+            waiters = self._unindexed[matcher.key]
+            waiters.remove(waiter)
+            if not waiters:
+                del self._unindexed[matcher.key]
+            return waiter
+        by_fields = self._index[matcher.key]
+        by_values = by_fields[matcher.fields]
+        waiters = by_values[matcher.values]
+        waiters.remove(waiter)
+        if not waiters:
+            del by_values[matcher.values]
+            if not by_values:
+                del by_fields[matcher.fields]
+                if not by_fields:
+                    del self._index[matcher.key]
+        return waiter
+
+    def arm(self, waiter_id, timeout):
+        """Expire a pending waiter timeout ms from now"""
+        waiter = self._waiters.get(waiter_id)
+        if waiter is None:
+            return
+        waiter.timeout = timeout
+        self._schedule(waiter)
+
+    def _schedule(self, waiter: Waiter):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + waiter.timeout / 1000
+        waiter.deadline = deadline
+
+        if len(self._deadlines) > 64 and len(self._deadlines) > 2 * len(self):
+            self._deadlines = [d for d in self._deadlines if d[1] in self._waiters]
+            heapq.heapify(self._deadlines)
+        heapq.heappush(self._deadlines, (deadline, waiter.id))
+
+        if self._timer is None or deadline < self._timer.when():
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = loop.call_at(deadline, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        deadlines = self._deadlines
+
+        while deadlines and deadlines[0][0] <= now:
+            deadline, waiter_id = heapq.heappop(deadlines)
+            waiter = self._waiters.get(waiter_id)
+            if waiter is None or waiter.deadline != deadline:
+                continue
+
+            self.pop(waiter_id)
+            matcher = waiter.matcher
+            LOGGER.warning(
+                "No response for: %s %s %s %s",
+                CommandType(matcher.command_type).name,
+                Subsystem(matcher.subsystem).name,
+                matcher.command,
+                matcher.payload,
+            )
+            self.expired += 1
+            waiter.set_timeout()
+
+        while deadlines and deadlines[0][1] not in self._waiters:
+            heapq.heappop(deadlines)
+        if deadlines:
+            self._timer = loop.call_at(deadlines[0][0], self._expire)
+
+    def resolve(self, obj: ZpiObject):
+        """Hand obj to the waiters it matches, oldest first
+
+        Stops at the first waiter carrying a sequence, which then also tags obj.
+        """
+        key = (obj.command_type, obj.subsystem, obj.command)
+        by_fields = self._index.get(key)
+        if by_fields:
+            payload = obj.payload
+            for fields in list(by_fields):
+                try:
+                    waiters = by_fields[fields].get(tuple(payload[f] for f in fields))
+                except (KeyError, TypeError):
+                    continue
+                while waiters:
+                    waiter = self.pop(waiters[0].id)
+                    waiter.set_result(obj)
+                    if waiter.sequence:
+                        obj.sequence = waiter.sequence
+                        return
+
+        unindexed = self._unindexed.get(key)
+        if unindexed:
+            for waiter in list(unindexed):
+                if not waiter.match(obj):
+                    continue
+                self.pop(waiter.id)
+                waiter.set_result(obj)
+                if waiter.sequence:
+                    obj.sequence = waiter.sequence
+                    return
+
+
 class API:
     _uart: Optional[Gateway]
 
     def __init__(self, device_config: Dict[str, Any]):
         self._config = device_config
-        self._lock = asyncio.Lock()
+        self._lock = PriorityLock()
         self._waiter_id = 0
-        self._waiters: Dict[int, Waiter] = {}
+        self._waiters = Waiters()
+        self._stats = Stats()
+        self._tracer: Optional[Tracer] = None
+        # (subsystem, command id) -> callbacks for every received frame
+        self._handlers: Dict[Tuple[Subsystem, int], Tuple[Handler, ...]] = {}
+        for subsystem, command in HANDLERS:
+            self.add_handler(subsystem, command, getattr(self, "_handle_" + command))
         self._app = None
         self._proto_ver = None
         self._uart = None
@@ -110,15 +335,79 @@ class API:
     def connection_lost(self):
         self._app.connection_lost()
 
+    def set_tracer(self, tracer: Optional[Tracer]):
+        """Call tracer(event, command, tsn, nwk, **info), see zigpy_cc.tracing"""
+        self._tracer = tracer
+
+    def add_handler(self, subsystem: Subsystem, command: str, handler: Handler):
+        """Call handler(obj) for every received frame of the command"""
+        cmd = registry.get_command(subsystem, command)
+        key = (cmd.subsystem, cmd.id)
+        self._handlers[key] = self._handlers.get(key, ()) + (handler,)
+
+    def remove_handler(self, subsystem: Subsystem, command: str, handler: Handler):
+        """Undo add_handler, ValueError if handler is not registered for command"""
+        cmd = registry.get_command(subsystem, command)
+        key = (cmd.subsystem, cmd.id)
+        handlers = list(self._handlers.get(key, ()))
+        if handler not in handlers:
+            raise ValueError(
+                "{} is not a handler for {} {}".format(handler, subsystem, command)
+            )
+        handlers.remove(handler)
+        if handlers:
+            self._handlers[key] = tuple(handlers)
+        else:
+            del self._handlers[key]
+
+    def handles(self, obj: ZpiObject) -> bool:
+        """Any handler registered for the command of obj"""
+        return (obj.subsystem, obj.command_id) in self._handlers
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the request counters and latency histograms"""
+        res = self._stats.snapshot()
+        res["waiters"] = len(self._waiters)
+        res["expired_waiters"] = self._waiters.expired
+        return res
+
     async def request(
-        self, subsystem, command, payload, waiter_id=None, expected_status=None
+        self,
+        subsystem,
+        command,
+        payload,
+        waiter_id=None,
+        expected_status=None,
+        priority=Priority.NORMAL,
     ):
         obj = ZpiObject.from_command(subsystem, command, payload)
-        return await self.request_raw(obj, waiter_id, expected_status)
+        return await self.request_raw(obj, waiter_id, expected_status, priority)
 
-    async def request_raw(self, obj: ZpiObject, waiter_id=None, expected_status=None):
-        async with self._lock:
+    async def request_raw(
+        self,
+        obj: ZpiObject,
+        waiter_id=None,
+        expected_status=None,
+        priority=Priority.NORMAL,
+    ):
+        tracer = self._tracer
+        if tracer is not None:
+            tsn, nwk = request_ids(obj)
+            trace(tracer, TraceEvent.ENQUEUE, obj.command, tsn, nwk, priority=priority)
+
+        stats = self._stats
+        stats.enqueue()
+        started = time.monotonic()
+        try:
+            await self._lock.acquire(priority)
+        finally:
+            stats.dequeue(time.monotonic() - started)
+        try:
+            if tracer is not None:
+                trace(tracer, TraceEvent.LOCK_ACQUIRED, obj.command, tsn, nwk)
             return await self._request_raw(obj, waiter_id, expected_status)
+        finally:
+            self._lock.release()
 
     async def _request_raw(self, obj: ZpiObject, waiter_id=None, expected_status=None):
         if expected_status is None:
@@ -126,6 +415,14 @@ class API:
 
         LOGGER.debug("--> %s", obj)
         frame = obj.to_unpi_frame()
+        # hold the sender while the transport is over its high water mark,
+        # before any response timeout starts running
+        await self._uart.drain()
+        stats = self._stats.command(obj.subsystem, obj.command)
+        stats.count += 1
+        tracer = self._tracer
+        if tracer is not None:
+            tsn, nwk = request_ids(obj)
 
         if obj.command_type == CommandType.SREQ:
             timeout = (
@@ -138,13 +435,44 @@ class API:
                 CommandType.SRSP, obj.subsystem, obj.command, {}, timeout
             )
             self._uart.send(frame)
-            result = await waiter.wait()
+            started = time.monotonic()
+            if waiter_id is not None:
+                response = self._waiters.get(waiter_id)
+                if response is not None:
+                    response.sent = started
+            if tracer is not None:
+                trace(tracer, TraceEvent.FRAME_WRITTEN, obj.command, tsn, nwk)
+            try:
+                result = await waiter.wait()
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                if tracer is not None:
+                    trace(
+                        tracer,
+                        TraceEvent.TIMEOUT,
+                        obj.command,
+                        tsn,
+                        nwk,
+                        waiting_for="SRSP",
+                    )
+                raise
+            stats.latency.observe(time.monotonic() - started)
+            if tracer is not None:
+                trace(
+                    tracer,
+                    TraceEvent.SRSP,
+                    obj.command,
+                    tsn,
+                    nwk,
+                    status=result.payload.get("status"),
+                )
             if (
                 result
                 and "status" in result.payload
                 and result.payload["status"] not in expected_status
             ):
-                if waiter_id is not None:
+                stats.error(result.payload["status"])
+                if waiter_id is not None and waiter_id in self._waiters:
                     self._waiters.pop(waiter_id).set_result(result)
 
                 raise CommandError(
@@ -161,36 +489,103 @@ class API:
             )
             # TODO clear queue, requests waiting for lock
             self._uart.send(frame)
+            if tracer is not None:
+                trace(tracer, TraceEvent.FRAME_WRITTEN, obj.command, tsn, nwk)
             return await waiter.wait()
         else:
             if obj.command_type == CommandType.AREQ:
                 self._uart.send(frame)
+                if tracer is not None:
+                    trace(tracer, TraceEvent.FRAME_WRITTEN, obj.command, tsn, nwk)
                 return None
             else:
                 LOGGER.warning("Unknown type '%s'", obj.command_type)
                 raise Exception("Unknown type '{}'".format(obj.command_type))
 
-    def create_response_waiter(self, obj: ZpiObject, sequence=None):
+    def create_response_waiter(
+        self, obj: ZpiObject, sequence=None, timeout=Timeouts.default
+    ):
         if obj.command_type == CommandType.SREQ and obj.command.startswith(
             "dataRequest"
         ):
             payload = {
                 "transid": obj.payload["transid"],
             }
-            return self.wait_for(CommandType.AREQ, Subsystem.AF, "dataConfirm", payload)
-
-        if obj.command_type == CommandType.SREQ and obj.command.endswith("Req"):
-            rsp = obj.command.replace("Req", "Rsp")
-            for cmd in Definition[obj.subsystem]:
-                if rsp == cmd["name"]:
-                    payload = {"srcaddr": obj.payload["dstaddr"]}
-                    return self.wait_for(
-                        CommandType.AREQ, Subsystem.ZDO, rsp, payload, sequence=sequence
+            waiter = self.wait_for(
+                CommandType.AREQ, Subsystem.AF, "dataConfirm", payload, timeout
+            )
+            stats = self._stats.confirm(obj.subsystem, obj.command)
+            stats.count += 1
+            waiter.future.add_done_callback(
+                functools.partial(self._confirmed, stats, obj, waiter)
+            )
+            return waiter
+
+        if obj.command_type == CommandType.SREQ:
+            rsp = registry.get_response_command(obj.subsystem, obj.command)
+            if rsp is not None:
+                payload = {"srcaddr": obj.payload["dstaddr"]}
+                waiter = self.wait_for(
+                    CommandType.AREQ,
+                    Subsystem.ZDO,
+                    rsp,
+                    payload,
+                    timeout,
+                    sequence=sequence,
+                )
+                if self._tracer is not None:
+                    waiter.future.add_done_callback(
+                        functools.partial(self._replied, obj, rsp)
                     )
+                return waiter
 
         LOGGER.warning("no response cmd configured for %s", obj.command)
         return None
 
+    def _confirmed(
+        self,
+        stats: CommandStats,
+        obj: ZpiObject,
+        waiter: Waiter,
+        future: asyncio.Future,
+    ):
+        if future.cancelled():
+            return
+        tracer = self._tracer
+        if future.exception() is not None:
+            stats.timeouts += 1
+            if tracer is not None:
+                tsn, nwk = request_ids(obj)
+                trace(
+                    tracer,
+                    TraceEvent.TIMEOUT,
+                    obj.command,
+                    tsn,
+                    nwk,
+                    waiting_for="dataConfirm",
+                )
+            return
+        # from the frame leaving for the adapter, lock and queue time are
+        # in the lock_wait histogram
+        if waiter.sent is not None:
+            stats.latency.observe(time.monotonic() - waiter.sent)
+        status = future.result().payload.get("status", 0)
+        if status != 0:
+            stats.error(status)
+        if tracer is not None:
+            tsn, nwk = request_ids(obj)
+            trace(tracer, TraceEvent.DATA_CONFIRM, obj.command, tsn, nwk, status=status)
+
+    def _replied(self, obj: ZpiObject, rsp: str, future: asyncio.Future):
+        tracer = self._tracer
+        if future.cancelled() or tracer is None:
+            return
+        tsn, nwk = request_ids(obj)
+        if future.exception() is not None:
+            trace(tracer, TraceEvent.TIMEOUT, obj.command, tsn, nwk, waiting_for=rsp)
+        else:
+            trace(tracer, TraceEvent.REPLY, obj.command, tsn, nwk)
+
     def wait_for(
         self,
         command_type: CommandType,
@@ -209,52 +604,98 @@ class API:
             timeout,
             sequence,
         )
-        self._waiters[waiter.id] = waiter
+        self._waiters.add(waiter)
         self._waiter_id += 1
 
-        def callback():
-            if not waiter.future.done() or waiter.future.cancelled():
-                LOGGER.warning(
-                    "No response for: %s %s %s %s",
-                    command_type.name,
-                    subsystem.name,
-                    command,
-                    payload,
-                )
-                try:
-                    self._waiters.pop(waiter.id)
-                except KeyError:
-                    LOGGER.warning("Waiter not found: %s", waiter)
+        return waiter
 
-        asyncio.get_event_loop().call_later(timeout / 1000 + 0.1, callback)
+    def arm_waiter(self, waiter: Waiter, timeout=Timeouts.default):
+        """Start the timeout of a waiter, over again if it had one"""
+        self._waiters.arm(waiter.id, timeout)
 
-        return waiter
+    def cancel_waiter(self, waiter: Waiter):
+        if waiter.id in self._waiters:
+            self._waiters.pop(waiter.id)
+        waiter.future.cancel()
 
     def data_received(self, frame):
+        key = INCOMING_KEYS.get(frame.command_id)
+        if (
+            key is not None
+            and frame.subsystem == Subsystem.AF
+            and frame.command_type == CommandType.AREQ
+            and self._app is not None
+            and not self._waiters.waiting_for(key)
+            and (Subsystem.AF, frame.command_id) not in self._handlers
+            and self._incoming(frame, key[2])
+        ):
+            return
+
         try:
             obj = ZpiObject.from_unpi_frame(frame)
         except Exception as e:
             LOGGER.error("Error while parsing frame: %s", frame)
             raise e
 
-        for waiter_id in list(self._waiters):
-            waiter = self._waiters.get(waiter_id)
-            if waiter.match(obj):
-                self._waiters.pop(waiter_id)
-                waiter.set_result(obj)
-                if waiter.sequence:
-                    obj.sequence = waiter.sequence
-                    break
+        self._waiters.resolve(obj)
 
         LOGGER.debug("<-- %s", obj)
 
         if self._app is not None:
             self._app.handle_znp(obj)
 
-        try:
-            getattr(self, "_handle_%s" % (obj.command,))(obj)
-        except AttributeError:
-            pass
+        handlers = self._handlers.get((obj.subsystem, obj.command_id))
+        if handlers is not None:
+            for handler in handlers:
+                try:
+                    handler(obj)
+                except Exception as e:
+                    LOGGER.warning(
+                        "Handler %s failed on %s: %s", handler, obj.command, e
+                    )
+
+    def _incoming(self, frame, command: str) -> bool:
+        """
+        Hand a ZCL frame straight to the application, without a ZpiObject.
+        False leaves malformed frames to the generic path.
+        """
+        data = frame.data
+        if command == "incomingMsg":
+            if len(data) < INCOMING_MSG.size:
+                return False
+            cluster, nwk, src_ep, dst_ep, lqi, length = INCOMING_MSG.unpack_from(data)
+            nwk = zigpy.types.NWK(nwk)
+            ieee = None
+            start = INCOMING_MSG.size
+        else:
+            if len(data) < INCOMING_MSG_EXT.size:
+                return False
+            (
+                cluster,
+                mode,
+                address,
+                src_ep,
+                dst_ep,
+                lqi,
+                length,
+            ) = INCOMING_MSG_EXT.unpack_from(data)
+            nwk, ieee = source_address(mode, address)
+            start = INCOMING_MSG_EXT.size
+        if len(data) < start + length:
+            return False
+
+        LOGGER.debug("<-- AREQ AF %s from %s cluster %d", command, ieee or nwk, cluster)
+        self._app.handle_incoming(
+            command,
+            nwk,
+            ieee,
+            cluster,
+            src_ep,
+            dst_ep,
+            lqi,
+            bytes(data[start : start + length]),
+        )
+        return True
 
     async def version(self):
         version = await self.request(Subsystem.SYS, "version", {})
@@ -268,9 +709,6 @@ class API:
     def _handle_getDeviceInfo(self, data):
         LOGGER.info("Device info: %s", data.payload)
 
-    def _handle_srcRtgInd(self, data):
-        pass
-
     @classmethod
     async def probe(cls, device_config: Dict[str, Any]) -> bool:
         """Probe port for the device presence."""
@@ -1,8 +1,53 @@
 from collections.abc import Iterable
+import struct
 
 import zigpy.types
 from zigpy_cc.exception import TODO
-from zigpy_cc.types import AddressMode, ParameterType
+from zigpy_cc.types import ADDRESS_MODES, AddressMode, ParameterType
+
+
+_INT_STRUCTS = {
+    (1, False): struct.Struct("<B"),
+    (2, False): struct.Struct("<H"),
+    (4, False): struct.Struct("<I"),
+    (1, True): struct.Struct("<b"),
+}
+
+# BUFFER takes its length from the previous parameter
+BUFFER_SIZES = {
+    ParameterType.BUFFER: None,
+    ParameterType.BUFFER8: 8,
+    ParameterType.BUFFER16: 16,
+    ParameterType.BUFFER18: 18,
+    ParameterType.BUFFER32: 32,
+    ParameterType.BUFFER42: 42,
+    ParameterType.BUFFER100: 100,
+}
+
+
+def address_mode(value) -> AddressMode:
+    res = ADDRESS_MODES[value]
+    if res is None:
+        raise ValueError("%d is not a valid AddressMode" % (value,))
+    return res
+
+
+def coercion(name, type):
+    """
+    Conversion of a decoded integer parameter, picked by its name. Resolve it
+    once per parameter definition, see ParameterCodec.
+    """
+    if type == ParameterType.UINT8:
+        if name.endswith("addrmode"):
+            return address_mode
+    elif type == ParameterType.UINT16:
+        if (
+            name.endswith("addr")
+            or name.endswith("address")
+            or name.endswith("addrofinterest")
+        ):
+            return zigpy.types.NWK
+    return None
 
 
 class BuffaloOptions:
@@ -33,8 +78,18 @@ class Buffalo:
                     self.write(i)
             else:
                 self.write(value, 8)
+        elif type == ParameterType.INT8:
+            self.write(value, signed=True)
         elif type == ParameterType.BUFFER:
             self.buffer += value
+        elif type in BUFFER_SIZES:
+            if len(value) != BUFFER_SIZES[type]:
+                raise ValueError(
+                    "{} takes {} bytes, got {}".format(
+                        ParameterType(type).name, BUFFER_SIZES[type], len(value)
+                    )
+                )
+            self.buffer += value
         elif type == ParameterType.LIST_UINT8:
             for v in value:
                 self.write(v)
@@ -68,27 +123,26 @@ class Buffalo:
         self.write(value["lqi"])
 
     def read_parameter(self, name, type, options):
+        res = self.read_value(type, options)
+        convert = coercion(name, type)
+        if convert is not None:
+            res = convert(res)
+        return res
 
+    def read_value(self, type, options):
+        """read_parameter without the conversions picked by name"""
         if type == ParameterType.UINT8:
             res = self.read_int()
-            if name.endswith("addrmode"):
-                res = AddressMode(res)
         elif type == ParameterType.UINT16:
             res = self.read_int(2)
-            if (
-                name.endswith("addr")
-                or name.endswith("address")
-                or name.endswith("addrofinterest")
-            ):
-                res = zigpy.types.NWK(res)
         elif type == ParameterType.UINT32:
             res = self.read_int(4)
         elif type == ParameterType.IEEEADDR:
             res = self.read_ieee_addr()
-        elif ParameterType.is_buffer(type):
-            type_name = ParameterType(type).name
-            length = int(type_name.replace("BUFFER", "") or options.length)
-            res = self.read(length)
+        elif type in BUFFER_SIZES:
+            length = BUFFER_SIZES[type] or options.length
+            # buffers escape into the payload, don't keep the frame alive
+            res = bytes(self.read(length))
         elif type == ParameterType.INT8:
             res = self.read_int(signed=True)
         else:
@@ -103,13 +157,26 @@ class Buffalo:
             elif type == ParameterType.LIST_NEIGHBOR_LQI:
                 for i in range(0, options.length):
                     res.append(self.read_neighbor_lqi())
+            elif type == ParameterType.LIST_ASSOC_DEV:
+                # length counts every associated device, the list starts at
+                # startIndex
+                for i in range(0, options.length - (options.startIndex or 0)):
+                    res.append(self.read_int(2))
             else:
                 raise TODO("read type %d", type)
 
         return res
 
     def read_int(self, length=1, signed=False):
-        return int.from_bytes(self.read(length), "little", signed=signed)
+        int_struct = _INT_STRUCTS.get((length, signed))
+        if int_struct is None:
+            return int.from_bytes(self.read(length), "little", signed=signed)
+
+        if self.position + length > self._len:
+            raise OverflowError
+        res = int_struct.unpack_from(self.buffer, self.position)[0]
+        self.position += length
+        return res
 
     def read(self, length=1):
         if self.position + length > self._len:
@@ -0,0 +1,271 @@
+"""
+Binary capture of the UNPI traffic seen by the Gateway
+
+A capture file starts with MAGIC, followed by one record per frame: a
+RECORD header (frame length, direction, time.monotonic_ns()) and the frame
+as it went over the wire. The writer rotates files like
+logging.handlers.RotatingFileHandler, the reader maps a file into memory and
+walks its records lazily.
+
+    python -m zigpy_cc.capture dump capture.bin
+    python -m zigpy_cc.capture replay capture.bin --speed 10
+"""
+import argparse
+import asyncio
+import enum
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Iterator, Optional
+
+from zigpy_cc import config, uart
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"ZCCCAP\x00\x01"
+RECORD = struct.Struct("<HBQ")
+
+DEFAULT_BACKUP_COUNT = 3
+
+
+class Direction(enum.IntEnum):
+    RX = 0
+    TX = 1
+
+
+class CaptureWriter:
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = config.CONF_CAPTURE_MAX_BYTES_DEFAULT,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+        self._size = 0
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = "%s.%d" % (self.path, i)
+                if os.path.exists(source):
+                    os.replace(source, "%s.%d" % (self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, direction: Direction, *parts):
+        """Append one frame, given as the parts of its bytes"""
+        length = sum(len(part) for part in parts)
+        size = RECORD.size + length
+        if self.max_bytes and self._size + size > self.max_bytes:
+            self._rotate()
+
+        write = self._file.write
+        write(RECORD.pack(length, direction, time.monotonic_ns()))
+        for part in parts:
+            write(part)
+        self._size += size
+
+    def write_frame(self, direction: Direction, frame: "uart.UnpiFrame"):
+        data = frame.data
+        cmd0 = ((frame.command_type << 5) & 0xE0) | (frame.subsystem & 0x1F)
+        fcs = frame.fcs
+        if fcs is None:
+            fcs = frame.calculate_checksum(
+                bytes((len(data), cmd0, frame.command_id)) + bytes(data)
+            )
+        self.write(
+            direction,
+            bytes((uart.SOF, len(data), cmd0, frame.command_id)),
+            data,
+            bytes((fcs,)),
+        )
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _to_frame(data) -> Optional["uart.UnpiFrame"]:
+    if len(data) < uart.MinMessageLength:
+        return None
+    length = data[uart.PositionDataLength]
+    return uart.UnpiFrame.from_buffer(length, uart.DataStart + length, data)
+
+
+class CaptureRecord:
+    __slots__ = ("direction", "timestamp", "data")
+
+    def __init__(self, direction: Direction, timestamp: int, data: memoryview):
+        self.direction = direction
+        self.timestamp = timestamp
+        self.data = data
+
+    def frame(self) -> Optional["uart.UnpiFrame"]:
+        return _to_frame(self.data)
+
+    def __repr__(self) -> str:
+        return "<CaptureRecord direction=%s timestamp=%d data=%s>" % (
+            self.direction.name,
+            self.timestamp,
+            self.data.tobytes(),
+        )
+
+
+class CaptureReader:
+    """
+    Records reference the mapped file, copy what has to outlive the reader
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._mmap = None
+            self._view = memoryview(b"")
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if self._view[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not a capture file".format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        return self.records()
+
+    def records(self, start: int = None, end: int = None) -> Iterator[CaptureRecord]:
+        """Records between the byte offsets start and end"""
+        view = self._view
+        pos = len(MAGIC) if start is None else start
+        end = len(view) if end is None else min(end, len(view))
+        unpack_from = RECORD.unpack_from
+        header_size = RECORD.size
+
+        while pos + header_size <= end:
+            length, direction, timestamp = unpack_from(view, pos)
+            pos += header_size
+            if pos + length > end:
+                # torn write at the end of the file
+                break
+            yield CaptureRecord(
+                Direction(direction), timestamp, view[pos : pos + length]
+            )
+            pos += length
+
+    def offsets(self, chunk_size: int) -> Iterator[int]:
+        """Record boundaries about every chunk_size bytes, to split the file"""
+        view = self._view
+        unpack_from = RECORD.unpack_from
+        pos = next_offset = len(MAGIC)
+        while pos + RECORD.size <= len(view):
+            if pos >= next_offset:
+                yield pos
+                next_offset = pos + chunk_size
+            pos += RECORD.size + unpack_from(view, pos)[0]
+
+    def close(self):
+        self._view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # records still in use, unmapped once they are collected
+                pass
+            self._mmap = None
+        self._file.close()
+
+
+async def replay(path: str, api, speed: float = 1.0, direction=Direction.RX):
+    """
+    Feed the captured frames of direction into api.data_received, spaced as
+    they were captured divided by speed, or back to back if speed is 0
+    """
+    loop = asyncio.get_event_loop()
+    count = 0
+    with CaptureReader(path) as reader:
+        start = first = None
+        for record in reader:
+            if record.direction != direction:
+                continue
+            if speed:
+                if first is None:
+                    first, start = record.timestamp, loop.time()
+                delay = start + (record.timestamp - first) / 1e9 / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            # the frame escapes into the application, detach it from the file
+            frame = _to_frame(record.data.tobytes())
+            if frame is not None:
+                api.data_received(frame)
+                count += 1
+    return count
+
+
+def main(argv=None):
+    # the api imports uart, which imports this module
+    from zigpy_cc.api import API
+
+    parser = argparse.ArgumentParser(prog="python -m zigpy_cc.capture")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    dump = commands.add_parser("dump", help="print the captured frames")
+    dump.add_argument("path")
+    play = commands.add_parser("replay", help="feed received frames to an API")
+    play.add_argument("path")
+    play.add_argument("--speed", type=float, default=1.0, help="0: no delays")
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        with CaptureReader(args.path) as reader:
+            first = None
+            for record in reader:
+                if first is None:
+                    first = record.timestamp
+                print(
+                    "%12.6f %s %s"
+                    % (
+                        (record.timestamp - first) / 1e9,
+                        record.direction.name,
+                        record.frame(),
+                    )
+                )
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    api = API(config.SCHEMA_DEVICE({config.CONF_DEVICE_PATH: "auto"}))
+    started = time.perf_counter()
+    count = asyncio.get_event_loop().run_until_complete(
+        replay(args.path, api, args.speed)
+    )
+    LOGGER.info("Replayed %d frames in %.3fs", count, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Parameter lists compiled to a struct for the fixed-width prefix, with only
+the variable length tail going through Buffalo
+"""
+from collections.abc import Iterable
+import struct
+
+import zigpy.types
+from zigpy_cc.buffalo import Buffalo, BuffaloOptions, coercion
+from zigpy_cc.types import ParameterType
+
+BufferAndListTypes = [
+    ParameterType.BUFFER,
+    ParameterType.BUFFER8,
+    ParameterType.BUFFER16,
+    ParameterType.BUFFER18,
+    ParameterType.BUFFER32,
+    ParameterType.BUFFER42,
+    ParameterType.BUFFER100,
+    ParameterType.LIST_UINT16,
+    ParameterType.LIST_ROUTING_TABLE,
+    ParameterType.LIST_BIND_TABLE,
+    ParameterType.LIST_NEIGHBOR_LQI,
+    ParameterType.LIST_NETWORK,
+    ParameterType.LIST_ASSOC_DEV,
+    ParameterType.LIST_UINT8,
+]
+
+DECODE_FORMATS = {
+    ParameterType.UINT8: "B",
+    ParameterType.UINT16: "H",
+    ParameterType.UINT32: "I",
+    ParameterType.INT8: "b",
+    ParameterType.IEEEADDR: "8s",
+    ParameterType.BUFFER8: "8s",
+    ParameterType.BUFFER16: "16s",
+    ParameterType.BUFFER18: "18s",
+    ParameterType.BUFFER32: "32s",
+    ParameterType.BUFFER42: "42s",
+    ParameterType.BUFFER100: "100s",
+}
+
+# Buffalo.write_parameter only knows these fixed-width types
+ENCODE_FORMATS = {
+    ParameterType.UINT8: "B",
+    ParameterType.UINT16: "H",
+    ParameterType.UINT32: "I",
+    ParameterType.IEEEADDR: "8s",
+}
+
+
+def _decoder(name, param_type):
+    if param_type == ParameterType.IEEEADDR:
+        return zigpy.types.EUI64
+    return coercion(name, param_type)
+
+
+def _encode_ieee_addr(value):
+    if isinstance(value, Iterable):
+        return bytes(value)
+    return value.to_bytes(8, "little")
+
+
+def _fixed_prefix(parameters, formats):
+    count = 0
+    for p in parameters:
+        if p["parameterType"] not in formats:
+            break
+        count += 1
+    fmt = "".join(formats[p["parameterType"]] for p in parameters[:count])
+    return count, struct.Struct("<" + fmt)
+
+
+class ParameterCodec:
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+        count, self._decode_struct = _fixed_prefix(parameters, DECODE_FORMATS)
+        self._decode_names = tuple(p["name"] for p in parameters[:count])
+        conversions = []
+        for p in parameters[:count]:
+            convert = _decoder(p["name"], p["parameterType"])
+            if convert is not None:
+                conversions.append((p["name"], convert))
+        self._decode_conversions = tuple(conversions)
+        self._decode_tail = parameters[count:]
+        # (name, type, sized by the previous parameters, conversion)
+        self._tail_plan = tuple(
+            (
+                p["name"],
+                p["parameterType"],
+                p["parameterType"] in BufferAndListTypes,
+                coercion(p["name"], p["parameterType"]),
+            )
+            for p in self._decode_tail
+        )
+
+        count, self._encode_struct = _fixed_prefix(parameters, ENCODE_FORMATS)
+        self._encode_names = tuple(p["name"] for p in parameters[:count])
+        self._encode_conversions = tuple(
+            (i, _encode_ieee_addr)
+            for i, p in enumerate(parameters[:count])
+            if p["parameterType"] == ParameterType.IEEEADDR
+        )
+        self._encode_tail = parameters[count:]
+
+    def decode(self, data):
+        decode_struct = self._decode_struct
+        if len(data) < decode_struct.size:
+            raise OverflowError
+
+        names = self._decode_names
+        res = dict(zip(names, decode_struct.unpack_from(data)))
+        for name, convert in self._decode_conversions:
+            res[name] = convert(res[name])
+
+        if self._decode_tail:
+            length = res[names[-1]] if names else None
+            start_index = res[names[-2]] if len(names) > 1 else None
+            buffalo = Buffalo(data, decode_struct.size)
+            self._read_tail(buffalo, res, length, start_index)
+
+        return res
+
+    def _read_tail(self, buffalo, res, length, start_index):
+        for name, param_type, sized, convert in self._tail_plan:
+            options = BuffaloOptions()
+            if sized:
+                if isinstance(length, int):
+                    options.length = length
+
+                if param_type == ParameterType.LIST_ASSOC_DEV:
+                    if isinstance(start_index, int):
+                        options.startIndex = start_index
+
+            value = buffalo.read_value(param_type, options)
+            if convert is not None:
+                value = convert(value)
+            res[name] = value
+
+            # For LIST_ASSOC_DEV, we need to grab the start_index which is
+            # right before the length
+            start_index = length
+            # When reading a buffer, assume that the previous parsed parameter
+            # contains the length of the buffer
+            length = res[name]
+
+    def encode(self, payload) -> bytes:
+        values = [payload[name] for name in self._encode_names]
+        for i, convert in self._encode_conversions:
+            values[i] = convert(values[i])
+        data = self._encode_struct.pack(*values)
+
+        if self._encode_tail:
+            buffalo = Buffalo(data)
+            for p in self._encode_tail:
+                value = payload[p["name"]]
+                buffalo.write_parameter(p["parameterType"], value, {})
+            data = buffalo.buffer
+
+        return data
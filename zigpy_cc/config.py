@@ -11,15 +11,91 @@ CONF_DEVICE_BAUDRATE = "baudrate"
 CONF_DEVICE_BAUDRATE_DEFAULT = 115200
 CONF_FLOW_CONTROL = "flow_control"
 CONF_FLOW_CONTROL_DEFAULT = None
+CONF_WRITE_BUFFER_HIGH = "write_buffer_high"
+CONF_WRITE_BUFFER_HIGH_DEFAULT = 4096
+CONF_WRITE_BUFFER_LOW = "write_buffer_low"
+CONF_WRITE_BUFFER_LOW_DEFAULT = 1024
+CONF_CAPTURE_PATH = "capture_path"
+CONF_CAPTURE_MAX_BYTES = "capture_max_bytes"
+CONF_CAPTURE_MAX_BYTES_DEFAULT = 64 * 1024 * 1024
+CONF_CONFIRM_DELIVERY = "confirm_delivery"
+CONF_CONFIRM_DELIVERY_DEFAULT = False
+CONF_CONFIRM_TIMEOUT = "confirm_timeout"
+CONF_CONFIRM_TIMEOUT_DEFAULT = 10
+CONF_METRICS = "metrics"
+CONF_METRICS_HOST = "host"
+CONF_METRICS_HOST_DEFAULT = "127.0.0.1"
+CONF_METRICS_PORT = "port"
+CONF_METRICS_TEXTFILE = "textfile"
+CONF_METRICS_INTERVAL = "interval"
+CONF_METRICS_INTERVAL_DEFAULT = 15
 
-SCHEMA_DEVICE = vol.Schema(
+# network attached adapters, e.g. behind ser2net
+SOCKET_URL = r"^(socket|tcp)://[^:/]+:\d+/?$"
+
+
+class DeviceSchema(vol.Schema):
+    """
+    Also checks the write buffer limits against each other, keeping .schema and
+    .extend of a plain Schema
+    """
+
+    def __call__(self, data):
+        data = super().__call__(data)
+        low = data.get(CONF_WRITE_BUFFER_LOW, CONF_WRITE_BUFFER_LOW_DEFAULT)
+        high = data.get(CONF_WRITE_BUFFER_HIGH, CONF_WRITE_BUFFER_HIGH_DEFAULT)
+        if low > high:
+            raise vol.Invalid(
+                "{} ({}) is above {} ({})".format(
+                    CONF_WRITE_BUFFER_LOW, low, CONF_WRITE_BUFFER_HIGH, high
+                ),
+                path=[CONF_WRITE_BUFFER_LOW],
+            )
+        return data
+
+
+SCHEMA_DEVICE = DeviceSchema(
     {
-        vol.Required(CONF_DEVICE_PATH): vol.Any(vol.PathExists(), "auto"),
+        vol.Required(CONF_DEVICE_PATH): vol.Any(
+            vol.PathExists(), "auto", vol.Match(SOCKET_URL)
+        ),
         vol.Optional(CONF_DEVICE_BAUDRATE, default=CONF_DEVICE_BAUDRATE_DEFAULT): int,
         vol.Optional(CONF_FLOW_CONTROL, default=CONF_FLOW_CONTROL_DEFAULT): vol.In(
             ("hardware", "software", None)
         ),
+        vol.Optional(
+            CONF_WRITE_BUFFER_HIGH, default=CONF_WRITE_BUFFER_HIGH_DEFAULT
+        ): vol.All(int, vol.Range(min=0)),
+        vol.Optional(
+            CONF_WRITE_BUFFER_LOW, default=CONF_WRITE_BUFFER_LOW_DEFAULT
+        ): vol.All(int, vol.Range(min=0)),
+        vol.Optional(CONF_CAPTURE_PATH): str,
+        vol.Optional(
+            CONF_CAPTURE_MAX_BYTES, default=CONF_CAPTURE_MAX_BYTES_DEFAULT
+        ): vol.All(int, vol.Range(min=0)),
     }
 )
 
-CONFIG_SCHEMA = CONFIG_SCHEMA.extend({vol.Required(CONF_DEVICE): SCHEMA_DEVICE})
+SCHEMA_METRICS = vol.Schema(
+    {
+        vol.Optional(CONF_METRICS_HOST, default=CONF_METRICS_HOST_DEFAULT): str,
+        vol.Optional(CONF_METRICS_PORT): vol.All(int, vol.Range(min=0, max=65535)),
+        vol.Optional(CONF_METRICS_TEXTFILE): str,
+        vol.Optional(
+            CONF_METRICS_INTERVAL, default=CONF_METRICS_INTERVAL_DEFAULT
+        ): vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False)),
+    }
+)
+
+CONFIG_SCHEMA = CONFIG_SCHEMA.extend(
+    {
+        vol.Required(CONF_DEVICE): SCHEMA_DEVICE,
+        vol.Optional(
+            CONF_CONFIRM_DELIVERY, default=CONF_CONFIRM_DELIVERY_DEFAULT
+        ): cv_boolean,
+        vol.Optional(
+            CONF_CONFIRM_TIMEOUT, default=CONF_CONFIRM_TIMEOUT_DEFAULT
+        ): vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False)),
+        vol.Optional(CONF_METRICS): SCHEMA_METRICS,
+    }
+)
@@ -0,0 +1,566 @@
+"""
+In-process stand-in for a ZNP adapter, for load tests and benchmarks
+
+Speaks UNPI on the adapter side: SREQs are answered from the command
+definitions, data requests are confirmed and answered by virtual devices
+after a configurable latency, with optional loss and a limited number of
+buffers. Attach it in-process with Emulator.connect, a drop-in for
+uart.connect, or through a pty with Emulator.open_pty, which exercises the
+real serial_asyncio path.
+"""
+import asyncio
+import functools
+import logging
+import os
+import random
+import struct
+from typing import Any, Dict, List, Optional
+
+import zigpy.types
+
+from zigpy_cc import registry, uart
+from zigpy_cc.types import CommandType, ParameterType, Repr, Subsystem, ZnpVersion
+from zigpy_cc.zigbee.common import Common
+from zigpy_cc.zpi_object import ZpiObject
+
+LOGGER = logging.getLogger(__name__)
+
+SUCCESS = 0x00
+FAILURE = 0x01
+MEM_ERROR = 0x10
+NV_ITEM_UNINIT = 0x09
+MAC_NO_ACK = 0xE9
+
+ZCL_READ_ATTRIBUTES = 0x00
+ZCL_READ_ATTRIBUTES_RSP = 0x01
+ZCL_DEFAULT_RSP = 0x0B
+ZCL_UNSUPPORTED_ATTRIBUTE = 0x86
+ZCL_CHAR_STRING = 0x42
+
+_DEFAULTS = {
+    ParameterType.UINT8: 0,
+    ParameterType.UINT16: 0,
+    ParameterType.UINT32: 0,
+    ParameterType.INT8: 0,
+    ParameterType.IEEEADDR: bytes(8),
+    ParameterType.BUFFER: b"",
+    ParameterType.BUFFER8: bytes(8),
+    ParameterType.BUFFER16: bytes(16),
+    ParameterType.BUFFER18: bytes(18),
+    ParameterType.BUFFER32: bytes(32),
+    ParameterType.BUFFER42: bytes(42),
+    ParameterType.BUFFER100: bytes(100),
+    ParameterType.LIST_UINT8: [],
+    ParameterType.LIST_UINT16: [],
+}
+
+
+def _payload(parameters, **values):
+    payload = {p["name"]: _DEFAULTS.get(p["parameterType"]) for p in parameters}
+    payload.update(values)
+    return payload
+
+
+class VirtualDevice(Repr):
+    def __init__(
+        self,
+        nwk: int,
+        ieee: zigpy.types.EUI64,
+        manufacturer="zigpy-cc",
+        model="emulated",
+        in_clusters=(0x0000, 0x0006),
+        out_clusters=(),
+    ):
+        self.nwk = nwk
+        self.ieee = ieee
+        self.manufacturer = manufacturer
+        self.model = model
+        self.endpoint = 1
+        self.profile = 0x0104
+        self.device_type = 0x0100
+        self.in_clusters = list(in_clusters)
+        self.out_clusters = list(out_clusters)
+
+    def attributes(self, cluster: int) -> Dict[int, str]:
+        if cluster == 0x0000:
+            return {0x0004: self.manufacturer, 0x0005: self.model}
+        return {}
+
+
+class _Transport(asyncio.Transport):
+    """Delivers writes to the peer protocol on the next loop iteration"""
+
+    def __init__(self, loop, peer: asyncio.Protocol):
+        super().__init__()
+        self._loop = loop
+        self._peer = peer
+        self._closing = False
+
+    def write(self, data):
+        if not self._closing:
+            self._loop.call_soon(self._peer.data_received, bytes(data))
+
+    def writelines(self, list_of_data):
+        self.write(b"".join(list_of_data))
+
+    def is_closing(self):
+        return self._closing
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._loop.call_soon(self._peer.connection_lost, None)
+
+
+class _PtyTransport(asyncio.Transport):
+    def __init__(self, loop, fd):
+        super().__init__()
+        self._loop = loop
+        self._fd = fd
+        self._buffer = bytearray()
+
+    def write(self, data):
+        if self._fd is None:
+            return
+        if self._buffer:
+            self._buffer += data
+            return
+        try:
+            written = os.write(self._fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self._buffer += data[written:]
+            self._loop.add_writer(self._fd, self._write_ready)
+
+    def _write_ready(self):
+        try:
+            written = os.write(self._fd, self._buffer)
+        except BlockingIOError:
+            return
+        del self._buffer[:written]
+        if not self._buffer:
+            self._loop.remove_writer(self._fd)
+
+    def is_closing(self):
+        return self._fd is None
+
+    def close(self):
+        if self._fd is not None and self._buffer:
+            self._loop.remove_writer(self._fd)
+        self._fd = None
+
+
+class Emulator(asyncio.Protocol):
+    """
+    Fake ZNP adapter
+
+    :param devices: number of virtual devices on the network
+    :param latency: seconds until a data request is confirmed and answered
+    :param srsp_latency: seconds until an SREQ is answered
+    :param loss: probability of a data request not reaching its device
+    :param buffers: data requests the adapter holds until they are confirmed,
+        further ones are refused with MEM_ERROR
+    """
+
+    def __init__(
+        self,
+        devices: int = 0,
+        version: ZnpVersion = ZnpVersion.zStack3x0,
+        latency: float = 0.0,
+        srsp_latency: float = 0.0,
+        loss: float = 0.0,
+        buffers: int = 16,
+        seed=None,
+    ):
+        self.version = version
+        self.latency = latency
+        self.srsp_latency = srsp_latency
+        self.loss = loss
+        self.buffers = buffers
+        self.ieee = zigpy.types.EUI64.convert("00:12:4b:00:00:00:00:01")
+        self.devices: Dict[int, VirtualDevice] = {}
+        for i in range(devices):
+            self.add_device()
+
+        self.nv: Dict[int, bytes] = {}
+        self.endpoints: List[int] = []
+        self.groups = set()
+        self.state = Common.devStates["HOLD"]
+
+        self._random = random.Random(seed)
+        self._parser = uart.Parser()
+        self._transport: Optional[asyncio.Transport] = None
+        self._pty = None
+        self._in_flight = 0
+
+        # counters
+        self.requests = 0
+        self.confirmed = 0
+        self.lost = 0
+        self.refused = 0
+
+    def add_device(self, **kwargs) -> VirtualDevice:
+        index = len(self.devices) + 1
+        ieee = zigpy.types.EUI64(struct.pack("<Q", 0x00124B0010000000 + index))
+        device = VirtualDevice(0x1000 + index, ieee, **kwargs)
+        self.devices[device.nwk] = device
+        return device
+
+    async def connect(self, config: Dict[str, Any], api, loop=None) -> uart.Gateway:
+        """Drop-in for uart.connect, attaching api to this emulator"""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        gateway = uart.Gateway(api)
+        self.connection_made(_Transport(loop, gateway))
+        gateway.connection_made(_Transport(loop, self))
+        return gateway
+
+    def open_pty(self) -> str:
+        """Serve on a new pty, returns the path for the serial port to open"""
+        # POSIX only, the rest of the emulator works everywhere
+        import tty
+
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        self._pty = (master, slave)
+        loop = asyncio.get_event_loop()
+        loop.add_reader(master, self._read_pty)
+        self.connection_made(_PtyTransport(loop, master))
+        return os.ttyname(slave)
+
+    def _read_pty(self):
+        try:
+            data = os.read(self._pty[0], 4096)
+        except (BlockingIOError, OSError):
+            return
+        self.data_received(data)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._pty is not None:
+            asyncio.get_event_loop().remove_reader(self._pty[0])
+            for fd in self._pty:
+                os.close(fd)
+            self._pty = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        self._transport = None
+
+    def data_received(self, data):
+        for frame in self._parser.write(data):
+            try:
+                obj = ZpiObject.from_unpi_frame(frame)
+            except Exception:
+                LOGGER.warning("Emulator can't parse %s", frame)
+                if frame.command_type == CommandType.SREQ:
+                    self._respond_unparsed(frame)
+                continue
+            self._handle(obj)
+
+    def send(self, command_type, subsystem, command: str, payload):
+        if self._transport is None:
+            return
+        cmd = registry.get_command(subsystem, command)
+        data = cmd.codec(command_type).encode(payload)
+        frame = uart.UnpiFrame(command_type, subsystem, cmd.id, data)
+        self._transport.write(frame.to_buffer())
+
+    def send_areq(self, subsystem, command: str, **values):
+        cmd = registry.get_command(subsystem, command)
+        self.send(CommandType.AREQ, subsystem, command, _payload(cmd.request, **values))
+
+    def later(self, delay, callback, *args, **kwargs):
+        if kwargs:
+            callback = functools.partial(callback, **kwargs)
+        loop = asyncio.get_event_loop()
+        if delay:
+            loop.call_later(delay, callback, *args)
+        else:
+            loop.call_soon(callback, *args)
+
+    def announce(self, device: VirtualDevice):
+        """Device joined the network"""
+        self.send_areq(
+            Subsystem.ZDO,
+            "endDeviceAnnceInd",
+            srcaddr=device.nwk,
+            nwkaddr=device.nwk,
+            ieeeaddr=device.ieee,
+            capabilities=0x8E,
+        )
+
+    def incoming(self, device: VirtualDevice, cluster: int, data: bytes, dst_ep=1):
+        """Frame sent by device to the coordinator"""
+        self.send_areq(
+            Subsystem.AF,
+            "incomingMsg",
+            clusterid=cluster,
+            srcaddr=device.nwk,
+            srcendpoint=device.endpoint,
+            dstendpoint=dst_ep,
+            linkquality=200,
+            len=len(data),
+            data=data,
+        )
+
+    def _handle(self, obj: ZpiObject):
+        handler = getattr(self, "_handle_%s" % (obj.command,), None)
+        values = handler(obj) if handler is not None else None
+
+        if obj.command_type != CommandType.SREQ:
+            return
+
+        self._respond(obj.subsystem, obj.command, values)
+
+    def _respond_unparsed(self, frame):
+        # an adapter answers every SREQ it knows, even one with odd arguments
+        try:
+            cmd = registry.get_command_by_id(frame.subsystem, frame.command_id)
+        except KeyError:
+            return
+        self._respond(cmd.subsystem, cmd.name, None)
+
+    def _respond(self, subsystem, command: str, values):
+        cmd = registry.get_command(subsystem, command)
+        payload = _payload(cmd.response, **(values or {}))
+        self.later(
+            self.srsp_latency, self.send, CommandType.SRSP, subsystem, command, payload
+        )
+
+    # SYS
+
+    def _handle_ping(self, obj):
+        return {"capabilities": 0x0779}
+
+    def _handle_version(self, obj):
+        return {"transportrev": 2, "product": self.version, "majorrel": 2}
+
+    def _handle_resetReq(self, obj):
+        self.later(
+            0,
+            self.send_areq,
+            Subsystem.SYS,
+            "resetInd",
+            reason=0,
+            transportrev=2,
+            productid=self.version,
+        )
+
+    def _handle_osalNvRead(self, obj):
+        value = self.nv.get(obj.payload["id"], b"")
+        return {"status": SUCCESS, "len": len(value), "value": value}
+
+    def _handle_osalNvWrite(self, obj):
+        self.nv[obj.payload["id"]] = obj.payload["value"]
+
+    def _handle_osalNvItemInit(self, obj):
+        if obj.payload["id"] in self.nv:
+            return {"status": SUCCESS}
+        self.nv[obj.payload["id"]] = obj.payload["initvalue"]
+        return {"status": NV_ITEM_UNINIT}
+
+    def _handle_readConfiguration(self, obj):
+        value = self.nv.get(obj.payload["configid"], b"")
+        return {"configid": obj.payload["configid"], "len": len(value), "value": value}
+
+    def _handle_writeConfiguration(self, obj):
+        self.nv[obj.payload["configid"]] = obj.payload["value"]
+
+    # UTIL
+
+    def _handle_getDeviceInfo(self, obj):
+        return {
+            "ieeeaddr": self.ieee,
+            "devicetype": 0x07,
+            "devicestate": self.state,
+        }
+
+    # network start
+
+    def _start(self):
+        self.state = Common.devStates["ZB_COORD"]
+        self.later(
+            self.latency, self.send_areq, Subsystem.ZDO, "stateChangeInd", state=9
+        )
+
+    def _handle_bdbStartCommissioning(self, obj):
+        if obj.payload["mode"] == 0x04:
+            self._start()
+
+    def _handle_startupFromApp(self, obj):
+        self._start()
+
+    def _handle_register(self, obj):
+        self.endpoints.append(obj.payload["endpoint"])
+
+    def _handle_extFindGroup(self, obj):
+        key = (obj.payload["endpoint"], obj.payload["groupid"])
+        return {"status": SUCCESS if key in self.groups else FAILURE}
+
+    def _handle_extAddGroup(self, obj):
+        self.groups.add((obj.payload["endpoint"], obj.payload["groupid"]))
+
+    # ZDO
+
+    def _zdo_response(self, obj, command, **values):
+        dstaddr = obj.payload["dstaddr"]
+        if dstaddr != 0 and dstaddr not in self.devices:
+            return
+        self.later(
+            self.latency,
+            self.send_areq,
+            Subsystem.ZDO,
+            command,
+            srcaddr=dstaddr,
+            nwkaddr=obj.payload.get("nwkaddrofinterest", dstaddr),
+            **values
+        )
+
+    def _handle_activeEpReq(self, obj):
+        if obj.payload["dstaddr"] == 0:
+            endpoints = self.endpoints
+        else:
+            endpoints = [1]
+        self._zdo_response(
+            obj, "activeEpRsp", activeepcount=len(endpoints), activeeplist=endpoints
+        )
+
+    def _handle_nodeDescReq(self, obj):
+        self._zdo_response(
+            obj,
+            "nodeDescRsp",
+            logicaltype_cmplxdescavai_userdescavai=0x01,
+            apsflags_freqband=0x40,
+            maccapflags=0x8E,
+            manufacturercode=0x1234,
+            maxbuffersize=80,
+            maxintransfersize=160,
+            servermask=0x2C00,
+            maxouttransfersize=160,
+        )
+
+    def _handle_simpleDescReq(self, obj):
+        device = self.devices.get(obj.payload["dstaddr"])
+        if device is None:
+            return
+        in_clusters, out_clusters = device.in_clusters, device.out_clusters
+        self._zdo_response(
+            obj,
+            "simpleDescRsp",
+            len=8 + 2 * (len(in_clusters) + len(out_clusters)),
+            endpoint=device.endpoint,
+            profileid=device.profile,
+            deviceid=device.device_type,
+            numinclusters=len(in_clusters),
+            inclusterlist=in_clusters,
+            numoutclusters=len(out_clusters),
+            outclusterlist=out_clusters,
+        )
+
+    def _handle_mgmtPermitJoinReq(self, obj):
+        self.later(
+            self.latency,
+            self.send_areq,
+            Subsystem.ZDO,
+            "mgmtPermitJoinRsp",
+            srcaddr=0,
+            status=SUCCESS,
+        )
+
+    # AF
+
+    def _handle_dataRequest(self, obj):
+        self.requests += 1
+        if self._in_flight >= self.buffers:
+            self.refused += 1
+            return {"status": MEM_ERROR}
+
+        self._in_flight += 1
+        device = self.devices.get(obj.payload["dstaddr"])
+        self.later(self.latency, self._deliver, obj, device)
+
+    def _handle_dataRequestExt(self, obj):
+        # group and broadcast sends, confirmed but nobody answers
+        self.requests += 1
+        if self._in_flight >= self.buffers:
+            self.refused += 1
+            return {"status": MEM_ERROR}
+
+        self._in_flight += 1
+        self.later(self.latency, self._deliver, obj, None)
+
+    def _deliver(self, obj: ZpiObject, device: Optional[VirtualDevice]):
+        self._in_flight -= 1
+        payload = obj.payload
+        status = SUCCESS
+        if self.loss and self._random.random() < self.loss:
+            self.lost += 1
+            status = MAC_NO_ACK
+
+        self.confirmed += 1
+        self.send_areq(
+            Subsystem.AF,
+            "dataConfirm",
+            status=status,
+            endpoint=payload["srcendpoint"],
+            transid=payload["transid"],
+        )
+
+        if status != SUCCESS or device is None:
+            return
+        reply = self._zcl_reply(device, payload["clusterid"], payload["data"])
+        if reply is not None:
+            self.incoming(device, payload["clusterid"], reply, payload["srcendpoint"])
+
+    def _zcl_reply(self, device: VirtualDevice, cluster: int, data: bytes):
+        if len(data) < 3:
+            return None
+        frame_control = data[0]
+        if frame_control & 0x04:
+            header_length = 5
+            manufacturer = data[1:3]
+        else:
+            header_length = 3
+            manufacturer = b""
+        if len(data) < header_length:
+            return None
+        tsn, command_id = data[header_length - 2], data[header_length - 1]
+        is_global = frame_control & 0x03 == 0
+
+        # server to client, default response disabled
+        header = bytes([0x18 | (frame_control & 0x04)]) + manufacturer
+
+        if is_global and command_id == ZCL_READ_ATTRIBUTES:
+            attributes = device.attributes(cluster)
+            records = b""
+            body = data[header_length:]
+            for (attr_id,) in struct.iter_unpack("<H", body[: len(body) & ~1]):
+                value = attributes.get(attr_id)
+                if value is None:
+                    records += struct.pack("<HB", attr_id, ZCL_UNSUPPORTED_ATTRIBUTE)
+                else:
+                    value = value.encode()
+                    records += struct.pack(
+                        "<HBBB", attr_id, SUCCESS, ZCL_CHAR_STRING, len(value)
+                    )
+                    records += value
+            return header + bytes([tsn, ZCL_READ_ATTRIBUTES_RSP]) + records
+
+        if frame_control & 0x10:
+            return None
+        return header + bytes([tsn, ZCL_DEFAULT_RSP, command_id, SUCCESS])
@@ -19,3 +19,7 @@ class CommandError(ZigbeeException):
     @property
     def status(self):
         return self._status
+
+
+class OutboundQueueFull(ZigbeeException):
+    pass
@@ -0,0 +1,274 @@
+"""
+OpenMetrics exposition of the radio and protocol counters
+
+The text is rendered on demand from the counters the Gateway, its Parser, the
+API and the application keep anyway, so nothing is collected while nobody
+scrapes. MetricsExporter serves it over HTTP and/or rewrites a file for the
+node_exporter textfile collector.
+"""
+import asyncio
+import logging
+import math
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PREFIX = "zigpy_cc_"
+
+Sample = Tuple[str, Dict[str, Any], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Family:
+    """One metric family and its samples"""
+
+    def __init__(self, name: str, kind: str, help_text: str, unit: str = None):
+        self.name = PREFIX + name
+        self.kind = kind
+        self.help = help_text
+        self.unit = unit
+        self.samples: List[Sample] = []
+
+    def add(self, value, suffix: str = "", **labels):
+        self.samples.append((suffix, labels, value))
+        return self
+
+    def histogram(self, snapshot: Dict[str, Any], **labels):
+        """Add a stats.Histogram snapshot"""
+        for bound, count in snapshot["buckets"]:
+            self.add(count, "_bucket", le=_value(float(bound)), **labels)
+        self.add(snapshot["count"], "_count", **labels)
+        self.add(snapshot["sum"], "_sum", **labels)
+        return self
+
+    def render(self, lines: List[str]):
+        lines.append("# TYPE {} {}".format(self.name, self.kind))
+        if self.unit:
+            lines.append("# UNIT {} {}".format(self.name, self.unit))
+        lines.append("# HELP {} {}".format(self.name, _escape(self.help)))
+        for suffix, labels, value in self.samples:
+            if labels:
+                lines.append(
+                    "{}{}{{{}}} {}".format(
+                        self.name,
+                        suffix,
+                        ",".join(
+                            '{}="{}"'.format(k, _escape(v)) for k, v in labels.items()
+                        ),
+                        _value(value),
+                    )
+                )
+            else:
+                lines.append("{}{} {}".format(self.name, suffix, _value(value)))
+
+
+def collect(api, app=None) -> List[Family]:
+    """Metric families of an API, and of the application driving it"""
+    families = []
+
+    def family(*args, **kwargs) -> Family:
+        res = Family(*args, **kwargs)
+        families.append(res)
+        return res
+
+    gateway = api._uart if api is not None else None
+    if gateway is not None:
+        parser = gateway.parser
+        family("frames", "counter", "UNPI frames").add(
+            parser.frames, "_total", direction="rx"
+        ).add(gateway.frames_sent, "_total", direction="tx")
+        family("bytes", "counter", "Bytes on the wire", "bytes").add(
+            gateway.bytes_received, "_total", direction="rx"
+        ).add(gateway.bytes_sent, "_total", direction="tx")
+        family(
+            "checksum_failures", "counter", "Received frames with a bad checksum"
+        ).add(parser.checksum_failures, "_total")
+        family(
+            "dropped_bytes", "counter", "Received bytes not part of a valid frame"
+        ).add(parser.dropped_bytes, "_total")
+        family("flushes", "counter", "Writes to the transport").add(
+            gateway.flushes, "_total"
+        )
+        family("outbound_queued", "gauge", "Frames waiting to be written").add(
+            gateway.queued
+        )
+        family("outbound_paused", "gauge", "Transport over its high water mark").add(
+            gateway.paused
+        )
+
+    if api is not None:
+        stats = api.stats()
+        family("waiters", "gauge", "Pending response waiters").add(stats["waiters"])
+        family("waiters_expired", "counter", "Response waiters timed out").add(
+            stats["expired_waiters"], "_total"
+        )
+        family("lock_queue_depth", "gauge", "Requests waiting for the lock").add(
+            stats["queue_depth"]
+        )
+        family(
+            "lock_wait_seconds", "histogram", "Time waited for the lock", "seconds"
+        ).histogram(stats["lock_wait"])
+
+        for name, kind, help_text in (
+            ("commands", "sreq", "SREQ to SRSP"),
+            ("confirms", "confirm", "dataRequest to dataConfirm"),
+        ):
+            requests = family(
+                "%s_requests" % kind, "counter", "%s requests" % help_text
+            )
+            timeouts = family(
+                "%s_timeouts" % kind, "counter", "%s timeouts" % help_text
+            )
+            errors = family(
+                "%s_errors" % kind, "counter", "%s failures by status" % help_text
+            )
+            latency = family(
+                "%s_latency_seconds" % kind,
+                "histogram",
+                "%s latency" % help_text,
+                "seconds",
+            )
+            for command, values in stats[name].items():
+                subsystem, command = command.split(" ", 1)
+                labels = {"subsystem": subsystem, "command": command}
+                requests.add(values["count"], "_total", **labels)
+                timeouts.add(values["timeouts"], "_total", **labels)
+                for status, count in sorted(values["errors"].items()):
+                    errors.add(count, "_total", status=status, **labels)
+                latency.histogram(values["latency"], **labels)
+
+    semaphore = getattr(app, "_semaphore", None)
+    if semaphore is not None:
+        family("concurrency_limit", "gauge", "Data requests allowed in flight").add(
+            semaphore.value
+        )
+        family("concurrency_in_flight", "gauge", "Data requests in flight").add(
+            semaphore.in_flight
+        )
+        family("concurrency_waiting", "gauge", "Data requests waiting for a slot").add(
+            semaphore.waiting
+        )
+    limiter = getattr(app, "_broadcast_limiter", None)
+    if limiter is not None:
+        family(
+            "broadcasts_available", "gauge", "Free broadcast transaction entries"
+        ).add(limiter.available)
+
+    return families
+
+
+def render(api, app=None) -> str:
+    lines: List[str] = []
+    for family in collect(api, app):
+        family.render(lines)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str, text: str):
+    """Replace path atomically, the collector never reads a partial file"""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """
+    Serves render() at http://host:port/metrics and/or writes it to textfile
+    every interval seconds
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], str],
+        host: str = None,
+        port: int = None,
+        textfile: str = None,
+        interval: float = 15,
+    ):
+        self._source = source
+        self.host = host
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.port is not None and self._server is None:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+            if not self.port:
+                self.port = self._server.sockets[0].getsockname()[1]
+            LOGGER.info("Serving metrics on %s:%d", self.host, self.port)
+        if self.textfile and self._task is None:
+            self._task = asyncio.ensure_future(self._write_loop())
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _write_loop(self):
+        while True:
+            try:
+                write_textfile(self.textfile, self._source())
+            except Exception as e:
+                LOGGER.warning("Failed to write metrics to %s: %s", self.textfile, e)
+            await asyncio.sleep(self.interval)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.split()
+            if len(parts) < 2 or parts[0] != b"GET":
+                status, content_type, body = "405 Method Not Allowed", "text/plain", ""
+            elif parts[1].split(b"?")[0] != b"/metrics":
+                status, content_type, body = "404 Not Found", "text/plain", ""
+            else:
+                status, content_type, body = "200 OK", CONTENT_TYPE, self._source()
+
+            data = body.encode()
+            writer.write(
+                (
+                    "HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+                    "Connection: close\r\n\r\n"
+                )
+                .format(status, content_type, len(data))
+                .encode()
+                + data
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            LOGGER.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,80 @@
+"""
+Indexes over the generated command definitions, built once at import
+"""
+from typing import Dict, Optional, Tuple
+
+from zigpy_cc.codec import ParameterCodec
+from zigpy_cc.definition import Definition
+from zigpy_cc.types import CommandType, Repr, Subsystem
+
+
+class Command(Repr):
+    def __init__(self, subsystem, definition):
+        self.subsystem = Subsystem(subsystem)
+        self.name = definition["name"]
+        self.id = definition["ID"]
+        self.type = definition["type"]
+        self.request = definition["request"]
+        self.response = definition.get("response")
+        self.request_codec = ParameterCodec(self.request)
+        self.response_codec = (
+            ParameterCodec(self.response) if self.response is not None else None
+        )
+        # name of the AREQ callback answering a ...Req command
+        self.response_command = None
+
+    def parameters(self, command_type):
+        if command_type == CommandType.SRSP:
+            return self.response
+        return self.request
+
+    def codec(self, command_type) -> ParameterCodec:
+        if command_type == CommandType.SRSP:
+            return self.response_codec
+        return self.request_codec
+
+
+_by_name: Dict[Tuple[int, str], Command] = {}
+_by_id: Dict[Tuple[int, int], Command] = {}
+_by_frame: Dict[Tuple[int, int, int], Command] = {}
+
+
+def _build():
+    for subsystem, definitions in Definition.items():
+        commands = [Command(subsystem, d) for d in definitions]
+        for cmd in commands:
+            _by_name[(subsystem, cmd.name)] = cmd
+            _by_id[(subsystem, cmd.id)] = cmd
+            _by_frame[(subsystem, cmd.type, cmd.id)] = cmd
+            if cmd.type == CommandType.SREQ:
+                _by_frame[(subsystem, CommandType.SRSP, cmd.id)] = cmd
+
+        for cmd in commands:
+            if cmd.type == CommandType.SREQ and cmd.name.endswith("Req"):
+                rsp = cmd.name.replace("Req", "Rsp")
+                if (subsystem, rsp) in _by_name:
+                    cmd.response_command = rsp
+
+
+_build()
+
+
+def get_command(subsystem: int, name: str) -> Command:
+    return _by_name[(subsystem, name)]
+
+
+def get_command_by_id(subsystem: int, command_id: int) -> Command:
+    return _by_id[(subsystem, command_id)]
+
+
+def get_frame_command(subsystem: int, command_type: int, command_id: int) -> Command:
+    """Command for a received frame, SRSP frames resolve to their SREQ"""
+    cmd = _by_frame.get((subsystem, command_type, command_id))
+    if cmd is None:
+        cmd = _by_id[(subsystem, command_id)]
+    return cmd
+
+
+def get_response_command(subsystem: int, name: str) -> Optional[str]:
+    cmd = _by_name.get((subsystem, name))
+    return cmd.response_command if cmd is not None else None
@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import heapq
+from typing import Deque, List
+
+from zigpy_cc.types import Priority
+
+# a waiter queued for this long is served next whatever its priority
+STARVATION_TIMEOUT = 5.0
+
+
+class PriorityLock:
+    """
+    Lock serializing SREQs which hands ownership to the most urgent waiter.
+
+    Waiters of the same priority are served in FIFO order, so an interactive
+    request waits for at most the SREQ in progress and the interactive ones
+    queued before it. Waiters starving for longer than STARVATION_TIMEOUT go
+    first, so background work still makes progress under load.
+    """
+
+    def __init__(self, starvation_timeout: float = None):
+        self.starvation_timeout = (
+            STARVATION_TIMEOUT if starvation_timeout is None else starvation_timeout
+        )
+        self._locked = False
+        self._seq = 0
+        # [priority, seq, enqueued, future], a heap and in arrival order
+        self._queue: List[list] = []
+        self._arrivals: Deque[list] = collections.deque()
+
+    def locked(self) -> bool:
+        return self._locked
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for entry in self._arrivals if not entry[3].done())
+
+    async def acquire(self, priority: Priority = Priority.NORMAL) -> bool:
+        if not self._locked and not self._queue:
+            self._locked = True
+            return True
+
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        entry = [int(priority), self._seq, loop.time(), fut]
+        self._seq += 1
+        heapq.heappush(self._queue, entry)
+        self._arrivals.append(entry)
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # ownership was handed over just before the cancellation
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        if not self._locked:
+            raise RuntimeError("Lock is not acquired.")
+        self._locked = False
+
+        entry = self._next()
+        if entry is not None:
+            self._locked = True
+            entry[3].set_result(True)
+
+    def _next(self):
+        arrivals = self._arrivals
+        while arrivals and arrivals[0][3].done():
+            arrivals.popleft()
+        if (
+            arrivals
+            and asyncio.get_event_loop().time() - arrivals[0][2]
+            >= self.starvation_timeout
+        ):
+            return arrivals.popleft()
+
+        queue = self._queue
+        while queue:
+            entry = heapq.heappop(queue)
+            if not entry[3].done():
+                return entry
+
+        arrivals.clear()
+        return None
+
+    def __call__(self, priority: Priority = Priority.NORMAL):
+        return _PriorityLockContext(self, priority)
+
+
+class _PriorityLockContext:
+    def __init__(self, lock: PriorityLock, priority: Priority):
+        self._lock = lock
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._lock.acquire(self._priority)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
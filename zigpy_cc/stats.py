@@ -0,0 +1,121 @@
+import bisect
+from typing import Any, Dict, Tuple
+
+from zigpy_cc.types import Subsystem
+
+# upper bounds of the latency buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """Fixed bucket histogram, observing is a bisect and two additions"""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cumulative counts per upper bound, like a Prometheus histogram"""
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class CommandStats:
+    __slots__ = ("count", "timeouts", "errors", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        # status -> count
+        self.errors: Dict[int, int] = {}
+        self.latency = Histogram()
+
+    def error(self, status: int):
+        self.errors[status] = self.errors.get(status, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "errors": dict(self.errors),
+            "latency": self.latency.snapshot(),
+        }
+
+
+class Stats:
+    """
+    Counters kept by the API: SREQ -> SRSP per command, dataRequest ->
+    dataConfirm per command and the time spent waiting for the request lock
+    """
+
+    def __init__(self):
+        self.commands: Dict[Tuple[int, str], CommandStats] = {}
+        self.confirms: Dict[Tuple[int, str], CommandStats] = {}
+        self.lock_wait = Histogram()
+        self.queued = 0
+        self.max_queued = 0
+
+    def command(self, subsystem: int, command: str) -> CommandStats:
+        key = (subsystem, command)
+        stats = self.commands.get(key)
+        if stats is None:
+            stats = self.commands[key] = CommandStats()
+        return stats
+
+    def confirm(self, subsystem: int, command: str) -> CommandStats:
+        key = (subsystem, command)
+        stats = self.confirms.get(key)
+        if stats is None:
+            stats = self.confirms[key] = CommandStats()
+        return stats
+
+    def enqueue(self):
+        self.queued += 1
+        if self.queued > self.max_queued:
+            self.max_queued = self.queued
+
+    def dequeue(self, waited: float):
+        self.queued -= 1
+        self.lock_wait.observe(waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        def by_name(commands):
+            return {
+                "{} {}".format(Subsystem(subsystem).name, command): stats.snapshot()
+                for (subsystem, command), stats in sorted(commands.items())
+            }
+
+        return {
+            "commands": by_name(self.commands),
+            "confirms": by_name(self.confirms),
+            "lock_wait": self.lock_wait.snapshot(),
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+        }
@@ -0,0 +1,61 @@
+"""
+Request lifecycle events for tracing backends
+
+A tracer is any callable taking (event, command, tsn, nwk, **info), set with
+API.set_tracer or ControllerApplication.set_tracer. It is called inline on
+the event loop, so it should only record the event and return. Exceptions it
+raises are logged and dropped. Without a tracer every event costs a single
+None check.
+
+    enqueue        request waiting for the lock         info: priority
+    lock_acquired  request got the lock
+    frame_written  frame handed to the Gateway
+    srsp           SRSP to the request received         info: status
+    data_confirm   dataConfirm of a data request        info: status
+    reply          ZDO response matched to its request,
+                   or ZCL frame handed to zigpy
+    timeout        gave up waiting                      info: waiting_for
+"""
+import enum
+import logging
+from typing import Callable, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+Tracer = Callable[..., None]
+
+
+class TraceEvent(str, enum.Enum):
+    ENQUEUE = "enqueue"
+    LOCK_ACQUIRED = "lock_acquired"
+    FRAME_WRITTEN = "frame_written"
+    SRSP = "srsp"
+    DATA_CONFIRM = "data_confirm"
+    REPLY = "reply"
+    TIMEOUT = "timeout"
+
+
+def trace(tracer: Tracer, event: TraceEvent, command, tsn, nwk, **info):
+    """Call tracer, logging instead of raising so it can't break the radio path"""
+    try:
+        tracer(event, command, tsn, nwk, **info)
+    except Exception:
+        LOGGER.exception("Tracer failed on %s of %s", event.value, command)
+
+
+def request_ids(obj) -> Tuple[Optional[int], Optional[int]]:
+    """(tsn, destination nwk) of a request, None when it has none"""
+    payload = obj.payload
+    tsn = obj.sequence
+    if tsn is None:
+        tsn = payload.get("transid")
+    return tsn, payload.get("dstaddr")
+
+
+def zcl_tsn(data) -> Optional[int]:
+    """Transaction sequence number of a ZCL frame"""
+    # manufacturer specific frames carry the manufacturer code first
+    position = 3 if data and data[0] & 0x04 else 1
+    if len(data) <= position:
+        return None
+    return data[position]
@@ -7,10 +7,16 @@ import zigpy.types as t
 class Repr:
     def __repr__(self) -> str:
         r = "<%s " % (self.__class__.__name__,)
-        r += " ".join(["%s=%s" % (f, getattr(self, f, None)) for f in vars(self)])
+        r += " ".join(["%s=%s" % (f, self._repr_value(f)) for f in vars(self)])
         r += ">"
         return r
 
+    def _repr_value(self, field):
+        value = getattr(self, field, None)
+        if isinstance(value, memoryview):
+            return value.tobytes()
+        return value
+
 
 class Timeouts:
     SREQ = 6000
@@ -40,6 +46,14 @@ class ZnpVersion(t.uint8_t, enum.Enum):
     zStack30x = 2
 
 
+class Priority(t.uint8_t, enum.Enum):
+    """SREQ scheduling class, lower values are served first"""
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BACKGROUND = 2
+
+
 class CommandType(t.uint8_t, enum.Enum):
     POLL = 0
     SREQ = 1
@@ -98,6 +112,20 @@ class ParameterType(t.uint8_t, enum.Enum):
         )
 
 
+def enum_table(enum_type) -> tuple:
+    """Members of a uint8 enum indexed by value, None where undefined"""
+    table = [None] * 256
+    for member in enum_type:
+        table[member.value] = member
+    return tuple(table)
+
+
+# the enums decoded for every frame, looked up instead of constructed
+COMMAND_TYPES = enum_table(CommandType)
+SUBSYSTEMS = enum_table(Subsystem)
+ADDRESS_MODES = enum_table(AddressMode)
+
+
 class NetworkOptions(Repr):
     networkKey: t.KeyData
     panID: t.PanId
@@ -1,13 +1,27 @@
 import asyncio
+import collections
 import logging
-from typing import Any, Dict
+import socket
+from typing import Any, Deque, Dict, List, Optional
+import urllib.parse
 
 import serial
 import serial.tools.list_ports
 import serial_asyncio
 from serial.tools.list_ports_common import ListPortInfo
 
-from zigpy_cc.config import CONF_DEVICE_BAUDRATE, CONF_DEVICE_PATH, CONF_FLOW_CONTROL
+from zigpy_cc import capture
+from zigpy_cc.config import (
+    CONF_CAPTURE_MAX_BYTES,
+    CONF_CAPTURE_MAX_BYTES_DEFAULT,
+    CONF_CAPTURE_PATH,
+    CONF_DEVICE_BAUDRATE,
+    CONF_DEVICE_PATH,
+    CONF_FLOW_CONTROL,
+    CONF_WRITE_BUFFER_HIGH,
+    CONF_WRITE_BUFFER_LOW,
+)
+from zigpy_cc.exception import OutboundQueueFull
 import zigpy_cc.types as t
 
 LOGGER = logging.getLogger(__name__)
@@ -22,6 +36,19 @@ PositionCmd1 = 3
 MinMessageLength = 5
 MaxDataSize = 250
 
+SocketSchemes = ("socket://", "tcp://")
+
+# receive buffer handed to buffered (TCP) transports
+ReceiveBufferSize = 4096
+
+# TCP keepalive: idle seconds before probing, probe interval, probe count
+KeepAliveIdle = 10
+KeepAliveInterval = 5
+KeepAliveCount = 3
+
+# frames waiting for the next flush, or for the transport to resume writing
+MaxOutboundFrames = 256
+
 """
 0451:     Texas Instruments
 1a86:7523 QinHeng Electronics HL-340 USB-Serial adapter
@@ -32,29 +59,103 @@ usb_regexp = "0451:|1a86:7523"
 
 class Parser:
     def __init__(self) -> None:
-        self.buffer = b""
-
-    def write(self, b: int):
-        self.buffer += bytes([b])
-        if SOF == self.buffer[0]:
-            if len(self.buffer) > MinMessageLength:
-                dataLength = self.buffer[PositionDataLength]
-
-                fcsPosition = DataStart + dataLength
-                frameLength = fcsPosition + 1
-
-                if len(self.buffer) >= frameLength:
-                    frameBuffer = self.buffer[0:frameLength]
-                    self.buffer = self.buffer[frameLength:]
-
-                    frame = UnpiFrame.from_buffer(dataLength, fcsPosition, frameBuffer)
-
-                    return frame
+        self.buffer = bytearray()
+        self._receive = bytearray(ReceiveBufferSize)
+        self._receive_view = memoryview(self._receive)
+        # inbound metrics
+        self.frames = 0
+        self.checksum_failures = 0
+        self.dropped_bytes = 0
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Preallocated buffer for the transport to receive into"""
+        return self._receive_view
+
+    def buffer_updated(self, nbytes: int) -> List["UnpiFrame"]:
+        """Parse the nbytes received into the get_buffer() buffer
+
+        Parsed in place, the transport reuses the buffer for the next read, so
+        frames copy their data out of it and only an incomplete frame at the
+        end is kept.
+        """
+        if self.buffer:
+            return self.write(self._receive_view[:nbytes])
+        return self._parse(self._receive, nbytes, False)
+
+    def write(self, data: bytes) -> List["UnpiFrame"]:
+        """Feed a chunk of received bytes, return every complete frame in it
+
+        Frames reference an immutable snapshot of the chunk through read-only
+        memoryviews, so no frame or payload is copied out of it.
+        """
+        buffer = self.buffer
+        if buffer:
+            buffer += data
+            data = bytes(buffer)
+            buffer.clear()
         else:
-            LOGGER.debug("drop char")
-            self.buffer = b""
-
-        return None
+            data = bytes(data)
+        return self._parse(data, len(data), True)
+
+    def _parse(self, data, end: int, owned: bool) -> List["UnpiFrame"]:
+        """Frames in data[:end], owned if they may keep referencing data"""
+        view = memoryview(data)
+        frames = []
+
+        pos = 0
+        while pos < end:
+            start = data.find(SOF, pos, end)
+            if start < 0:
+                LOGGER.debug("drop %d chars", end - pos)
+                self.dropped_bytes += end - pos
+                pos = end
+                break
+            if start > pos:
+                LOGGER.debug("drop %d chars", start - pos)
+                self.dropped_bytes += start - pos
+                pos = start
+
+            if end - pos < MinMessageLength:
+                break
+
+            dataLength = data[pos + PositionDataLength]
+            if dataLength > MaxDataSize:
+                # not a real start of frame, resync on the next SOF
+                LOGGER.debug("drop char, invalid length %d", dataLength)
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+
+            fcsPosition = DataStart + dataLength
+            frameLength = fcsPosition + 1
+            if end - pos < frameLength:
+                break
+
+            frameBuffer = view[pos : pos + frameLength]
+            try:
+                frame = UnpiFrame.from_buffer(dataLength, fcsPosition, frameBuffer)
+            except ValueError as e:
+                # intact frame of a type we don't know, skip it
+                LOGGER.debug("drop %d chars, %s", frameLength, e)
+                self.dropped_bytes += frameLength
+                pos += frameLength
+                continue
+            if frame is None:
+                # the SOF may have been noise, resync on the next one
+                self.checksum_failures += 1
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+
+            pos += frameLength
+            if not owned:
+                frame.data = bytes(frame.data)
+            frames.append(frame)
+
+        self.frames += len(frames)
+        if pos < end:
+            self.buffer += view[pos:end]
+        return frames
 
 
 class UnpiFrame(t.Repr):
@@ -67,8 +168,12 @@ class UnpiFrame(t.Repr):
         length=None,
         fcs=None,
     ):
-        self.command_type = t.CommandType(command_type)
-        self.subsystem = t.Subsystem(subsystem)
+        self.command_type = t.COMMAND_TYPES[command_type]
+        self.subsystem = t.SUBSYSTEMS[subsystem]
+        if self.command_type is None or self.subsystem is None:
+            raise ValueError(
+                "Unknown command type %d or subsystem %d" % (command_type, subsystem)
+            )
         self.command_id = command_id
         self.data = data
         self.length = length
@@ -86,7 +191,9 @@ class UnpiFrame(t.Repr):
         if checksum == fcs:
             return cls(command_type, subsystem, command_id, data, length, fcs)
         else:
-            LOGGER.warning("Invalid checksum: 0x%s, data: 0x%s", checksum, buffer)
+            LOGGER.warning(
+                "Invalid checksum: 0x%s, data: 0x%s", checksum, bytes(buffer)
+            )
             return None
 
     @staticmethod
@@ -109,52 +216,186 @@ class UnpiFrame(t.Repr):
         return res + bytes([fcs])
 
 
-class Gateway(asyncio.Protocol):
+class Gateway(asyncio.BufferedProtocol):
+    """
+    Serial transports call data_received, socket transports receive straight
+    into the parser's buffer through get_buffer and buffer_updated.
+
+
+    Outbound frames sent during one event loop iteration are written to the
+    transport together, with a single write, once the iteration is done.
+    While the transport paused writing they stay queued, up to
+    MaxOutboundFrames, and drain() blocks senders until it resumes. close()
+    writes whatever is still queued, a lost connection drops it.
+
+    With a capture writer set, every frame sent and received is recorded.
+    """
+
     _transport: serial_asyncio.SerialTransport
 
-    def __init__(self, api, connected_future=None):
+    def __init__(self, api, connected_future=None, high_water=None, low_water=None):
         self._parser = Parser()
         self._connected_future = connected_future
         self._api = api
         self._transport = None
         self._open = False
+        self._outbox: Deque[bytes] = collections.deque()
+        self._flush_handle = None
+        self._paused = False
+        self._drain_waiters: List[asyncio.Future] = []
+        self._high_water = high_water
+        self._low_water = low_water
+        self.capture: Optional[capture.CaptureWriter] = None
+        # traffic metrics, received frames are counted by the parser
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.flushes = 0
+        self.max_queued = 0
+        self.bytes_received = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._outbox)
+
+    @property
+    def parser(self) -> Parser:
+        return self._parser
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
 
     def connection_made(self, transport: serial_asyncio.SerialTransport):
         """Callback when the uart is connected"""
         LOGGER.debug("Connection made")
         self._open = True
         self._transport = transport
+        if self._high_water is not None or self._low_water is not None:
+            transport.set_write_buffer_limits(self._high_water, self._low_water)
         if self._connected_future:
             self._connected_future.set_result(True)
 
     def close(self):
         self._open = False
+        # paused or not, the transport writes what it buffered before closing
+        self._flush(force=True)
         self._transport.close()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
 
     def write(self, data):
+        self._flush()
         self._transport.write(data)
 
     def send(self, frame: UnpiFrame):
         """Send data, taking care of escaping and framing"""
         data = frame.to_buffer()
         LOGGER.debug("Send: %s", data)
+
+        outbox = self._outbox
+        if len(outbox) >= MaxOutboundFrames:
+            raise OutboundQueueFull(
+                "Outbound queue full, {} frames waiting".format(len(outbox))
+            )
+        if self.capture is not None:
+            self.capture.write(capture.Direction.TX, data)
+        outbox.append(data)
+        if len(outbox) > self.max_queued:
+            self.max_queued = len(outbox)
+
+        if self._flush_handle is None and not self._paused:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._flush)
+
+    def _flush(self, force=False):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        outbox = self._outbox
+        if not outbox or (self._paused and not force) or self._transport is None:
+            return
+
+        frames = len(outbox)
+        data = outbox[0] if frames == 1 else b"".join(outbox)
+        outbox.clear()
+
+        self.frames_sent += frames
+        self.bytes_sent += len(data)
+        self.flushes += 1
         self._transport.write(data)
 
+    def pause_writing(self):
+        LOGGER.debug("Transport paused writing")
+        self._paused = True
+
+    def resume_writing(self):
+        LOGGER.debug("Transport resumed writing")
+        self._paused = False
+        self._flush()
+        self._wake_drain_waiters()
+
+    async def drain(self):
+        """Wait until the transport accepts more data"""
+        if not self._paused:
+            return
+        fut = asyncio.get_event_loop().create_future()
+        self._drain_waiters.append(fut)
+        try:
+            await fut
+        finally:
+            if fut in self._drain_waiters:
+                self._drain_waiters.remove(fut)
+
+    def _wake_drain_waiters(self, exc=None):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for fut in waiters:
+            if fut.done():
+                continue
+            if exc is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(exc)
+
     def data_received(self, data):
         """Callback when there is data received from the uart"""
 
-        found = False
-        for b in data:
-            frame = self._parser.write(b)
-            if frame is not None:
-                found = True
-                LOGGER.debug("Frame received: %s", frame)
-                self._api.data_received(frame)
+        frames = self._parser.write(data)
+        self.bytes_received += len(data)
+        if not frames and LOGGER.isEnabledFor(logging.DEBUG):
+            # usually part of a frame, the rest is in the next chunk
+            LOGGER.debug("Bytes received: %s", bytes(data))
+        self._frames_received(frames)
+
+    def get_buffer(self, sizehint):
+        return self._parser.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        frames = self._parser.buffer_updated(nbytes)
+        self.bytes_received += nbytes
+        if not frames and LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(
+                "Bytes received: %s", bytes(self._parser.get_buffer()[:nbytes])
+            )
+        self._frames_received(frames)
 
-        if not found:
-            LOGGER.info("Bytes received: %s", data)
+    def _frames_received(self, frames):
+        for frame in frames:
+            LOGGER.debug("Frame received: %s", frame)
+            if self.capture is not None:
+                self.capture.write_frame(capture.Direction.RX, frame)
+            self._api.data_received(frame)
 
     def connection_lost(self, exc):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._outbox:
+            LOGGER.debug("Dropping %d unsent frames", len(self._outbox))
+            self._outbox.clear()
+        self._wake_drain_waiters(
+            serial.SerialException("Serial port closed: {}".format(exc))
+        )
         if self._open:
             LOGGER.error("Serial port closed unexpectedly: %s", exc)
             self._api.connection_lost()
@@ -178,8 +419,33 @@ async def connect(config: Dict[str, Any], api, loop=None) -> Gateway:
         loop = asyncio.get_event_loop()
 
     connected_future = loop.create_future()
-    protocol = Gateway(api, connected_future)
+    protocol = Gateway(
+        api,
+        connected_future,
+        config.get(CONF_WRITE_BUFFER_HIGH),
+        config.get(CONF_WRITE_BUFFER_LOW),
+    )
+    if config.get(CONF_CAPTURE_PATH):
+        protocol.capture = capture.CaptureWriter(
+            config[CONF_CAPTURE_PATH],
+            config.get(CONF_CAPTURE_MAX_BYTES, CONF_CAPTURE_MAX_BYTES_DEFAULT),
+        )
+
+    port = config[CONF_DEVICE_PATH]
+    if port.startswith(SocketSchemes):
+        protocol = await connect_socket(loop, protocol, port)
+    else:
+        protocol = await connect_serial(loop, protocol, config)
+
+    await connected_future
+
+    protocol.write(b"\xef")
+    await asyncio.sleep(1)
 
+    return protocol
+
+
+async def connect_serial(loop, protocol: Gateway, config: Dict[str, Any]) -> Gateway:
     port, baudrate = config[CONF_DEVICE_PATH], config[CONF_DEVICE_BAUDRATE]
     if port == "auto":
         device = detect_port()
@@ -203,10 +469,28 @@ async def connect(config: Dict[str, Any], api, loop=None) -> Gateway:
         xonxoff=xonxoff,
         rtscts=rtscts,
     )
+    return protocol
 
-    await connected_future
 
-    protocol.write(b"\xef")
-    await asyncio.sleep(1)
+async def connect_socket(loop, protocol: Gateway, url: str) -> Gateway:
+    """Connect to a network attached adapter, e.g. socket://host:port"""
+    parsed = urllib.parse.urlparse(url)
+    LOGGER.debug("Connecting to %s:%d", parsed.hostname, parsed.port)
+    transport, protocol = await loop.create_connection(
+        lambda: protocol, parsed.hostname, parsed.port
+    )
 
+    sock = transport.get_extra_info("socket")
+    if sock is None:
+        return protocol
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # notice a dead bridge instead of waiting on it for hours
+    for option, value in (
+        ("TCP_KEEPIDLE", KeepAliveIdle),
+        ("TCP_KEEPINTVL", KeepAliveInterval),
+        ("TCP_KEEPCNT", KeepAliveCount),
+    ):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
     return protocol
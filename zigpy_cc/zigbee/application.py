@@ -1,7 +1,6 @@
 import asyncio
 import logging
-from asyncio.locks import Semaphore
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import zigpy.application
 import zigpy.config
@@ -12,11 +11,39 @@ from zigpy.profiles import zha
 from zigpy.types import BroadcastAddress
 from zigpy.zdo.types import ZDOCmd
 
-from zigpy_cc import __version__, types as t
-from zigpy_cc.api import API
-from zigpy_cc.config import CONF_DEVICE, CONFIG_SCHEMA, SCHEMA_DEVICE
+from zigpy_cc import __version__, metrics, registry, types as t
+from zigpy_cc.api import API, source_address
+from zigpy_cc.config import (
+    CONF_CONFIRM_DELIVERY,
+    CONF_CONFIRM_DELIVERY_DEFAULT,
+    CONF_CONFIRM_TIMEOUT,
+    CONF_CONFIRM_TIMEOUT_DEFAULT,
+    CONF_DEVICE,
+    CONF_METRICS,
+    CONF_METRICS_HOST,
+    CONF_METRICS_HOST_DEFAULT,
+    CONF_METRICS_INTERVAL,
+    CONF_METRICS_INTERVAL_DEFAULT,
+    CONF_METRICS_PORT,
+    CONF_METRICS_TEXTFILE,
+    CONFIG_SCHEMA,
+    SCHEMA_DEVICE,
+)
 from zigpy_cc.exception import TODO, CommandError
-from zigpy_cc.types import NetworkOptions, Subsystem, ZnpVersion, LedMode, AddressMode
+from zigpy_cc.types import (
+    AddressMode,
+    LedMode,
+    NetworkOptions,
+    Priority,
+    Subsystem,
+    ZnpVersion,
+)
+from zigpy_cc.zigbee.concurrency import (
+    AdaptiveSemaphore,
+    BroadcastLimiter,
+    is_resource_shortage,
+)
+from zigpy_cc.tracing import TraceEvent, Tracer, trace, zcl_tsn
 from zigpy_cc.zigbee.start_znp import start_znp
 from zigpy_cc.zpi_object import ZpiObject
 
@@ -26,6 +53,19 @@ CHANGE_NETWORK_WAIT = 1
 SEND_CONFIRM_TIMEOUT = 60
 PROTO_VER_WATCHDOG = 0x0108
 
+# status of a data request the adapter never confirmed, ZMacTransactionExpired
+CONFIRM_TIMEOUT_STATUS = 0xF0
+
+# data requests in flight, Z-Stack 3.x.0 adapters have buffers for more
+CONCURRENCY_ZSTACK3X0 = 16
+CONCURRENCY_DEFAULT = 2
+
+# table scans which can wait for user traffic
+BACKGROUND_ZDO_REQUESTS = (
+    ZDOCmd.Mgmt_Lqi_req,
+    ZDOCmd.Mgmt_Rtg_req,
+)
+
 REQUESTS = {
     "nwkAddrReq": (ZDOCmd.NWK_addr_req, 0),
     "ieeeAddrReq": (ZDOCmd.IEEE_addr_req, 0),
@@ -40,19 +80,21 @@ REQUESTS = {
     "bindRsp": (ZDOCmd.Bind_rsp, 2),
 }
 
+# answers to address lookups, they only refresh the NWK index
+ADDRESS_RESPONSES = ("nwkAddrRsp", "ieeeAddrRsp")
+
 IGNORED = (
-    "bdbComissioningNotifcation",
-    "dataConfirm",
-    "leaveInd",
-    "resetInd",
-    "srcRtgInd",
-    "stateChangeInd",
-    "tcDeviceInd",
+    (Subsystem.APP_CNF, "bdbComissioningNotifcation"),
+    (Subsystem.ZDO, "leaveInd"),
+    (Subsystem.SYS, "resetInd"),
+    (Subsystem.ZDO, "srcRtgInd"),
+    (Subsystem.ZDO, "stateChangeInd"),
+    (Subsystem.ZDO, "tcDeviceInd"),
 )
 
 
 class ControllerApplication(zigpy.application.ControllerApplication):
-    _semaphore: Semaphore
+    _semaphore: AdaptiveSemaphore
     _api: Optional[API]
     SCHEMA = CONFIG_SCHEMA
     SCHEMA_DEVICE = SCHEMA_DEVICE
@@ -62,14 +104,58 @@ class ControllerApplication(zigpy.application.ControllerApplication):
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config=zigpy.config.ZIGPY_SCHEMA(config))
         self._api = None
+        # NWK -> device, a hint for get_device checked against self.devices
+        self._nwk_index: Dict[zigpy.types.NWK, zigpy.device.Device] = {}
 
         self.discovering = False
         self.version = {}
+        self._broadcast_limiter = BroadcastLimiter()
+        # until startup knows the adapter, assume the smallest one
+        self._semaphore = AdaptiveSemaphore(
+            CONCURRENCY_DEFAULT, maximum=CONCURRENCY_DEFAULT * 2
+        )
+        # (subsystem, command id) -> handler, for the AREQs handle_znp routes
+        self._handlers: Dict[
+            Tuple[Subsystem, int], Callable[[ZpiObject], None]
+        ] = self._build_handlers()
+
+        self._confirm_delivery = self.config.get(
+            CONF_CONFIRM_DELIVERY, CONF_CONFIRM_DELIVERY_DEFAULT
+        )
+        self._confirm_timeout = self.config.get(
+            CONF_CONFIRM_TIMEOUT, CONF_CONFIRM_TIMEOUT_DEFAULT
+        )
+
+        self._tracer: Optional[Tracer] = None
+        self._metrics = None
+        metrics_config = self.config.get(CONF_METRICS)
+        if metrics_config:
+            self._metrics = metrics.MetricsExporter(
+                self.metrics,
+                metrics_config.get(CONF_METRICS_HOST, CONF_METRICS_HOST_DEFAULT),
+                metrics_config.get(CONF_METRICS_PORT),
+                metrics_config.get(CONF_METRICS_TEXTFILE),
+                metrics_config.get(
+                    CONF_METRICS_INTERVAL, CONF_METRICS_INTERVAL_DEFAULT
+                ),
+            )
 
     async def shutdown(self):
         """Shutdown application."""
+        if self._metrics is not None:
+            await self._metrics.stop()
         self._api.close()
 
+    def set_tracer(self, tracer: Optional[Tracer]):
+        """Trace the requests of this application, see zigpy_cc.tracing"""
+        self._tracer = tracer
+        if self._api is not None:
+            self._api.set_tracer(tracer)
+
+    def metrics(self) -> str:
+        """Radio and protocol counters in OpenMetrics text format"""
+        return metrics.render(self._api, self)
+
     def connection_lost(self):
         asyncio.create_task(self.reconnect())
 
@@ -90,6 +176,7 @@ class ControllerApplication(zigpy.application.ControllerApplication):
 
         LOGGER.info("Starting zigpy-cc version: %s", __version__)
         self._api = await API.new(self, self._config[CONF_DEVICE])
+        self._api.set_tracer(self._tracer)
 
         try:
             await self._api.request(Subsystem.SYS, "ping", {"capabilities": 1})
@@ -98,10 +185,14 @@ class ControllerApplication(zigpy.application.ControllerApplication):
 
         self.version = await self._api.version()
 
-        concurrent = 16 if self.version["product"] == ZnpVersion.zStack3x0 else 2
+        concurrent = (
+            CONCURRENCY_ZSTACK3X0
+            if self.version["product"] == ZnpVersion.zStack3x0
+            else CONCURRENCY_DEFAULT
+        )
         LOGGER.debug("Adapter concurrent: %d", concurrent)
 
-        self._semaphore = asyncio.Semaphore(concurrent)
+        self._semaphore = AdaptiveSemaphore(concurrent, maximum=concurrent * 2)
 
         ver = ZnpVersion(self.version["product"]).name
         LOGGER.info("Detected znp version '%s' (%s)", ver, self.version)
@@ -116,6 +207,20 @@ class ControllerApplication(zigpy.application.ControllerApplication):
         # add coordinator
         self.devices[self._ieee] = Coordinator(self, self._ieee, self._nwk)
 
+        if self._metrics is not None:
+            await self._metrics.start()
+
+    @property
+    def concurrency(self) -> int:
+        """Number of data requests currently allowed in flight"""
+        return self._semaphore.value
+
+    def _handle_send_status(self, status):
+        if status == 0:
+            self._semaphore.success()
+        elif is_resource_shortage(status):
+            self._semaphore.congested()
+
     async def permit_with_key(self, node, code, time_s=60):
         raise TODO("permit_with_key")
 
@@ -123,6 +228,67 @@ class ControllerApplication(zigpy.application.ControllerApplication):
         """Forcibly remove device from NCP."""
         LOGGER.warning("FORCE REMOVE %s", dev)
 
+    def get_device(self, ieee=None, nwk=None):
+        if ieee is not None:
+            return self.devices[ieee]
+
+        device = self._nwk_index.get(nwk) if nwk is not None else None
+        # devices are replaced by quirks and loaded from the database without
+        # the index noticing, trust an entry only while it is still current
+        if (
+            device is not None
+            and device.nwk == nwk
+            and self.devices.get(device.ieee) is device
+        ):
+            return device
+
+        device = super().get_device(nwk=nwk)
+        self._index_device(device)
+        return device
+
+    def _index_device(self, device: zigpy.device.Device):
+        self._nwk_index[device.nwk] = device
+
+    def _unindex_device(self, device: zigpy.device.Device):
+        if self._nwk_index.get(device.nwk) is device:
+            del self._nwk_index[device.nwk]
+
+    def _update_address(self, ieee, nwk):
+        device = self.devices.get(ieee)
+        if device is None:
+            return
+        if device.nwk != nwk:
+            LOGGER.debug(
+                "Device %s changed id (0x%04x => 0x%04x)", ieee, device.nwk, nwk
+            )
+            self._unindex_device(device)
+            device.nwk = nwk
+        self._index_device(device)
+
+    def add_device(self, ieee, nwk):
+        device = super().add_device(ieee, nwk)
+        self._index_device(device)
+        return device
+
+    def device_initialized(self, device):
+        super().device_initialized(device)
+        # quirks replace the device
+        self._index_device(self.devices[device.ieee])
+
+    def handle_join(self, nwk, ieee, parent_nwk):
+        ieee = zigpy.types.EUI64(ieee)
+        previous = self.devices.get(ieee)
+        if previous is not None:
+            self._unindex_device(previous)
+        super().handle_join(nwk, ieee, parent_nwk)
+        self._index_device(self.devices[ieee])
+
+    async def remove(self, ieee):
+        device = self.devices.get(ieee)
+        await super().remove(ieee)
+        if device is not None:
+            self._unindex_device(device)
+
     async def form_network(self, channel=15, pan_id=None, extended_pan_id=None):
         LOGGER.info("Forming network")
         LOGGER.debug("Config: %s", self.config)
@@ -193,16 +359,14 @@ class ControllerApplication(zigpy.application.ControllerApplication):
             if waiter:
                 waiter_id = waiter.id
 
+            # group sends are broadcasts on the NWK layer
+            await self._broadcast_limiter.acquire()
             async with self._semaphore:
                 await self._api.request_raw(obj, waiter_id)
-                """
-                As a group command is not confirmed and thus immediately returns
-                (contrary to network address requests) we will give the
-                command some time to 'settle' in the network.
-                """
-                await asyncio.sleep(0.2)
+                self._handle_send_status(0)
 
         except CommandError as ex:
+            self._handle_send_status(ex.status)
             return ex.status, "Couldn't enqueue send data multicast: {}".format(ex)
 
         return 0, "message send success"
@@ -219,6 +383,7 @@ class ControllerApplication(zigpy.application.ControllerApplication):
         data,
         expect_reply=True,
         use_ieee=False,
+        priority=None,
     ):
         LOGGER.debug(
             "request %s",
@@ -239,20 +404,64 @@ class ControllerApplication(zigpy.application.ControllerApplication):
             obj = ZpiObject.from_cluster(
                 device.nwk, profile, cluster, src_ep, dst_ep, sequence, data
             )
+            if priority is None:
+                priority = (
+                    Priority.BACKGROUND
+                    if profile == 0 and cluster in BACKGROUND_ZDO_REQUESTS
+                    else Priority.NORMAL
+                )
+            confirm = self._confirm_delivery and obj.command.startswith("dataRequest")
+            waiter = None
             waiter_id = None
-            if expect_reply:
-                waiter = self._api.create_response_waiter(obj, sequence)
+            if expect_reply or confirm:
+                # armed once the adapter took the frame, waiting for a slot
+                # or the lock doesn't count against it
+                waiter = self._api.create_response_waiter(obj, sequence, None)
                 if waiter:
                     waiter_id = waiter.id
 
-            async with self._semaphore:
-                await self._api.request_raw(obj, waiter_id)
+            try:
+                async with self._semaphore:
+                    await self._api.request_raw(obj, waiter_id, priority=priority)
+                    self._handle_send_status(0)
+                    if confirm:
+                        # keep the slot until the frame actually left the radio
+                        return await self._wait_confirm(waiter, sequence)
+                    if waiter is not None:
+                        self._api.arm_waiter(waiter)
+            except BaseException:
+                if waiter is not None and waiter.deadline is None:
+                    self._api.cancel_waiter(waiter)
+                raise
 
         except CommandError as ex:
+            self._handle_send_status(ex.status)
             return ex.status, "Couldn't enqueue send data request: {}".format(ex)
 
         return 0, "message send success"
 
+    async def _wait_confirm(self, waiter, sequence):
+        """(status, message) of the dataConfirm for a sent data request"""
+        self._api.arm_waiter(waiter, self._confirm_timeout * 1000)
+        try:
+            result = await waiter.wait()
+        except asyncio.TimeoutError:
+            return (
+                CONFIRM_TIMEOUT_STATUS,
+                "No confirm for tsn {} within {}s".format(
+                    sequence, self._confirm_timeout
+                ),
+            )
+        status = result.payload["status"]
+        if status != 0:
+            return (
+                status,
+                "Delivery of tsn {} failed with status 0x{:02x}".format(
+                    sequence, status
+                ),
+            )
+        return 0, "message delivered"
+
     async def broadcast(
         self,
         profile,
@@ -292,16 +501,13 @@ class ControllerApplication(zigpy.application.ControllerApplication):
                 addr_mode=AddressMode.ADDR_16BIT,
             )
 
+            await self._broadcast_limiter.acquire()
             async with self._semaphore:
                 await self._api.request_raw(obj)
-                """
-                As a broadcast command is not confirmed and thus immediately returns
-                (contrary to network address requests) we will give the
-                command some time to 'settle' in the network.
-                """
-                await asyncio.sleep(0.2)
+                self._handle_send_status(0)
 
         except CommandError as ex:
+            self._handle_send_status(ex.status)
             return (
                 ex.status,
                 "Couldn't enqueue send data request for broadcast: {}".format(ex),
@@ -320,63 +526,80 @@ class ControllerApplication(zigpy.application.ControllerApplication):
         async with self._semaphore:
             await self._api.request(Subsystem.ZDO, "mgmtPermitJoinReq", payload)
 
+    def _build_handlers(self):
+        handlers = {}
+
+        def add(subsystem, command, handler):
+            cmd = registry.get_command(subsystem, command)
+            handlers[(cmd.subsystem, cmd.id)] = handler
+
+        for subsystem, command in IGNORED:
+            add(subsystem, command, self._ignore)
+        for command in REQUESTS:
+            add(Subsystem.ZDO, command, self._handle_zdo)
+        for command in ADDRESS_RESPONSES:
+            add(Subsystem.ZDO, command, self._handle_address)
+        add(Subsystem.ZDO, "endDeviceAnnceInd", self._handle_device_annce)
+        add(Subsystem.ZDO, "mgmtPermitJoinRsp", self._handle_permit_join_rsp)
+        add(Subsystem.ZDO, "permitJoinInd", self._handle_permit_join_ind)
+        add(Subsystem.AF, "dataConfirm", self._handle_data_confirm)
+        add(Subsystem.AF, "incomingMsg", self._handle_af_incoming)
+        add(Subsystem.AF, "incomingMsgExt", self._handle_af_incoming)
+        return handlers
+
     def handle_znp(self, obj: ZpiObject):
         if obj.command_type != t.CommandType.AREQ:
             return
 
-        frame = obj.to_unpi_frame()
+        handler = self._handlers.get((obj.subsystem, obj.command_id))
+        if handler is not None:
+            handler(obj)
+        elif self._api is None or not self._api.handles(obj):
+            LOGGER.warning(
+                "Unhandled message: %s %s %s",
+                t.CommandType(obj.command_type),
+                t.Subsystem(obj.subsystem),
+                obj.command,
+            )
 
-        nwk = obj.payload["srcaddr"] if "srcaddr" in obj.payload else None
-        ieee = obj.payload["ieeeaddr"] if "ieeeaddr" in obj.payload else None
-        profile_id = zha.PROFILE_ID
-        src_ep = 0
-        dst_ep = 0
-        lqi = 0
-        rssi = 0
+    def _ignore(self, obj: ZpiObject):
+        pass
 
-        if obj.subsystem == t.Subsystem.ZDO and obj.command == "endDeviceAnnceInd":
-            nwk = obj.payload["nwkaddr"]
-            LOGGER.info("New device joined: 0x%04x, %s", nwk, ieee)
-            self.handle_join(nwk, ieee, 0)
-            obj.sequence = 0
+    def _handle_device_annce(self, obj: ZpiObject):
+        nwk = obj.payload["nwkaddr"]
+        ieee = obj.payload["ieeeaddr"]
+        LOGGER.info("New device joined: 0x%04x, %s", nwk, ieee)
+        self.handle_join(nwk, ieee, 0)
+        obj.sequence = 0
+        self._handle_zdo(obj)
 
-        if obj.command in IGNORED:
-            return
+    def _handle_data_confirm(self, obj: ZpiObject):
+        if is_resource_shortage(obj.payload["status"]):
+            self._semaphore.congested()
 
-        if obj.subsystem == t.Subsystem.ZDO and obj.command == "mgmtPermitJoinRsp":
-            self.set_led(LedMode.On)
+    def _handle_address(self, obj: ZpiObject):
+        if obj.payload["status"] == 0:
+            self._update_address(obj.payload["ieeeaddr"], obj.payload["nwkaddr"])
 
-        if obj.subsystem == t.Subsystem.ZDO and obj.command == "permitJoinInd":
-            self.set_led(LedMode.Off if obj.payload["duration"] == 0 else LedMode.On)
-            return
-
-        if obj.subsystem == t.Subsystem.ZDO and obj.command in REQUESTS:
-            if obj.sequence is None:
-                return
-            LOGGER.debug("REPLY for %d %s", obj.sequence, obj.command)
-            cluster_id, prefix_length = REQUESTS[obj.command]
-            tsn = bytes([obj.sequence])
-            data = tsn + frame.data[prefix_length:]
+    def _handle_permit_join_rsp(self, obj: ZpiObject):
+        self.set_led(LedMode.On)
+        self._handle_zdo(obj)
 
-        elif obj.subsystem == t.Subsystem.AF and (
-            obj.command == "incomingMsg" or obj.command == "incomingMsgExt"
-        ):
-            # ZCL commands
-            cluster_id = obj.payload["clusterid"]
-            src_ep = obj.payload["srcendpoint"]
-            dst_ep = obj.payload["dstendpoint"]
-            data = obj.payload["data"]
-            lqi = obj.payload["linkquality"]
+    def _handle_permit_join_ind(self, obj: ZpiObject):
+        self.set_led(LedMode.Off if obj.payload["duration"] == 0 else LedMode.On)
 
-        else:
-            LOGGER.warning(
-                "Unhandled message: %s %s %s",
-                t.CommandType(obj.command_type),
-                t.Subsystem(obj.subsystem),
-                obj.command,
-            )
+    def _handle_zdo(self, obj: ZpiObject):
+        """ZDO response, handed to zigpy as a frame of its ZDO cluster"""
+        if obj.sequence is None:
             return
-
+        LOGGER.debug("REPLY for %d %s", obj.sequence, obj.command)
+        cluster_id, prefix_length = REQUESTS[obj.command]
+        tsn = bytes([obj.sequence])
+        data = tsn + obj.frame_data()[prefix_length:]
+
+        payload = obj.payload
+        nwk = payload["srcaddr"] if "srcaddr" in payload else None
+        ieee = payload["ieeeaddr"] if "ieeeaddr" in payload else None
         try:
             if ieee:
                 device = self.get_device(ieee=ieee)
@@ -388,10 +611,51 @@ class ControllerApplication(zigpy.application.ControllerApplication):
             )
             return
 
-        device.radio_details(lqi, rssi)
+        device.radio_details(0, 0)
 
         LOGGER.info("handle_message %s", obj.command)
-        self.handle_message(device, profile_id, cluster_id, src_ep, dst_ep, data)
+        self.handle_message(device, zha.PROFILE_ID, cluster_id, 0, 0, data)
+
+    def _handle_af_incoming(self, obj: ZpiObject):
+        # ZCL commands, usually delivered by the API's fast path
+        payload = obj.payload
+        if obj.command == "incomingMsgExt":
+            nwk, ieee = source_address(
+                payload["srcaddrmode"], payload["srcaddr"].serialize()
+            )
+        else:
+            nwk, ieee = payload["srcaddr"], None
+        self.handle_incoming(
+            obj.command,
+            nwk,
+            ieee,
+            payload["clusterid"],
+            payload["srcendpoint"],
+            payload["dstendpoint"],
+            payload["linkquality"],
+            payload["data"],
+        )
+
+    def handle_incoming(
+        self, command, nwk, ieee, cluster_id, src_ep, dst_ep, lqi, data
+    ):
+        """ZCL frame from AF incomingMsg or incomingMsgExt"""
+        if self._tracer is not None:
+            trace(self._tracer, TraceEvent.REPLY, command, zcl_tsn(data), nwk)
+
+        try:
+            if ieee is not None:
+                device = self.get_device(ieee=ieee)
+            else:
+                device = self.get_device(nwk=nwk)
+        except KeyError:
+            LOGGER.warning(
+                "Received frame from unknown device: %s", ieee if ieee else nwk
+            )
+            return
+
+        device.radio_details(lqi, 0)
+        self.handle_message(device, zha.PROFILE_ID, cluster_id, src_ep, dst_ep, data)
 
     def set_led(self, mode: LedMode):
         if self.version["product"] != ZnpVersion.zStack3x0:
@@ -399,7 +663,10 @@ class ControllerApplication(zigpy.application.ControllerApplication):
                 loop = asyncio.get_event_loop()
                 loop.create_task(
                     self._api.request(
-                        Subsystem.UTIL, "ledControl", {"ledid": 3, "mode": mode}
+                        Subsystem.UTIL,
+                        "ledControl",
+                        {"ledid": 3, "mode": mode},
+                        priority=Priority.BACKGROUND,
                     )
                 )
             except Exception as ex:
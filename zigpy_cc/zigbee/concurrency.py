@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import logging
+from typing import Deque
+
+LOGGER = logging.getLogger(__name__)
+
+# Z-Stack statuses meaning the adapter ran out of buffers or table entries.
+# Not ZMacChannelAccessFailure (0xE1), that is a busy channel and fewer
+# requests in flight don't make it any quieter
+RESOURCE_STATUSES = frozenset(
+    (
+        0x10,  # ZMemError
+        0x11,  # ZBufferFull
+        0x1A,  # ZMacNoResources
+        0xC7,  # ZNwkTableFull
+        0xF1,  # ZMacTransactionOverFlow
+    )
+)
+
+# Z-Stack defaults: broadcast transaction table size, and how long an entry
+# stays in it (BCAST_DELIVERY_TIME, 30 * 100ms)
+MAX_BCAST = 9
+BCAST_DELIVERY_TIME = 3.0
+
+# ignore further shortages for this long after shrinking the window, one burst
+# of failed frames should only halve it once
+CONGESTION_HOLDOFF = 1.0
+
+
+def is_resource_shortage(status) -> bool:
+    return status in RESOURCE_STATUSES
+
+
+class AdaptiveSemaphore:
+    """
+    Semaphore whose size follows AIMD: every successful request grows it by
+    1 / size (one slot per window of successes), a resource shortage reported
+    by the adapter halves it.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        self._minimum = minimum
+        self._maximum = maximum if maximum is not None else initial
+        self._limit = float(min(max(initial, minimum), self._maximum))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+        self._last_decrease = None
+
+    @property
+    def value(self) -> int:
+        """Current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def locked(self) -> bool:
+        return self._in_flight >= self.value
+
+    def success(self):
+        if self._limit >= self._maximum:
+            return
+        previous = self.value
+        self._limit = min(self._limit + 1 / self._limit, self._maximum)
+        if self.value != previous:
+            LOGGER.debug("Adapter concurrency raised to %d", self.value)
+            self._wake()
+
+    def congested(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if (
+            self._last_decrease is not None
+            and now - self._last_decrease < CONGESTION_HOLDOFF
+        ):
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit / 2, self._minimum)
+        LOGGER.info("Adapter out of resources, concurrency lowered to %d", self.value)
+
+    async def acquire(self) -> bool:
+        if not self._waiters and self._in_flight < self.value:
+            self._in_flight += 1
+            return True
+
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+            elif fut.done() and not fut.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < self.value:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._in_flight += 1
+                fut.set_result(True)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class BroadcastLimiter:
+    """
+    Keeps broadcasts and group sends within the adapter's broadcast transaction
+    table: every broadcast holds one of `capacity` entries until it expires
+    after `expiry` seconds, further broadcasts wait for the oldest entry.
+    """
+
+    def __init__(self, capacity: int = MAX_BCAST, expiry: float = BCAST_DELIVERY_TIME):
+        self.capacity = capacity
+        self.expiry = expiry
+        self._entries: Deque[float] = collections.deque()
+        self._lock = None
+
+    @property
+    def available(self) -> int:
+        self._purge(asyncio.get_event_loop().time())
+        return self.capacity - len(self._entries)
+
+    def _purge(self, now):
+        while self._entries and self._entries[0] <= now:
+            self._entries.popleft()
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            while True:
+                now = loop.time()
+                self._purge(now)
+                if len(self._entries) < self.capacity:
+                    break
+                LOGGER.debug("Broadcast table full, waiting")
+                await asyncio.sleep(self._entries[0] - now)
+            self._entries.append(now + self.expiry)
@@ -7,7 +7,7 @@ from zigpy.zcl.clusters.security import IasZone, IasWd
 
 from zigpy_cc.api import API
 from zigpy_cc.const import Constants
-from zigpy_cc.types import NetworkOptions, Subsystem, ZnpVersion, CommandType
+from zigpy_cc.types import NetworkOptions, Priority, Subsystem, ZnpVersion, CommandType
 from zigpy_cc.exception import CommandError
 from zigpy_cc.zigbee.backup import Restore
 from zigpy_cc.zigbee.common import Common
@@ -70,7 +70,9 @@ async def validate_item(
     command="osalNvRead",
     expected_status=None,
 ):
-    result = await znp.request(subsystem, command, item, None, expected_status)
+    result = await znp.request(
+        subsystem, command, item, None, expected_status, Priority.BACKGROUND
+    )
     if result.payload["value"] != item["value"]:
         msg = "Item '{}' is invalid, got '{}', expected '{}'".format(
             message, result.payload["value"], item["value"]
@@ -116,7 +118,10 @@ async def needsToBeInitialised(znp: API, version, options):
             if version == ZnpVersion.zStack30x or version == ZnpVersion.zStack3x0:
                 # When the panID has never been set, it will be [0xFF, 0xFF].
                 result = await znp.request(
-                    Subsystem.SYS, "osalNvRead", Items.panID(options.panID)
+                    Subsystem.SYS,
+                    "osalNvRead",
+                    Items.panID(options.panID),
+                    priority=Priority.BACKGROUND,
                 )
                 LOGGER.debug("PANID: %s", result.payload["value"])
                 if result.payload["value"] == bytes([0xFF, 0xFF]):
@@ -1,27 +1,9 @@
 from zigpy.profiles import zha
 from zigpy.types import BroadcastAddress
 
-from zigpy_cc import uart
-from zigpy_cc.buffalo import Buffalo, BuffaloOptions
-from zigpy_cc.definition import Definition
-from zigpy_cc.types import CommandType, ParameterType, Subsystem, AddressMode
-
-BufferAndListTypes = [
-    ParameterType.BUFFER,
-    ParameterType.BUFFER8,
-    ParameterType.BUFFER16,
-    ParameterType.BUFFER18,
-    ParameterType.BUFFER32,
-    ParameterType.BUFFER42,
-    ParameterType.BUFFER100,
-    ParameterType.LIST_UINT16,
-    ParameterType.LIST_ROUTING_TABLE,
-    ParameterType.LIST_BIND_TABLE,
-    ParameterType.LIST_NEIGHBOR_LQI,
-    ParameterType.LIST_NETWORK,
-    ParameterType.LIST_ASSOC_DEV,
-    ParameterType.LIST_UINT8,
-]
+from zigpy_cc import registry, uart
+from zigpy_cc.codec import ParameterCodec
+from zigpy_cc.types import COMMAND_TYPES, SUBSYSTEMS, AddressMode, Subsystem
 
 
 class ZpiObject:
@@ -34,59 +16,71 @@ class ZpiObject:
         payload,
         parameters,
         sequence=None,
+        codec: ParameterCodec = None,
+        data=None,
     ):
-        self.command_type = CommandType(command_type)
-        self.subsystem = Subsystem(subsystem)
+        self.command_type = COMMAND_TYPES[command_type]
+        self.subsystem = SUBSYSTEMS[subsystem]
+        if self.command_type is None or self.subsystem is None:
+            raise ValueError(
+                "Unknown command type %d or subsystem %d" % (command_type, subsystem)
+            )
         self.command = command
         self.command_id = command_id
         self.payload = payload
         self.parameters = parameters
         self.sequence = sequence
+        self._codec = codec
+        # UNPI data the object was decoded from
+        self.data = data
 
     def is_reset_command(self):
         return (self.command == "resetReq" and self.subsystem == Subsystem.SYS) or (
             self.command == "systemReset" and self.subsystem == Subsystem.SAPI
         )
 
+    def frame_data(self):
+        """UNPI data of the object, encoded only if it wasn't received"""
+        if self.data is not None:
+            return self.data
+        return self.to_unpi_frame().data
+
     def to_unpi_frame(self):
-        data = Buffalo(b"")
+        codec = self._codec
+        if codec is None:
+            codec = ParameterCodec(self.parameters)
+        data = codec.encode(self.payload)
 
-        for p in self.parameters:
-            value = self.payload[p["name"]]
-            data.write_parameter(p["parameterType"], value, {})
-
-        return uart.UnpiFrame(
-            self.command_type, self.subsystem, self.command_id, data.buffer
-        )
+        return uart.UnpiFrame(self.command_type, self.subsystem, self.command_id, data)
 
     @classmethod
     def from_command(cls, subsystem, command, payload):
-        cmd = next(c for c in Definition[subsystem] if c["name"] == command)
-        parameters = (
-            cmd["response"] if cmd["type"] == CommandType.SRSP else cmd["request"]
-        )
+        cmd = registry.get_command(subsystem, command)
+        parameters = cmd.parameters(cmd.type)
+        codec = cmd.codec(cmd.type)
 
-        return cls(cmd["type"], subsystem, cmd["name"], cmd["ID"], payload, parameters)
+        return cls(
+            cmd.type, subsystem, cmd.name, cmd.id, payload, parameters, codec=codec
+        )
 
     @classmethod
     def from_unpi_frame(cls, frame):
-        cmd = next(
-            c for c in Definition[frame.subsystem] if c["ID"] == frame.command_id
-        )
-        parameters = (
-            cmd["response"]
-            if frame.command_type == CommandType.SRSP
-            else cmd["request"]
+        cmd = registry.get_frame_command(
+            frame.subsystem, frame.command_type, frame.command_id
         )
-        payload = cls.read_parameters(frame.data, parameters)
+        parameters = cmd.parameters(frame.command_type)
+        codec = cmd.codec(frame.command_type)
+        payload = codec.decode(frame.data)
 
         return cls(
             frame.command_type,
             frame.subsystem,
-            cmd["name"],
-            cmd["ID"],
+            cmd.name,
+            cmd.id,
             payload,
             parameters,
+            codec=codec,
+            data=frame.data,
         )
 
     @classmethod
@@ -106,16 +100,15 @@ class ZpiObject:
         if profile == zha.PROFILE_ID:
             subsystem = Subsystem.AF
             if addr_mode is None:
-                cmd = next(c for c in Definition[subsystem] if c["ID"] == 1)
+                cmd = registry.get_command_by_id(subsystem, 1)
             else:
-                cmd = next(c for c in Definition[subsystem] if c["ID"] == 2)
+                cmd = registry.get_command_by_id(subsystem, 2)
         else:
             subsystem = Subsystem.ZDO
-            cmd = next(c for c in Definition[subsystem] if c["ID"] == cluster)
-        name = cmd["name"]
-        parameters = (
-            cmd["response"] if cmd["type"] == CommandType.SRSP else cmd["request"]
-        )
+            cmd = registry.get_command_by_id(subsystem, cluster)
+        name = cmd.name
+        parameters = cmd.parameters(cmd.type)
+        codec = cmd.codec(cmd.type)
 
         if name == "dataRequest":
             payload = {
@@ -149,53 +142,27 @@ class ZpiObject:
                 if nwk == BroadcastAddress.ALL_ROUTERS_AND_COORDINATOR
                 else AddressMode.ADDR_16BIT
             )
-            payload = cls.read_parameters(
-                bytes([addrmode]) + nwk.to_bytes(2, "little") + data[1:], parameters
+            payload = codec.decode(
+                bytes([addrmode]) + nwk.to_bytes(2, "little") + data[1:]
             )
         else:
             # TODO
             # assert sequence == data[0]
-            payload = cls.read_parameters(
-                nwk.to_bytes(2, "little") + data[1:], parameters
-            )
+            payload = codec.decode(nwk.to_bytes(2, "little") + data[1:])
 
         return cls(
-            cmd["type"], subsystem, name, cmd["ID"], payload, parameters, sequence
+            cmd.type, subsystem, name, cmd.id, payload, parameters, sequence, codec
         )
 
     @classmethod
     def read_parameters(cls, data: bytes, parameters):
-        # print(parameters)
-        buffalo = Buffalo(data)
-        res = {}
-        length = None
-        start_index = None
-        for p in parameters:
-            options = BuffaloOptions()
-            name = p["name"]
-            param_type = p["parameterType"]
-            if param_type in BufferAndListTypes:
-                if isinstance(length, int):
-                    options.length = length
-
-                if param_type == ParameterType.LIST_ASSOC_DEV:
-                    if isinstance(start_index, int):
-                        options.startIndex = start_index
-
-            res[name] = buffalo.read_parameter(name, param_type, options)
-
-            # For LIST_ASSOC_DEV, we need to grab the start_index which is
-            # right before the length
-            start_index = length
-            # When reading a buffer, assume that the previous parsed parameter
-            # contains the length of the buffer
-            length = res[name]
-
-        return res
+        return ParameterCodec(parameters).decode(data)
 
     def __repr__(self) -> str:
-        command_type = CommandType(self.command_type).name
-        subsystem = Subsystem(self.subsystem).name
         return "{} {} {} tsn: {} {}".format(
-            command_type, subsystem, self.command, self.sequence, self.payload
+            self.command_type.name,
+            self.subsystem.name,
+            self.command,
+            self.sequence,
+            self.payload,
         )